@@ -0,0 +1,90 @@
+"""Скорость фильтрации и сортировки ApartmentIndex на синтетическом каталоге.
+
+Запуск: python -m benchmarks.bench_apartment_index [--listings 300000]
+"""
+import argparse
+import json
+import random
+import timeit
+from pathlib import Path
+from typing import List
+
+from services.apartment_index import ApartmentIndex, STYLES
+from services.apartment_query import parse_query
+
+DATA_PATH = Path(__file__).parent.parent / "data"
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург", "Сочи", "Самара", "Пермь"]
+QUERIES = [
+    "2 комнаты Москва до 15 млн",
+    "однушка в питере от 30 м2 сначала дешевые",
+    "люкс в москве от 100 м2 сначала дорогие",
+    "снять квартиру в казани до 50 тыс",
+    "3-к 5-10 млн",
+    "квартира",
+]
+
+
+def synthetic_catalog(n: int) -> List[dict]:
+    rng = random.Random(42)
+    with open(DATA_PATH / "apartments.json", 'r', encoding='utf-8') as f:
+        base = json.load(f)
+    catalog = []
+    for i in range(n):
+        apt = dict(rng.choice(base))
+        rooms = rng.randint(1, 5)
+        rental = rng.random() < 0.3
+        apt.update({
+            "address": f"{rng.choice(CITIES)}, ул. Синтетическая, {i}",
+            "rooms": rooms,
+            "area": round(rng.uniform(18, 40) * rooms, 1),
+            "price": rng.randint(20, 300) * 1000 if rental else rng.randint(30, 600) * 100_000,
+            "style": rng.choice(STYLES),
+            "rental": rental,
+        })
+        catalog.append(apt)
+    return catalog
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--listings", type=int, default=300_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    catalog = synthetic_catalog(args.listings)
+    build_seconds = min(timeit.repeat(lambda: ApartmentIndex(catalog), number=1, repeat=3))
+    index = ApartmentIndex(catalog)
+    print(f"{len(index)} listings, index build {build_seconds * 1e3:.0f} ms")
+
+    for text in QUERIES:
+        query = parse_query(text, index.cities)
+        seconds = min(timeit.repeat(lambda: index.search(query, limit=3), number=1, repeat=args.repeat))
+        scan_seconds = min(timeit.repeat(
+            lambda: [apt for apt in catalog if _matches(apt, query)][:3], number=1, repeat=3
+        ))
+        total, _ = index.search(query, limit=3)
+        print(
+            f"  {text!r}: {total} found, index {seconds * 1e3:6.2f} ms, "
+            f"list scan {scan_seconds * 1e3:7.1f} ms (x{scan_seconds / seconds:.0f})"
+        )
+
+
+def _matches(apt: dict, query) -> bool:
+    """Прямой перебор списка словарей — прежний способ работы с каталогом"""
+    for name in ("price", "area", "rooms"):
+        bounds = getattr(query, name)
+        if bounds is not None:
+            low, high = bounds
+            if (low is not None and apt[name] < low) or (high is not None and apt[name] > high):
+                return False
+    if query.city is not None and not apt["address"].startswith(query.city):
+        return False
+    if query.style is not None and apt.get("style") != query.style:
+        return False
+    if query.rental is not None and bool(apt.get("rental", False)) != query.rental:
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    main()
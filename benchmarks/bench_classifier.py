@@ -0,0 +1,228 @@
+"""Скорость и точность каскада IntentClassifier без обращения к модели.
+
+Прогоняет все реплики человека из my_dialogues.txt и размеченные примеры из
+intents.json через IntentClassifier.classify_with_tier и MLService.predict_intent,
+печатает пропускную способность, p50/p95/p99 по уровням каскада и долю
+сообщений, которые ушли бы в AI. Результат сохраняется в JSON для сравнения
+между версиями.
+
+Запуск: python -m benchmarks.bench_classifier [--repeat 3] [--output benchmarks/results/classifier.json]
+        [--compare benchmarks/results/previous.json]
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from services.dialogue_index import iter_dialogue_pairs
+from services.intent_classifier import IntentClassifier, TIER_FALLTHROUGH
+
+DATA_PATH = Path(__file__).parent.parent / "data"
+RESULTS_PATH = Path(__file__).parent / "results"
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """Перцентиль с линейной интерполяцией по отсортированному списку"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def latency_stats(samples: List[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "p50_us": percentile(samples, 0.50) * 1e6,
+        "p95_us": percentile(samples, 0.95) * 1e6,
+        "p99_us": percentile(samples, 0.99) * 1e6,
+        "max_us": (samples[-1] if samples else 0.0) * 1e6,
+    }
+
+
+def load_corpus() -> Tuple[List[str], List[Tuple[str, str]]]:
+    """Реплики человека из диалогов и пары (пример, интент) из intents.json"""
+    messages = []
+    with open(DATA_PATH / "my_dialogues.txt", 'r', encoding='utf-8') as f:
+        for line in f:
+            speaker, _, text = line.partition(":")
+            if speaker.strip().upper() == "H" and text.strip():
+                messages.append(text.strip())
+
+    with open(DATA_PATH / "intents.json", 'r', encoding='utf-8') as f:
+        intents = json.load(f)
+    labeled = [(example, intent) for intent, examples in intents.items() for example in examples]
+    return messages, labeled
+
+
+def bench_classifier(classifier: IntentClassifier, messages: List[str], repeat: int) -> dict:
+    tiers: Dict[str, List[float]] = defaultdict(list)
+    total_seconds = 0.0
+    for _ in range(repeat):
+        for text in messages:
+            started = time.perf_counter()
+            _, _, tier = classifier.classify_with_tier(text)
+            elapsed = time.perf_counter() - started
+            total_seconds += elapsed
+            tiers[tier].append(elapsed)
+
+    calls = len(messages) * repeat
+    all_samples = [sample for samples in tiers.values() for sample in samples]
+    return {
+        "messages": len(messages),
+        "throughput_per_s": calls / total_seconds if total_seconds else 0.0,
+        "latency": latency_stats(all_samples),
+        "tiers": {
+            tier: {"share": len(samples) / calls, **latency_stats(samples)}
+            for tier, samples in sorted(tiers.items())
+        },
+        "llm_share": len(tiers.get(TIER_FALLTHROUGH, [])) / calls if calls else 0.0,
+    }
+
+
+def evaluate_labeled(classifier: IntentClassifier, labeled: List[Tuple[str, str]]) -> dict:
+    """Точность каскада на размеченных примерах (они же обучающие — это проверка, а не оценка обобщения)"""
+    correct = 0
+    for text, intent in labeled:
+        predicted, _, _ = classifier.classify_with_tier(text)
+        correct += predicted == intent
+    return {"examples": len(labeled), "accuracy": correct / len(labeled) if labeled else 0.0}
+
+
+def evaluate_dialogues(classifier: IntentClassifier) -> dict:
+    """Доля реплик, для которых каскад вернул именно ответ бота из корпуса"""
+    pairs = list(iter_dialogue_pairs(DATA_PATH / "my_dialogues.txt"))
+    exact = 0
+    for human, reply in pairs:
+        _, response, _ = classifier.classify_with_tier(human)
+        exact += response == classifier.normalize_response(reply)
+    return {"pairs": len(pairs), "reply_match": exact / len(pairs) if pairs else 0.0}
+
+
+def bench_ml(ml_service, messages: List[str], labeled: List[Tuple[str, str]], repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        for text in messages:
+            started = time.perf_counter()
+            ml_service.predict_intent(text)
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        ml_service.predict_batch(messages)
+    batch_seconds = (time.perf_counter() - started) / repeat
+
+    predictions = ml_service.predict_batch([text for text, _ in labeled])
+    correct = sum(predicted == intent for (predicted, _), (_, intent) in zip(predictions, labeled))
+    return {
+        "single": latency_stats(samples),
+        "single_throughput_per_s": len(samples) / sum(samples) if samples else 0.0,
+        "batch_throughput_per_s": len(messages) / batch_seconds if batch_seconds else 0.0,
+        "labeled_accuracy": correct / len(labeled) if labeled else 0.0,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, previous: dict) -> None:
+    def line(name: str, now: float, before: float, unit: str) -> None:
+        change = (now - before) / before * 100 if before else 0.0
+        print(f"  {name:<28} {before:12.1f} -> {now:12.1f} {unit} ({change:+.1f}%)")
+
+    print(f"Compared with {previous.get('revision') or previous.get('timestamp')}:")
+    now, before = current["classifier"], previous["classifier"]
+    line("throughput", now["throughput_per_s"], before["throughput_per_s"], "msg/s")
+    line("p95", now["latency"]["p95_us"], before["latency"]["p95_us"], "us")
+    line("llm share", now["llm_share"] * 100, before["llm_share"] * 100, "%")
+    for tier, stats in now["tiers"].items():
+        if tier in before["tiers"]:
+            line(f"{tier} p95", stats["p95_us"], before["tiers"][tier]["p95_us"], "us")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="число прогонов корпуса")
+    parser.add_argument("--no-ml", action="store_true", help="без ML-уровня (scikit-learn не нужен)")
+    parser.add_argument("--output", type=Path, default=None, help="куда сохранить JSON с результатами")
+    parser.add_argument("--compare", type=Path, default=None, help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    messages, labeled = load_corpus()
+
+    ml_service = None
+    if not args.no_ml:
+        from services.ml_service import MLService
+        ml_service = MLService()
+
+    started = time.perf_counter()
+    classifier = IntentClassifier(ml_service=ml_service)
+    load_seconds = time.perf_counter() - started
+
+    # Прогрев: первый вызов строит внутренние кэши и не показателен
+    for text in messages[:50]:
+        classifier.classify_with_tier(text)
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "ml_tier": ml_service is not None,
+        "load_seconds": load_seconds,
+        "classifier": bench_classifier(classifier, messages, args.repeat),
+        "labeled": evaluate_labeled(classifier, labeled),
+        "dialogues": evaluate_dialogues(classifier),
+    }
+    if ml_service is not None:
+        results["ml_service"] = bench_ml(ml_service, messages, labeled, args.repeat)
+
+    summary = results["classifier"]
+    print(
+        f"{summary['messages']} messages x {args.repeat}: {summary['throughput_per_s']:.0f} msg/s, "
+        f"p50 {summary['latency']['p50_us']:.1f} us, p95 {summary['latency']['p95_us']:.1f} us, "
+        f"p99 {summary['latency']['p99_us']:.1f} us; reaches LLM: {summary['llm_share'] * 100:.1f}%"
+    )
+    for tier, stats in summary["tiers"].items():
+        print(
+            f"  {tier:<13} {stats['share'] * 100:5.1f}%  p50 {stats['p50_us']:8.1f} us  "
+            f"p95 {stats['p95_us']:8.1f} us  p99 {stats['p99_us']:8.1f} us"
+        )
+    print(
+        f"labeled accuracy {results['labeled']['accuracy'] * 100:.1f}%, "
+        f"dialogue reply match {results['dialogues']['reply_match'] * 100:.1f}%"
+    )
+    if ml_service is not None:
+        ml = results["ml_service"]
+        print(
+            f"MLService: single p50 {ml['single']['p50_us']:.0f} us, "
+            f"{ml['single_throughput_per_s']:.0f} msg/s single vs {ml['batch_throughput_per_s']:.0f} msg/s batch, "
+            f"labeled accuracy {ml['labeled_accuracy'] * 100:.1f}%"
+        )
+
+    if args.compare is not None:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+    output = args.output or RESULTS_PATH / f"classifier-{results['revision'] or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Сравнение автомата Ахо-Корасик с перебором примеров интентов.
+
+Запуск: python -m benchmarks.bench_intent_matcher [--intents 50] [--examples 100]
+"""
+import argparse
+import json
+import random
+import timeit
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from services.intent_matcher import IntentMatcher
+
+DATA_PATH = Path(__file__).parent.parent / "data"
+
+
+def loop_match(intents: Dict[str, List[str]], text: str) -> Optional[str]:
+    """Прежний алгоритм IntentClassifier.classify: перебор всех примеров"""
+    for intent, examples in intents.items():
+        for example in examples:
+            if example in text:
+                return intent
+    return None
+
+
+def synthetic_intents(base: Dict[str, List[str]], n_intents: int, n_examples: int) -> Dict[str, List[str]]:
+    rng = random.Random(42)
+    words = sorted({word for examples in base.values() for example in examples for word in example.split()})
+    words += ["квартира", "дом", "район", "метро", "ипотека", "аренда", "цена", "этаж", "балкон", "ремонт"]
+    intents = dict(base)
+    for i in range(n_intents):
+        intents[f"synthetic_{i}"] = [
+            " ".join(rng.sample(words, 3)) + f" {i}_{j}" for j in range(n_examples)
+        ]
+    return intents
+
+
+def load_messages() -> List[str]:
+    messages = []
+    with open(DATA_PATH / "my_dialogues.txt", 'r', encoding='utf-8') as f:
+        for line in f:
+            speaker, _, text = line.partition(":")
+            if speaker.strip().upper() == "H" and text.strip():
+                messages.append(text.strip().lower())
+    return messages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--intents", type=int, default=50, help="число синтетических интентов")
+    parser.add_argument("--examples", type=int, default=100, help="примеров на синтетический интент")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(DATA_PATH / "intents.json", 'r', encoding='utf-8') as f:
+        base = json.load(f)
+
+    messages = load_messages()
+    for name, intents in [
+        ("intents.json", base),
+        (f"+{args.intents}x{args.examples} synthetic", synthetic_intents(base, args.intents, args.examples)),
+    ]:
+        build_started = timeit.default_timer()
+        matcher = IntentMatcher(intents)
+        build_seconds = timeit.default_timer() - build_started
+
+        loop_seconds = min(timeit.repeat(
+            lambda: [loop_match(intents, text) for text in messages], number=1, repeat=args.repeat
+        ))
+        automaton_seconds = min(timeit.repeat(
+            lambda: [matcher.match(text) for text in messages], number=1, repeat=args.repeat
+        ))
+
+        per_message = 1e6 / len(messages)
+        print(
+            f"{name}: {matcher.patterns} patterns, {len(messages)} messages, build {build_seconds * 1e3:.1f} ms\n"
+            f"  loop:      {loop_seconds * per_message:8.1f} us/message\n"
+            f"  automaton: {automaton_seconds * per_message:8.1f} us/message "
+            f"(x{loop_seconds / automaton_seconds:.1f})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""Локальная заглушка Bot API для нагрузочной проверки бота без Telegram.
+
+Заглушка отвечает на запросы бота (getMe, getUpdates, sendMessage, sendPhoto,
+sendVoice, ...) с заданной задержкой и играет роль пользователей: каждый из
+--users пользователей отправляет --messages сообщений, следующее — через
+--think секунд после первого ответа бота на предыдущее. Обновления отдаются
+через getUpdates или, если бот вызвал setWebhook, отправляются POST-запросом
+на его адрес. В конце печатаются задержка до первого ответа (p50/p95/max),
+пропускная способность и число вызовов методов.
+
+Запуск заглушки: python -m benchmarks.fake_bot_api [--port 8081] [--users 50] [--messages 5]
+                 [--latency 0.05] [--think 1.0] [--flood-every 0] [--output results/fake_api.json]
+Бот (polling):   BOT_API_BASE_URL=http://127.0.0.1:8081/bot TELEGRAM_TOKEN=1:fake python main.py
+Бот (webhook):   то же и BOT_MODE=webhook WEBHOOK_URL=http://127.0.0.1:8443
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.request
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Deque, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+MESSAGES = [
+    "Привет",
+    "2 комнаты Москва до 15 млн",
+    "Сколько стоит ипотека?",
+    "/search однушка Питер",
+    "Спасибо",
+    "Хочу квартиру в аренду",
+]
+# Методы, ответ которыми считается ответом пользователю
+REPLY_METHODS = {"sendMessage", "sendPhoto", "sendMediaGroup", "sendVoice"}
+
+
+class FakeBotAPI:
+    def __init__(self, users: int, messages: int, latency: float, think: float, flood_every: int):
+        self.users = users
+        self.messages = messages
+        self.latency = latency
+        self.think = think
+        self.flood_every = flood_every
+        self.calls: Counter = Counter()
+        self.floods = 0
+        self.latencies: List[float] = []
+        self.webhook_url: Optional[str] = None
+        self.webhook_secret: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished = threading.Event()
+        self._lock = threading.Condition()
+        self._updates: Deque[dict] = deque()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._sends = itertools.count(1)
+        # chat_id -> время отправки сообщения, на которое ещё нет ответа
+        self._waiting: Dict[int, float] = {}
+        self._sent: Dict[int, int] = defaultdict(int)
+        self._pusher = ThreadPoolExecutor(max_workers=32)
+
+    # --- пользователи ---
+
+    def start_users(self) -> None:
+        with self._lock:
+            if self.started_at is not None:
+                return
+            self.started_at = time.perf_counter()
+        for user_id in range(1, self.users + 1):
+            threading.Timer(random.uniform(0, self.think), self._user_message, (user_id,)).start()
+
+    def _user_message(self, user_id: int) -> None:
+        text = random.choice(MESSAGES)
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        update = {"update_id": next(self._update_ids), "message": message}
+        with self._lock:
+            self._waiting[user_id] = time.perf_counter()
+            self._sent[user_id] += 1
+            if self.webhook_url is None:
+                self._updates.append(update)
+                self._lock.notify_all()
+                return
+        self._pusher.submit(self._push, update)
+
+    def _push(self, update: dict) -> None:
+        request = urllib.request.Request(
+            self.webhook_url, data=json.dumps(update).encode("utf-8"), headers={"Content-Type": "application/json"}
+        )
+        if self.webhook_secret:
+            request.add_header("X-Telegram-Bot-Api-Secret-Token", self.webhook_secret)
+        try:
+            urllib.request.urlopen(request, timeout=30).read()
+        except OSError as e:
+            print(f"Webhook push error: {e}")
+
+    def _answered(self, chat_id: int) -> None:
+        with self._lock:
+            sent_at = self._waiting.pop(chat_id, None)
+            if sent_at is None:
+                return
+            self.latencies.append(time.perf_counter() - sent_at)
+            more = self._sent[chat_id] < self.messages
+            if not more and not self._waiting and all(self._sent[u] >= self.messages for u in range(1, self.users + 1)):
+                self.finished.set()
+        if more:
+            threading.Timer(self.think, self._user_message, (chat_id,)).start()
+
+    # --- Bot API ---
+
+    def get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset", 0) or 0)
+        timeout = float(params.get("timeout", 0) or 0)
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._updates and self._updates[0]["update_id"] < offset:
+                self._updates.popleft()
+            while not self._updates and time.monotonic() < deadline:
+                self._lock.wait(deadline - time.monotonic())
+            return list(self._updates)[:int(params.get("limit", 100) or 100)]
+
+    def _message(self, chat_id: int, **fields) -> dict:
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, **fields}
+
+    def call(self, method: str, params: dict):
+        """(ok, результат или (код ошибки, описание, retry_after))"""
+        self.calls[method] += 1
+        if method != "getUpdates" and self.latency:
+            time.sleep(self.latency)
+        chat_id = int(params.get("chat_id", 0) or 0)
+
+        if method in REPLY_METHODS and self.flood_every and next(self._sends) % self.flood_every == 0:
+            with self._lock:
+                self.floods += 1
+            return False, (429, "Too Many Requests: retry after 1", 1)
+
+        if method == "getMe":
+            self.start_users()
+            return True, {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        if method == "setWebhook":
+            with self._lock:
+                self.webhook_url = params.get("url")
+                self.webhook_secret = params.get("secret_token")
+                # Накопленное до регистрации webhook досылается на него
+                pending, self._updates = list(self._updates), deque()
+            for update in pending:
+                self._pusher.submit(self._push, update)
+            return True, True
+        if method == "deleteWebhook":
+            with self._lock:
+                self.webhook_url = None
+            return True, True
+        if method == "getUpdates":
+            return True, self.get_updates(params)
+        if method == "sendMessage":
+            result = self._message(chat_id, text=params.get("text", ""))
+        elif method == "editMessageText":
+            result = self._message(chat_id, text=params.get("text", ""))
+        elif method == "sendPhoto":
+            result = self._message(chat_id, photo=[_file("photo", 1280, 960)])
+        elif method == "sendMediaGroup":
+            media = params.get("media", "[]")
+            count = len(json.loads(media)) if isinstance(media, str) else 1
+            result = [self._message(chat_id, photo=[_file("photo", 1280, 960)]) for _ in range(count)]
+        elif method == "sendVoice":
+            result = self._message(chat_id, voice={**_file("voice"), "duration": 1})
+        elif method == "getFile":
+            result = {**_file("file"), "file_path": "voice/file.ogg"}
+        else:
+            result = True
+
+        if method in REPLY_METHODS:
+            self._answered(chat_id)
+        return True, result
+
+    def report(self) -> dict:
+        elapsed = time.perf_counter() - (self.started_at or time.perf_counter())
+        latencies = sorted(self.latencies)
+        return {
+            "users": self.users,
+            "messages_per_user": self.messages,
+            "answered": len(latencies),
+            "seconds": elapsed,
+            "updates_per_second": len(latencies) / elapsed if elapsed else 0.0,
+            "first_reply_p50_ms": percentile(latencies, 0.50) * 1000,
+            "first_reply_p95_ms": percentile(latencies, 0.95) * 1000,
+            "first_reply_max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+            "flood_responses": self.floods,
+            "calls": dict(self.calls.most_common()),
+        }
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    # Заглушка не импортирует пакеты бота: её можно запускать без его зависимостей
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round((len(sorted_values) - 1) * fraction)))]
+
+
+def _file(kind: str, width: int = 0, height: int = 0) -> dict:
+    unique = f"{kind}{random.getrandbits(48):x}"
+    fields = {"file_id": f"fake-{unique}", "file_unique_id": unique}
+    if width:
+        fields.update(width=width, height=height)
+    return fields
+
+
+def parse_params(handler: BaseHTTPRequestHandler) -> dict:
+    """Параметры запроса Bot API: query string, JSON, form-urlencoded или multipart (файлы пропускаются)"""
+    params = dict(parse_qsl(urlsplit(handler.path).query))
+    length = int(handler.headers.get("Content-Length", 0) or 0)
+    body = handler.rfile.read(length) if length else b""
+    content_type = handler.headers.get("Content-Type", "")
+    if not body:
+        return params
+    if content_type.startswith("application/json"):
+        params.update(json.loads(body))
+    elif content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=policy.default).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+        )
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name and not part.get_filename():
+                params[name] = part.get_content()
+    else:
+        params.update(parse_qsl(body.decode("utf-8")))
+    return params
+
+
+def make_handler(api: FakeBotAPI):
+    class Handler(BaseHTTPRequestHandler):
+        def _handle(self):
+            # /bot<token>/<method>
+            method = urlsplit(self.path).path.rsplit("/", 1)[-1]
+            ok, result = api.call(method, parse_params(self))
+            if ok:
+                payload = {"ok": True, "result": result}
+                status = 200
+            else:
+                status, description, retry_after = result
+                payload = {"ok": False, "error_code": status, "description": description,
+                           "parameters": {"retry_after": retry_after}}
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = _handle
+        do_POST = _handle
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Заглушка Bot API с имитацией пользователей")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=5, help="сообщений на пользователя")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа на каждый вызов, с")
+    parser.add_argument("--think", type=float, default=1.0, help="пауза пользователя после ответа бота, с")
+    parser.add_argument("--flood-every", type=int, default=0, help="каждый N-й ответ пользователю — 429")
+    parser.add_argument("--timeout", type=float, default=600, help="ожидание окончания прогона, с")
+    parser.add_argument("--output", type=Path, default=None, help="сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(args.users, args.messages, args.latency, args.think, args.flood_every)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(api))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Fake Bot API on http://{args.host}:{args.port}/bot — waiting for the bot to call getMe...")
+
+    try:
+        api.finished.wait(args.timeout)
+    except KeyboardInterrupt:
+        pass
+    server.shutdown()
+
+    report = api.report()
+    print(f"Answered {report['answered']}/{args.users * args.messages} messages in {report['seconds']:.1f}s "
+          f"({report['updates_per_second']:.1f}/s)")
+    print(f"First reply: p50={report['first_reply_p50_ms']:.0f}ms p95={report['first_reply_p95_ms']:.0f}ms "
+          f"max={report['first_reply_max_ms']:.0f}ms, 429 sent: {report['flood_responses']}")
+    print("Calls: " + ", ".join(f"{method}={count}" for method, count in report["calls"].items()))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
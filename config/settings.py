@@ -8,13 +8,133 @@ load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 AI_ENABLED = os.getenv("AI_ENABLED", "true").lower() == "true"
 
-# Настройки пользователей
-user_settings = {}
+# Настройки пользователей хранятся в services.settings_store (SQLite, отложенная запись)
+USER_SETTINGS_DB = Path(os.getenv("USER_SETTINGS_DB", str(Path(__file__).parent.parent / "data" / "user_settings.sqlite3")))
+USER_SETTINGS_FLUSH_INTERVAL = float(os.getenv("USER_SETTINGS_FLUSH_INTERVAL", "5"))
+USER_SETTINGS_CACHE_SIZE = int(os.getenv("USER_SETTINGS_CACHE_SIZE", "100000"))
 
 def save_user_setting(user_id, key, value):
-    if user_id not in user_settings:
-        user_settings[user_id] = {}
-    user_settings[user_id][key] = value
+    _settings_store().set(user_id, key, value)
 
 def get_user_settings(user_id):
-    return user_settings.get(user_id, {"ai_mode": False, "voice_mode": False})
+    return _settings_store().get(user_id)
+
+def _settings_store():
+    # Импорт при вызове: пакет services сам импортирует config.settings
+    from services import get_service
+    return get_service("settings_store")
+
+# Настройки AI-воркера (секунды)
+AI_REQUEST_TIMEOUT = float(os.getenv("AI_REQUEST_TIMEOUT", "120"))
+AI_WORKER_START_TIMEOUT = float(os.getenv("AI_WORKER_START_TIMEOUT", "600"))
+
+# Потоковый вывод ответа AI правкой сообщения "Думаю..."
+AI_STREAMING = os.getenv("AI_STREAMING", "true").lower() == "true"
+# Минимальный интервал между правками сообщения (лимиты Telegram на edit)
+AI_STREAM_EDIT_INTERVAL = float(os.getenv("AI_STREAM_EDIT_INTERVAL", "1.0"))
+
+# Очередь запросов к модели
+AI_QUEUE_LIMIT = int(os.getenv("AI_QUEUE_LIMIT", "16"))
+# Новое сообщение пользователя отменяет его предыдущий запрос к модели
+AI_CANCEL_STALE = os.getenv("AI_CANCEL_STALE", "true").lower() == "true"
+
+# Сколько обновлений Telegram обрабатывается одновременно (обновления одного пользователя — по очереди)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
+
+# Получение обновлений: polling (getUpdates) или webhook (локальный HTTP-сервер за прокси)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Публичный адрес, который Telegram вызывает для доставки обновлений
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+# Проверяется по заголовку X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Адрес Bot API: свой telegram-bot-api сервер или локальная заглушка (benchmarks/fake_bot_api.py)
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "")
+BOT_API_BASE_FILE_URL = os.getenv("BOT_API_BASE_FILE_URL", "")
+
+# История диалога с моделью
+AI_HISTORY_MAX_SESSIONS = int(os.getenv("AI_HISTORY_MAX_SESSIONS", "10000"))
+AI_HISTORY_TTL = float(os.getenv("AI_HISTORY_TTL", "1800"))
+AI_HISTORY_MAX_TURNS = int(os.getenv("AI_HISTORY_MAX_TURNS", "10"))
+# Сколько сессий держат снимок KV-кэша в воркере (каждый занимает сотни МБ)
+AI_KV_SESSION_SLOTS = int(os.getenv("AI_KV_SESSION_SLOTS", "2"))
+
+# Каталог для кэшей, переживающих перезапуск
+CACHE_DIR = Path(os.getenv("CACHE_DIR", "cache"))
+
+# Кэш ответов AI
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "true").lower() == "true"
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "2000"))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "86400"))
+AI_CACHE_ON_DISK = os.getenv("AI_CACHE_ON_DISK", "true").lower() == "true"
+AI_CACHE_MAX_DISK_ENTRIES = int(os.getenv("AI_CACHE_MAX_DISK_ENTRIES", "20000"))
+
+# Модель: явный путь или первый *.gguf в каталоге моделей
+AI_MODEL_PATH = os.getenv("AI_MODEL_PATH", "")
+AI_MODELS_DIR = Path(os.getenv("AI_MODELS_DIR", "models"))
+AI_N_THREADS = int(os.getenv("AI_N_THREADS", "8"))
+AI_N_GPU_LAYERS = int(os.getenv("AI_N_GPU_LAYERS", "50"))
+AI_USE_MMAP = os.getenv("AI_USE_MMAP", "true").lower() == "true"
+AI_USE_MLOCK = os.getenv("AI_USE_MLOCK", "false").lower() == "true"
+# Загружать модель в фоне при старте, а не при первом запросе
+AI_WARMUP = os.getenv("AI_WARMUP", "true").lower() == "true"
+
+# Бюджет памяти на сервисы (МБ, 0 — без ограничения), включая процесс модели
+SERVICES_MEMORY_BUDGET_MB = int(os.getenv("SERVICES_MEMORY_BUDGET_MB", "0"))
+
+# Поиск ответа в корпусе диалогов (BM25)
+DIALOGUE_MIN_SCORE = float(os.getenv("DIALOGUE_MIN_SCORE", "0.5"))
+DIALOGUE_MAX_POSTINGS = int(os.getenv("DIALOGUE_MAX_POSTINGS", "1000"))
+
+# Проверка изменений data/* и перезагрузка контента без рестарта (секунды, 0 — выключено)
+CONTENT_RELOAD_INTERVAL = float(os.getenv("CONTENT_RELOAD_INTERVAL", "30"))
+# Пользователи, которым доступны служебные команды (/reload), через запятую
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if user_id}
+
+# ML-классификатор интентов (scikit-learn) после точных совпадений и диалогов
+ML_CLASSIFIER_ENABLED = os.getenv("ML_CLASSIFIER_ENABLED", "true").lower() == "true"
+# Минимальная калиброванная уверенность, при которой ответ идёт без AI
+ML_MIN_CONFIDENCE = float(os.getenv("ML_MIN_CONFIDENCE", "0.6"))
+
+# Каталог квартир: sqlite (на диске, постранично) или memory (столбцы NumPy в памяти)
+CATALOG_BACKEND = os.getenv("CATALOG_BACKEND", "sqlite").lower()
+CATALOG_SOURCE = Path(os.getenv("CATALOG_SOURCE", str(Path(__file__).parent.parent / "data" / "apartments.json")))
+CATALOG_DB_PATH = Path(os.getenv("CATALOG_DB_PATH", str(CACHE_DIR / "catalog.sqlite3")))
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "3"))
+# Готовые HTML-карточки объявлений в памяти
+CARD_CACHE_SIZE = int(os.getenv("CARD_CACHE_SIZE", "10000"))
+
+# Фотографии объявлений (поле image в каталоге)
+LISTING_IMAGES_DIR = Path(os.getenv("LISTING_IMAGES_DIR", str(Path(__file__).parent.parent / "data" / "images")))
+LISTING_PHOTOS = os.getenv("LISTING_PHOTOS", "true").lower() == "true"
+
+# Очередь исходящих сообщений: лимиты Telegram (сообщений в секунду)
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_GROUP_RATE = float(os.getenv("OUTBOX_GROUP_RATE", str(20 / 60)))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+# Сколько раз повторять отправку после RetryAfter
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "5"))
+
+# Кэш синтезированной речи (по хэшу текста) и file_id отправленных голосовых
+TTS_CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", str(CACHE_DIR / "tts")))
+TTS_CACHE_MAX_MB = int(os.getenv("TTS_CACHE_MAX_MB", "200"))
+# Сколько file_id голосовых хранить (самые недавно использованные)
+TTS_CACHE_MAX_FILE_IDS = int(os.getenv("TTS_CACHE_MAX_FILE_IDS", "50000"))
+# Одновременных процессов ffmpeg (конвертация голосовых)
+FFMPEG_MAX_PROCESSES = int(os.getenv("FFMPEG_MAX_PROCESSES", str(os.cpu_count() or 2)))
+
+# Распознавание речи: google (сеть), vosk или whisper (whisper.cpp) — офлайн на CPU
+STT_BACKEND = os.getenv("STT_BACKEND", "google").lower()
+# Каталог модели Vosk или файл ggml-модели whisper.cpp
+STT_MODEL_PATH = os.getenv("STT_MODEL_PATH", "")
+STT_WORKERS = int(os.getenv("STT_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Озвучка длинных ответов: короткая первая голосовая, остальное синтезируется параллельно кусками
+TTS_FIRST_CHUNK_CHARS = int(os.getenv("TTS_FIRST_CHUNK_CHARS", "150"))
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "400"))
+TTS_MAX_PARALLEL = int(os.getenv("TTS_MAX_PARALLEL", "4"))
+# Эндпоинт Prometheus /metrics (0 — выключен); по умолчанию слушает только локальный адрес
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
@@ -1,2 +1,3 @@
 from .text_handler import *
-from .voice_handler import *
\ No newline at end of file
+from .voice_handler import *
+from .admin_handler import *
\ No newline at end of file
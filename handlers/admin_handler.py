@@ -0,0 +1,25 @@
+import asyncio
+import logging
+from telegram import Update
+from telegram.ext import ContextTypes
+from services import get_service
+from config.settings import ADMIN_IDS
+
+logger = logging.getLogger(__name__)
+
+content_reloader = get_service("content_reloader")
+outbox = get_service("outbox")
+
+async def reload_content(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        logger.warning(f"User {user_id} tried to run /reload")
+        return
+
+    chat_id = update.effective_chat.id
+    await outbox.call(chat_id, update.message.reply_text, "🔄 Перезагружаю данные...")
+    reloaded = await asyncio.to_thread(content_reloader.reload_all)
+    if reloaded:
+        await outbox.call(chat_id, update.message.reply_text, f"✅ Обновлено: {', '.join(reloaded)}")
+    else:
+        await outbox.call(chat_id, update.message.reply_text, "⚠️ Ничего не обновлено, подробности в логах")
@@ -1,17 +1,16 @@
 from telegram import Message, Update
 from telegram.ext import ContextTypes
-from services.ai_service import AIService
-from services.voice_service import voice_service
-from services.intent_classifier import IntentClassifier
-from services.response_generator import ResponseGenerator
-from config.settings import user_settings
+from services import get_service
+from config.settings import get_user_settings, save_user_setting
 import logging
 import os
 
 logger = logging.getLogger(__name__)
-intent_classifier = IntentClassifier()
-response_generator = ResponseGenerator()
-ai_service = AIService()
+
+ai_service = get_service("ai_service")
+voice_service = get_service("voice_service")
+intent_classifier = get_service("intent_classifier")
+response_generator = get_service("response_generator")
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -24,14 +23,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def toggle_ai_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    current = user_settings.get_user_settings(user_id).get("ai_mode", False)
-    user_settings.save_user_setting(user_id, "ai_mode", not current)
+    current = get_user_settings(user_id).get("ai_mode", False)
+    save_user_setting(user_id, "ai_mode", not current)
     await update.message.reply_text(f"AI режим {'включен' if not current else 'выключен'}")
 
 async def toggle_voice_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    current = user_settings.get_user_settings(user_id).get("voice_mode", False)
-    user_settings.save_user_setting(user_id, "voice_mode", not current)
+    current = get_user_settings(user_id).get("voice_mode", False)
+    save_user_setting(user_id, "voice_mode", not current)
     await update.message.reply_text(f"Голосовой режим {'включен' if not current else 'выключен'}")
 
 async def search_apartments(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -49,10 +48,10 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not text:  # Защита от пустого сообщения
         return
 
-    settings = user_settings.get_user_settings(user_id)
+    settings = get_user_settings(user_id)
 
-    if settings.get("ai_mode", False) and ai_service.llm:
-        ai_response = ai_service.generate_response(text)
+    if settings.get("ai_mode", False) and ai_service.model_loaded:
+        ai_response = await ai_service.agenerate(text)
         if ai_response:
             await send_response(update, ai_response, user_id)
             return
@@ -73,7 +72,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         await send_response(update, response, user_id)
 
 async def send_response(update: Update, response: str, user_id: int):
-    if user_settings.get_user_settings(user_id).get("voice_mode", False):
+    if get_user_settings(user_id).get("voice_mode", False):
         voice_path = voice_service.text_to_voice(response, user_id)
         if voice_path:
             try:
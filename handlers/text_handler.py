@@ -1,24 +1,44 @@
+import asyncio
+import contextlib
 import random
 import logging
 import os
-from pathlib import Path
-from telegram import Update, ReplyKeyboardRemove
+import time
+from typing import Optional
+from telegram import Update, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import ContextTypes
-from services import ai_service, voice_service, intent_classifier, response_generator
-from config.settings import save_user_setting, get_user_settings
+from services import get_service
+from services.outbox import PRIORITY_RECOMMENDATION
+from services.inference_worker import InferenceError
+from services.llm_scheduler import RequestCancelled, SchedulerBusy
+from services.metrics import metrics
+from config.settings import save_user_setting, get_user_settings, AI_STREAMING, AI_STREAM_EDIT_INTERVAL, LISTING_PHOTOS
 
 logger = logging.getLogger(__name__)
 
+ai_service = get_service("ai_service")
+voice_service = get_service("voice_service")
+intent_classifier = get_service("intent_classifier")
+response_generator = get_service("response_generator")
+outbox = get_service("outbox")
+
 APT_RECOMMEND_PROBABILITY = 0.25
 GENERAL_RECOMMEND_PROBABILITY = 0.1
+# Сколько последних поисков пользователя можно листать кнопками
+SEARCH_HISTORY = 10
+AI_BUSY_TEXT = "⏳ Сейчас много запросов, попробуйте чуть позже."
+AI_WARMING_UP_TEXT = "⏳ AI-помощник ещё просыпается, через минуту смогу ответить подробнее. А пока можно посмотреть /search 🏠"
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
-    await update.message.reply_html(
+    await outbox.call(
+        update.effective_chat.id,
+        update.message.reply_html,
         f"Приветствую, {user.mention_html()}! 👋 Я твой виртуальный помощник по недвижимости.\n\n"
         "<b>🏠 Основные команды:</b>\n"
         "• /start - Начало работы\n"
-        "• /search - Найти квартиры 🔎\n"
+        "• /search - Найти квартиры 🔎 (например, /search 2 комнаты Москва до 15 млн)\n"
         "• /ai_mode - AI-режим\n"
         "• /voice_mode - Голосовой режим\n\n"
         "<i>Просто напиши мне о том, что ищешь, и я подберу лучшие варианты! 😊</i>",
@@ -31,7 +51,9 @@ async def toggle_ai_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     new_mode = not current_settings.get("ai_mode", False)
     
     save_user_setting(user_id, "ai_mode", new_mode)  # Исправлено
-    await update.message.reply_text(f"🤖 AI режим {'включен' if new_mode else 'выключен'}")
+    # Новый AI-режим начинается с чистой истории диалога
+    ai_service.reset_conversation(user_id)
+    await outbox.call(update.effective_chat.id, update.message.reply_text, f"🤖 AI режим {'включен' if new_mode else 'выключен'}")
 
 async def toggle_voice_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
@@ -39,12 +61,64 @@ async def toggle_voice_mode(update: Update, context: ContextTypes.DEFAULT_TYPE)
     new_mode = not current_settings.get("voice_mode", False)
     
     save_user_setting(user_id, "voice_mode", new_mode)  # Исправлено
-    await update.message.reply_text(f"🎤 Голосовой режим {'включен' if new_mode else 'выключен'}")
+    await outbox.call(update.effective_chat.id, update.message.reply_text, f"🎤 Голосовой режим {'включен' if new_mode else 'выключен'}")
 
 async def search_apartments(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    responses = response_generator.generate("apartment")  # Экземпляр из сразу сервиса
-    for response in responses:
-        await send_response(update, context.bot, response)
+    # /search 2 комнаты Москва до 15 млн
+    await _send_search(update, context, " ".join(context.args or []))
+
+async def search_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопки "Назад"/"Далее" под выдачей: запрашивается только одна страница"""
+    callback = update.callback_query
+    try:
+        _, search_id, direction, cursor = callback.data.split(":")
+        cursor = int(cursor)
+    except ValueError:
+        await callback.answer()
+        return
+    
+    text = context.user_data.get("searches", {}).get(search_id)
+    if text is None:
+        await callback.answer("⌛ Подборка устарела, повторите поиск: /search", show_alert=True)
+        return
+    
+    query = response_generator.parse_query(text)
+    if direction == "p":
+        page_text, page = response_generator.search(query, before=cursor)
+    else:
+        page_text, page = response_generator.search(query, after=cursor)
+    await callback.answer()
+    
+    chat_id = callback.message.chat_id
+    albums = context.user_data.setdefault("search_albums", {})
+    old_album = albums.pop(search_id, [])
+    album = await _page_album(page)
+    if not album and not old_album:
+        await _edit_message(
+            context.bot,
+            chat_id,
+            callback.message.message_id,
+            page_text,
+            parse_mode="HTML",
+            reply_markup=_search_keyboard(search_id, page)
+        )
+        return
+    
+    # В альбом нельзя добавить фото или изменить их число: новая страница отправляется
+    # заново (фото над своими карточками), а прежняя удаляется целиком, чтобы фото не копились
+    albums[search_id] = await _send_listing_photos(context.bot, chat_id, page, album)
+    await outbox.send_message(
+        context.bot,
+        chat_id,
+        page_text,
+        coalesce=False,
+        parse_mode="HTML",
+        reply_markup=_search_keyboard(search_id, page)
+    )
+    await asyncio.gather(*(
+        _delete_message(context.bot, chat_id, message_id)
+        for message_id in old_album + [callback.message.message_id]
+    ))
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.message or not update.message.text or not update.message.text.strip():
@@ -59,6 +133,10 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     
     intent, prepared_response = intent_classifier.classify(text, ai_active)
     
+    # "2 комнаты Москва до 15 млн" — поиск по каталогу, а не вопрос к модели
+    if intent == "unknown" and not ai_active and response_generator.parse_search_request(text) is not None:
+        intent = "apartment"
+    
     logger.info(f"Intent: {intent} | Prepared: {bool(prepared_response)}")
     
     if prepared_response:
@@ -69,79 +147,356 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     if ai_active or intent == "unknown":
         logger.info("Using AI processing...")
         
-        # Середаем сообщение "Думаю..."
         chat_id = update.effective_chat.id
-        thinking_msg = await context.bot.send_message(
-            chat_id=chat_id,
-            text="🤔 Думаю...",
+        
+        # Частые вопросы отвечаем из кэша, не обращаясь к модели
+        cached_response = ai_service.cached_response(text, user_id)
+        if cached_response:
+            logger.info("AI response served from cache")
+            await send_response(update, context.bot, _with_recommendation(cached_response))
+            return
+        
+        # Пока модель загружается, не держим пользователя в очереди
+        if ai_service.is_warming_up:
+            await _reply_while_warming_up(update, context, text)
+            return
+        
+        # Середаем сообщение "Думаю..."
+        # Это сообщение потом правится — склеивать с ним другие тексты нельзя
+        thinking_msg = await outbox.send_message(
+            context.bot,
+            chat_id,
+            "🤔 Думаю...",
+            coalesce=False,
             reply_to_message_id=update.message.message_id
         )
         
-        ai_response = ai_service.generate_response(text)
+        try:
+            if AI_STREAMING:
+                ai_response = await _stream_ai_response(context.bot, chat_id, thinking_msg.message_id, text, user_id)
+            else:
+                ai_response = await ai_service.agenerate(text, user_id)
+        except RequestCancelled:
+            # Пользователь уже написал новое сообщение — ответим на него
+            logger.info(f"AI request of user {user_id} superseded")
+            await outbox.call(chat_id, context.bot.delete_message, chat_id=chat_id, message_id=thinking_msg.message_id)
+            return
+        except SchedulerBusy as e:
+            logger.warning(f"AI queue is full: {str(e)}")
+            if not await _edit_message(context.bot, chat_id, thinking_msg.message_id, AI_BUSY_TEXT):
+                await outbox.send_message(context.bot, chat_id, AI_BUSY_TEXT)
+            return
+        except InferenceError as e:
+            logger.error(f"AI generation failed: {str(e)}")
+            ai_response = ""
+        
+        if ai_response:
+            logger.info(f"AI Response: {ai_response[:50]}...")
+            ai_response = _with_recommendation(ai_response)
+            
+            # В потоковом режиме дописываем ответ прямо в сообщение "Думаю..."
+            if AI_STREAMING and await _edit_message(context.bot, chat_id, thinking_msg.message_id, ai_response, parse_mode="HTML"):
+                await send_voice_response(update, context.bot, ai_response)
+                return
         
         # Удаляем сообщение "Думаю..."
-        await context.bot.delete_message(
+        await outbox.call(
+            chat_id,
+            context.bot.delete_message,
             chat_id=chat_id,
             message_id=thinking_msg.message_id
         )
         
         if ai_response:
-            logger.info(f"AI Response: {ai_response[:50]}...")
-            # Добавим рекомендацию квартиры с вероятностью 30%
-            if random.random() < APT_RECOMMEND_PROBABILITY:
-                apartment = response_generator.get_random_apartment()
-                if apartment:
-                    ai_response += f"\n\n✨ Кстати, вот отличный вариант для вас:\n\n{apartment}"
-                    
             await send_response(update, context.bot, ai_response)
             return
         else:
             # Если AI не вернул ответ, отправляем уведомление
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text="❌ Не удалось обработать ваш запрос. Попробуйте сформулировать иначе.",
+            await outbox.send_message(
+                context.bot,
+                chat_id,
+                "❌ Не удалось обработать ваш запрос. Попробуйте сформулировать иначе.",
                 reply_to_message_id=update.message.message_id
             )
             return
     
+    # Поиск квартир — постранично, с кнопками
+    if intent == "apartment":
+        await _send_search(update, context, text)
+        return
+    
     # Обычная обработка для известных intents
-    responses = response_generator.generate(intent)
+    responses = response_generator.generate(intent, text)
     
     # Добавим рекомендацию для обычных ответов
+    recommendation = None
     if random.random() < GENERAL_RECOMMEND_PROBABILITY:
         apartment = response_generator.get_random_apartment()
         if apartment:
-            responses.append(f"\n\n🏠 Рекомендую посмотреть этот вариант:\n\n{apartment}")
+            recommendation = f"🏠 Рекомендую посмотреть этот вариант:\n\n{apartment}"
     
-    for response in responses:
-        await send_response(update, context.bot, response)
+    await send_responses(update, context.bot, responses, recommendation)
+
+
+async def _reply_while_warming_up(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str) -> None:
+    """Быстрый ответ правилами и диалогами, пока AI-модель не готова"""
+    intent, prepared_response = intent_classifier.classify(text)
+    if prepared_response:
+        await send_response(update, context.bot, prepared_response)
+        return
+    
+    responses = response_generator.generate(intent, text) or [AI_WARMING_UP_TEXT]
+    await send_responses(update, context.bot, responses)
+
+
+def _with_recommendation(ai_response: str) -> str:
+    # Добавим рекомендацию квартиры с вероятностью 30%
+    if random.random() < APT_RECOMMEND_PROBABILITY:
+        apartment = response_generator.get_random_apartment()
+        if apartment:
+            ai_response += f"\n\n✨ Кстати, вот отличный вариант для вас:\n\n{apartment}"
+    return ai_response
+
+
+async def _send_search(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str) -> None:
+    query = response_generator.parse_query(text)
+    page_text, page = response_generator.search(query)
+    
+    # Текст запроса хранится у пользователя: в callback_data помещаются только номер поиска и курсор
+    search_id = None
+    if page is not None and (page.has_prev or page.has_next):
+        search_id = _remember_search(context, text)
+    
+    album_ids = await _send_listing_photos(context.bot, update.effective_chat.id, page)
+    if search_id is not None:
+        # При листании альбом этой страницы заменяется альбомом следующей
+        context.user_data.setdefault("search_albums", {})[search_id] = album_ids
+    await outbox.send_message(
+        context.bot,
+        update.effective_chat.id,
+        page_text,
+        parse_mode="HTML",
+        reply_markup=_search_keyboard(search_id, page)
+    )
+    await send_voice_response(update, context.bot, page_text)
+
+
+async def _page_album(page) -> list:
+    """(имя, file_id или путь) фото страницы; ещё не подготовленные фото
+    уменьшаются Pillow в потоке, а не в цикле событий"""
+    if not LISTING_PHOTOS or page is None:
+        return []
+    return await asyncio.to_thread(response_generator.page_photos, page)
+
+
+async def _send_listing_photos(bot, chat_id: int, page, album: Optional[list] = None) -> list:
+    """Фото квартир страницы одним альбомом; загруженные фото отправляются по file_id.
+
+    Возвращает message_id отправленных сообщений альбома.
+    """
+    if album is None:
+        album = await _page_album(page)
+    if not album:
+        return []
+    
+    photos = response_generator.photos
+    for attempt in range(2):
+        media = [InputMediaPhoto(item) for _, item in album]
+        try:
+            if len(media) == 1:
+                messages = [await outbox.call(chat_id, bot.send_photo, chat_id, photo=album[0][1])]
+            else:
+                messages = await outbox.call(chat_id, bot.send_media_group, chat_id, media=media)
+        except BadRequest as e:
+            # Устаревший file_id: забываем его и один раз повторяем с загрузкой файлов
+            reused = [name for name, item in album if isinstance(item, str)]
+            if attempt or not reused:
+                logger.warning(f"Listing photos send error: {str(e)}")
+                return []
+            await asyncio.to_thread(photos.forget, reused)
+            album = await asyncio.to_thread(photos.album, [name for name, _ in album])
+            continue
+        except TelegramError as e:
+            logger.warning(f"Listing photos send error: {str(e)}")
+            return []
+        
+        uploaded = [
+            (name, message.photo[-1].file_id)
+            for (name, item), message in zip(album, messages)
+            if not isinstance(item, str) and message.photo
+        ]
+        if uploaded:
+            # Запись в SQLite — в потоке, чтобы не блокировать цикл событий
+            await asyncio.to_thread(photos.remember, uploaded)
+        return [message.message_id for message in messages]
+    return []
+
+
+async def _delete_message(bot, chat_id: int, message_id: int) -> None:
+    try:
+        # Удаление никто не ждёт: ответы пользователям идут впереди
+        await outbox.call(
+            chat_id, bot.delete_message, chat_id=chat_id, message_id=message_id, priority=PRIORITY_RECOMMENDATION
+        )
+    except TelegramError as e:
+        # Сообщение старше 48 часов или уже удалено пользователем
+        logger.debug(f"Delete message error: {str(e)}")
+
+
+def _remember_search(context: ContextTypes.DEFAULT_TYPE, text: str) -> str:
+    searches = context.user_data.setdefault("searches", {})
+    sequence = context.user_data.get("search_seq", 0) + 1
+    context.user_data["search_seq"] = sequence
+    search_id = str(sequence)
+    searches[search_id] = text
+    albums = context.user_data.setdefault("search_albums", {})
+    while len(searches) > SEARCH_HISTORY:
+        oldest = next(iter(searches))
+        searches.pop(oldest)
+        albums.pop(oldest, None)
+    return search_id
+
+
+def _search_keyboard(search_id: Optional[str], page) -> Optional[InlineKeyboardMarkup]:
+    if search_id is None or page is None:
+        return None
+    buttons = []
+    if page.has_prev:
+        buttons.append(InlineKeyboardButton("◀️ Назад", callback_data=f"search:{search_id}:p:{page.ids[0]}"))
+    if page.has_next:
+        buttons.append(InlineKeyboardButton("Далее ▶️", callback_data=f"search:{search_id}:n:{page.ids[-1]}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+async def _edit_message(bot, chat_id: int, message_id: int, text: str, parse_mode=None, reply_markup=None) -> bool:
+    try:
+        await outbox.call(
+            chat_id,
+            bot.edit_message_text,
+            text,
+            chat_id=chat_id,
+            message_id=message_id,
+            parse_mode=parse_mode,
+            reply_markup=reply_markup
+        )
+        return True
+    except BadRequest as e:
+        # Текст не изменился — это не ошибка
+        if "not modified" in str(e).lower():
+            return True
+        logger.warning(f"Edit message error: {str(e)}")
+    except TelegramError as e:
+        logger.warning(f"Edit message error: {str(e)}")
+    return False
+
+
+async def _stream_ai_response(bot, chat_id: int, message_id: int, text: str, user_id: int) -> str:
+    """Потоковая генерация с постепенной правкой сообщения "Думаю..." """
+    chunks = []
+    shown = ""
+    next_edit_at = 0.0
+    # Правка в очереди outbox: пока она не отправлена, новые не ставятся —
+    # лимиты чата и RetryAfter соблюдает outbox, а генерация его не ждёт
+    pending: Optional[asyncio.Future] = None
+    
+    async for delta in ai_service.astream(text, user_id):
+        chunks.append(delta)
+        now = time.monotonic()
+        if now < next_edit_at or (pending is not None and not pending.done()):
+            continue
+        
+        current = "".join(chunks).strip()
+        if not current or current == shown:
+            continue
+        
+        next_edit_at = now + AI_STREAM_EDIT_INTERVAL
+        # Промежуточный текст без разметки: HTML-теги могут быть ещё не закрыты
+        pending = outbox.call(chat_id, bot.edit_message_text, current + " ▌", chat_id=chat_id, message_id=message_id)
+        pending.add_done_callback(_stream_edit_done)
+        shown = current
+    
+    return "".join(chunks).strip()
+
+
+def _stream_edit_done(future: asyncio.Future) -> None:
+    # Промежуточную правку никто не ждёт: ошибку только логируем
+    if not future.cancelled() and future.exception() is not None:
+        logger.debug(f"Stream edit skipped: {str(future.exception())}")
 
 
 async def send_response(update: Update, bot, text: str) -> None:
-    user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     
     if text:
-        await bot.send_message(chat_id, text, parse_mode="HTML")
+        await outbox.send_message(bot, chat_id, text, parse_mode="HTML")
+    
+    await send_voice_response(update, bot, text)
+
+
+async def send_responses(update: Update, bot, responses: list, recommendation: Optional[str] = None) -> None:
+    """Несколько ответов подряд: тексты встают в очередь разом и уходят одним сообщением,
+    если помещаются; рекомендация отправляется после ответов"""
+    chat_id = update.effective_chat.id
+    texts = [text for text in responses if text]
+    sends = [outbox.send_message(bot, chat_id, text, parse_mode="HTML") for text in texts]
+    if recommendation:
+        texts.append(recommendation)
+        sends.append(
+            outbox.send_message(bot, chat_id, recommendation, parse_mode="HTML", priority=PRIORITY_RECOMMENDATION)
+        )
+    
+    for result in await asyncio.gather(*sends, return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.error(f"Message send error: {str(result)}")
+    
+    for text in texts:
+        await send_voice_response(update, bot, text)
+
+
+async def send_voice_response(update: Update, bot, text: str) -> None:
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
     
     user_settings_data = get_user_settings(user_id)  # Исправлено
     voice_mode_active = user_settings_data.get("voice_mode", False)
     
     if voice_mode_active and text:
         logger.info("Sending voice response...")
-        if voice_path := voice_service.text_to_speech(text, user_id):
-            try:
-                if Path(voice_path).exists():
-                    with open(voice_path, 'rb') as voice_file:
-                        await bot.send_voice(chat_id, voice=voice_file)
-                    logger.info("Voice sent successfully")
-                else:
-                    logger.error(f"Voice file not found: {voice_path}")
-            except Exception as e:
-                logger.error(f"Voice send error: {str(e)}", exc_info=True)
-            finally:
-                try:
-                    if Path(voice_path).exists():
-                        Path(voice_path).unlink()
-                except Exception as e:
-                    logger.error(f"Failed to delete voice file: {str(e)}")
+        started = time.perf_counter()
+        sent = 0
+        # Первая голосовая уходит, пока синтезируется остальной текст
+        # aclosing: при break генератор закрывается сразу и отменяет незавершённый синтез
+        async with contextlib.aclosing(voice_service.text_to_speech(text)) as parts:
+            async for key, voice in parts:
+                if not await _send_voice(bot, chat_id, key, voice):
+                    break
+                if not sent:
+                    first_audio = time.perf_counter() - started
+                    metrics.observe("tts_first_audio_seconds", first_audio)
+                    logger.info(f"Time to first audio: {first_audio:.2f}s")
+                sent += 1
+        if sent:
+            logger.info(f"Voice sent successfully ({sent} parts)")
+
+
+async def _send_voice(bot, chat_id: int, key: str, voice) -> bool:
+    for attempt in range(2):
+        try:
+            # file_id — этот текст уже озвучивался: отправка без синтеза и загрузки
+            message = await outbox.call(chat_id, bot.send_voice, chat_id, voice=voice)
+            if not isinstance(voice, str) and message.voice:
+                await voice_service.remember_voice(key, message.voice.file_id)
+            return True
+        except BadRequest as e:
+            # Устаревший file_id: забываем его и один раз повторяем с аудио из кэша
+            if not attempt and isinstance(voice, str):
+                await voice_service.forget_voice(key)
+                voice = await voice_service.cached_audio(key)
+                if voice is not None:
+                    continue
+            logger.error(f"Voice send error: {str(e)}")
+            return False
+        except Exception as e:
+            logger.error(f"Voice send error: {str(e)}", exc_info=True)
+            return False
+    return False
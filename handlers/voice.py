@@ -1,19 +1,17 @@
 import os
 from telegram import Update
 from telegram.ext import ContextTypes
-from services import ai_service
-from services.intent_classifier import IntentClassifier
-from services.response_generator import ResponseGenerator
-from services.voice_service import voice_service
-from services.ai_service import AIService
-from config.settings import user_settings
+from services import get_service
+from config.settings import get_user_settings
 import logging
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
-intent_classifier = IntentClassifier()
-response_generator = ResponseGenerator()
-ai_service = AIService()
+
+ai_service = get_service("ai_service")
+voice_service = get_service("voice_service")
+intent_classifier = get_service("intent_classifier")
+response_generator = get_service("response_generator")
 
 async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.voice:
@@ -23,7 +21,7 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
     voice_path = f"data/audio/{user_id}_{datetime.now().timestamp()}.ogg"
 
     try:
-        if not user_settings.get_user_settings(user_id).get("voice_mode", False):
+        if not get_user_settings(user_id).get("voice_mode", False):
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text="ℹ Голосовой режим отключен. Включите командой /voice_mode"
@@ -49,8 +47,8 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
 
         # Получаем ответ с проверкой на пустоту
         response = None
-        if user_settings.get_user_settings(user_id).get("ai_mode", False):
-            response = ai_service.generate_response(text) or "Не удалось сгенерировать ответ"
+        if get_user_settings(user_id).get("ai_mode", False):
+            response = await ai_service.agenerate(text) or "Не удалось сгенерировать ответ"
         else:
             intent, dialogue_answer = intent_classifier.process(text)
             if dialogue_answer:
@@ -68,7 +66,7 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
             text=response
         )
 
-        if user_settings.get_user_settings(user_id).get("voice_mode", False):
+        if get_user_settings(user_id).get("voice_mode", False):
             voice_path = voice_service.text_to_voice(response, user_id)
             if voice_path and os.path.exists(voice_path):
                 try:
@@ -99,11 +97,11 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
 async def process_text_directly(text: str, update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка текста с учетом режимов"""
     user_id = update.effective_user.id
-    settings = user_settings.get_user_settings(user_id)
+    settings = get_user_settings(user_id)
 
     # AI-режим
-    if settings.get("ai_mode", False) and ai_service.llm:
-        ai_response = ai_service.generate_response(text)
+    if settings.get("ai_mode", False) and ai_service.model_loaded:
+        ai_response = await ai_service.agenerate(text)
         if ai_response:
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
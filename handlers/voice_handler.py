@@ -1,8 +1,8 @@
 import logging
-from pathlib import Path
 from telegram import Update, Message
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
-from services import voice_service
+from services import get_service
 from config.settings import get_user_settings
 from .text_handler import handle_text
 from datetime import datetime
@@ -10,6 +10,9 @@ import random
 
 logger = logging.getLogger(__name__)
 
+voice_service = get_service("voice_service")
+outbox = get_service("outbox")
+
 class CustomMessage:
     """Класс-обертка для имитации объекта сообщения"""
     def __init__(self, original_message, text):
@@ -46,31 +49,20 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     user_settings_data = get_user_settings(user_id)
 
     if not user_settings_data.get("voice_mode", False):
-        await update.message.reply_text("ℹ️ Для голосового общения активируйте функцию /voice_mode")
+        await outbox.call(update.effective_chat.id, update.message.reply_text, "ℹ️ Для голосового общения активируйте функцию /voice_mode")
         return
 
-    # Создаем временные папки
-    temp_dir = Path("temp") / "downloads"
-    temp_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Скачиваем голосовое сообщение
-    voice_file = await context.bot.get_file(update.message.voice.file_id)
-    audio_path = temp_dir / f"voice_{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.ogg"
-    await voice_file.download_to_drive(audio_path)
-    
-    if not audio_path.exists():
-        logger.error(f"Failed to download voice: {audio_path}")
-        await update.message.reply_text("❌ Не удалось обработать аудио. Попробуйте ещё раз.")
+    # Голосовое скачивается в память и конвертируется через pipe — без временных файлов
+    try:
+        voice_file = await context.bot.get_file(update.message.voice.file_id)
+        audio = bytes(await voice_file.download_as_bytearray())
+    except TelegramError as e:
+        logger.error(f"Failed to download voice: {str(e)}")
+        await outbox.call(update.effective_chat.id, update.message.reply_text, "❌ Не удалось обработать аудио. Попробуйте ещё раз.")
         return
 
     # Конвертируем в текст
-    recognized_text = voice_service.speech_to_text(str(audio_path))
-    
-    # Удаляем временный файл
-    try:
-        audio_path.unlink()
-    except Exception as e:
-        logger.warning(f"Error deleting audio file: {str(e)}")
+    recognized_text = await voice_service.speech_to_text(audio)
 
     if recognized_text:
         logger.info(f"Recognized text: {recognized_text}")
@@ -87,4 +79,4 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         # Обрабатываем как текстовое сообщение
         await handle_text(custom_update, context)
     else:
-        await update.message.reply_text("🔇 Не удалось распознать речь. Пожалуйста, повторите или пишите текстом.")
+        await outbox.call(update.effective_chat.id, update.message.reply_text, "🔇 Не удалось распознать речь. Пожалуйста, повторите или пишите текстом.")
@@ -1,9 +1,20 @@
+import time
+_STARTED_AT = time.perf_counter()
+
+import functools
 import logging
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
-from config.settings import TELEGRAM_TOKEN
-from handlers.text_handler import start, toggle_ai_mode, toggle_voice_mode, search_apartments, handle_text
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, filters
+from config.settings import (
+    TELEGRAM_TOKEN, CONCURRENT_UPDATES, AI_WARMUP, CONTENT_RELOAD_INTERVAL, BOT_MODE, WEBHOOK_URL, WEBHOOK_LISTEN,
+    WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, BOT_API_BASE_URL, BOT_API_BASE_FILE_URL, METRICS_HOST, METRICS_PORT
+)
+from handlers.text_handler import start, toggle_ai_mode, toggle_voice_mode, search_apartments, search_page_callback, handle_text
 from handlers.voice_handler import handle_voice
-from pathlib import Path
+from handlers.admin_handler import reload_content
+from services import get_service, registry
+from services.metrics import metrics, startup_profile
+from services.metrics_server import MetricsServer
+from services.update_processor import PerUserUpdateProcessor
 
 # Настройка логирования
 logging.basicConfig(
@@ -12,28 +23,96 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+ai_service = get_service("ai_service")
+content_reloader = get_service("content_reloader")
+
+def _instrumented(handler: str, callback):
+    """Обработчик с метриками: число обновлений, длительность и ошибки по имени обработчика"""
+    labels = {"handler": handler}
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        metrics.inc("updates_total", labels=labels)
+        try:
+            with metrics.timer("handler_seconds", labels):
+                return await callback(update, context)
+        except Exception:
+            metrics.inc("handler_errors_total", labels=labels)
+            raise
+
+    return wrapper
+
+async def post_init(application: Application) -> None:
+    # Изменения data/* подхватываются без перезапуска бота и модели
+    if CONTENT_RELOAD_INTERVAL > 0:
+        application.create_task(content_reloader.run())
+
 def main() -> None:
+    # Сервисы создаются при импорте обработчиков — вычитаем загрузку их данных из времени импортов
+    data_load_seconds = registry.total_load_seconds()
+    startup_profile.mark("data_load", data_load_seconds)
+    startup_profile.mark("imports", time.perf_counter() - _STARTED_AT - data_load_seconds)
     logger.info("Starting bot initialization...")
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        raise RuntimeError("BOT_MODE=webhook requires WEBHOOK_URL")
     
-    # Создаем папки для временных файлов
-    Path("temp/voices").mkdir(parents=True, exist_ok=True)
-    Path("temp/audio").mkdir(parents=True, exist_ok=True)
-    Path("temp/downloads").mkdir(parents=True, exist_ok=True)
+    # Модель грузится в отдельном процессе, пока бот уже отвечает на сообщения
+    if AI_WARMUP:
+        ai_service.warm_up()
     
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    # Генерация и работа с голосом не должны задерживать обновления других пользователей,
+    # а сообщения одного пользователя обрабатываются в порядке поступления; новое сообщение
+    # сразу отменяет устаревший запрос пользователя к модели
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES, on_message=ai_service.cancel_stale))
+        .post_init(post_init)
+    )
+    if BOT_API_BASE_URL:
+        builder = builder.base_url(BOT_API_BASE_URL)
+    if BOT_API_BASE_FILE_URL:
+        builder = builder.base_file_url(BOT_API_BASE_FILE_URL)
+    application = builder.build()
     
     # Регистрируем обработчики команд
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("ai_mode", toggle_ai_mode))
-    application.add_handler(CommandHandler("voice_mode", toggle_voice_mode))
-    application.add_handler(CommandHandler("search", search_apartments))
+    application.add_handler(CommandHandler("start", _instrumented("start", start)))
+    application.add_handler(CommandHandler("ai_mode", _instrumented("ai_mode", toggle_ai_mode)))
+    application.add_handler(CommandHandler("voice_mode", _instrumented("voice_mode", toggle_voice_mode)))
+    application.add_handler(CommandHandler("search", _instrumented("search", search_apartments)))
+    application.add_handler(CommandHandler("reload", _instrumented("reload", reload_content)))
+    application.add_handler(CallbackQueryHandler(_instrumented("search_page", search_page_callback), pattern=r"^search:"))
     
     # Регистрируем обработчики сообщений
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
-    application.add_handler(MessageHandler(filters.VOICE, handle_voice))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, _instrumented("text", handle_text)))
+    application.add_handler(MessageHandler(filters.VOICE, _instrumented("voice", handle_voice)))
+    
+    if METRICS_PORT > 0:
+        MetricsServer(METRICS_HOST, METRICS_PORT).start()
     
-    logger.info("All handlers registered. Starting polling...")
-    application.run_polling()
+    logger.info(f"Startup profile: {startup_profile.summary()}")
+    registry.log_memory_report()
+    try:
+        if BOT_MODE == "webhook":
+            # Требует python-telegram-bot[webhooks]; TLS завершается на прокси перед ботом
+            logger.info(f"All handlers registered. Starting webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}...")
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET or None
+            )
+        else:
+            logger.info("All handlers registered. Starting polling...")
+            application.run_polling()
+    finally:
+        ai_service.shutdown()
+        if registry.is_loaded("voice_service"):
+            registry.get("voice_service").stt.close()
+        # Несохранённые изменения настроек пользователей записываются перед выходом
+        if registry.is_loaded("settings_store"):
+            registry.get("settings_store").close()
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,129 @@
-from .ai_service import AIService
-from .voice_service import VoiceService
-from .intent_classifier import IntentClassifier
-from .response_generator import ResponseGenerator
-
-# Создаем экземпляры сервисов
-ai_service = AIService()
-voice_service = VoiceService()
-intent_classifier = IntentClassifier()  
-response_generator = ResponseGenerator()
+from .registry import ServiceRegistry, process_rss_bytes
+from pathlib import Path
+from .metrics import metrics as metrics_registry
+from config.settings import (
+    SERVICES_MEMORY_BUDGET_MB, CONTENT_RELOAD_INTERVAL, CACHE_DIR, ML_CLASSIFIER_ENABLED, CATALOG_SOURCE,
+    USER_SETTINGS_DB, USER_SETTINGS_FLUSH_INTERVAL, USER_SETTINGS_CACHE_SIZE,
+    OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_GROUP_RATE, OUTBOX_GLOBAL_RATE, OUTBOX_MAX_RETRIES
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Единый реестр: каждый сервис создаётся один раз на процесс при первом обращении.
+# Классы сервисов импортируются в фабриках: импорт services.<модуль> (бенчмарки,
+# утилиты) не тянет за собой gTTS, распознавание речи и python-telegram-bot
+registry = ServiceRegistry(memory_budget_mb=SERVICES_MEMORY_BUDGET_MB)
+
+
+def _create_ml_service():
+    # scikit-learn импортируется только при первом обращении к ML-сервису
+    from .ml_service import MLService
+    return MLService(model_path=CACHE_DIR / "intent_model.joblib")
+
+
+def _create_ai_service():
+    from .ai_service import AIService
+    return AIService()
+
+
+def _create_voice_service():
+    from .voice_service import VoiceService
+    return VoiceService()
+
+
+def _create_response_generator():
+    from .response_generator import ResponseGenerator
+    return ResponseGenerator()
+
+
+def _create_intent_classifier():
+    from .intent_classifier import IntentClassifier
+    ml = None
+    if ML_CLASSIFIER_ENABLED:
+        try:
+            ml = registry.get("ml_service")
+        except ImportError as e:
+            logger.warning(f"ML intent tier disabled: {e}")
+        except Exception as e:
+            # Битый intents.json или файл модели не должен мешать запуску: каскад работает без ML
+            logger.error(f"ML intent tier disabled, model failed to load: {str(e)}", exc_info=True)
+    return IntentClassifier(ml_service=ml)
+
+
+def _create_content_reloader():
+    from .content_reloader import ContentReloader
+    # Перезагружаются только уже созданные сервисы: незагруженный прочитает свежие данные сам
+    data_path = Path(__file__).parent.parent / "data"
+
+    def reload_ml():
+        if registry.is_loaded("ml_service"):
+            return registry.get("ml_service").reload()
+
+    def reload_classifier():
+        if registry.is_loaded("intent_classifier"):
+            return registry.get("intent_classifier").reload()
+
+    def reload_catalog():
+        if registry.is_loaded("response_generator"):
+            return registry.get("response_generator").reload()
+
+    return ContentReloader(CONTENT_RELOAD_INTERVAL, [
+        ("ml_service", [data_path / "intents.json"], reload_ml),
+        ("intent_classifier", [data_path / "intents.json", data_path / "my_dialogues.txt"], reload_classifier),
+        ("response_generator", [CATALOG_SOURCE], reload_catalog),
+    ])
+
+
+def _create_settings_store():
+    from .settings_store import UserSettingsStore
+    return UserSettingsStore(
+        USER_SETTINGS_DB,
+        flush_interval=USER_SETTINGS_FLUSH_INTERVAL,
+        cache_size=USER_SETTINGS_CACHE_SIZE,
+        legacy_json=Path(__file__).parent.parent / "data" / "user_settings.json"
+    )
+
+
+def _create_outbox():
+    from .outbox import Outbox
+    return Outbox(
+        chat_rate=OUTBOX_CHAT_RATE,
+        chat_burst=OUTBOX_CHAT_BURST,
+        group_rate=OUTBOX_GROUP_RATE,
+        global_rate=OUTBOX_GLOBAL_RATE,
+        max_retries=OUTBOX_MAX_RETRIES
+    )
+
+
+def _collect_runtime_metrics(m) -> None:
+    """Значения, которые считаются только при выгрузке /metrics"""
+    m.set_gauge("process_resident_bytes", process_rss_bytes())
+    for name, resident in registry.memory_report().items():
+        m.set_gauge("service_resident_bytes", resident, {"service": name})
+    for cache, hit_counters in (
+        ("response_cache", ("response_cache_hits_total",)),
+        ("card_cache", ("card_cache_hits_total",)),
+        # Отправка по file_id — тоже попадание: синтез и загрузка не нужны
+        ("tts_cache", ("tts_cache_hits_total", "tts_cache_file_id_hits_total")),
+    ):
+        hits = sum(m.counter(name) for name in hit_counters)
+        total = hits + m.counter(f"{cache}_misses_total")
+        m.set_gauge("cache_hit_ratio", hits / total if total else 0.0, {"cache": cache})
+
+
+registry.register("ai_service", _create_ai_service)
+registry.register("voice_service", _create_voice_service)
+registry.register("intent_classifier", _create_intent_classifier)
+registry.register("response_generator", _create_response_generator)
+registry.register("ml_service", _create_ml_service)
+registry.register("content_reloader", _create_content_reloader)
+registry.register("settings_store", _create_settings_store)
+registry.register("outbox", _create_outbox)
+metrics_registry.add_collector(_collect_runtime_metrics)
+
+
+def get_service(name: str):
+    """Экземпляр сервиса из реестра; имена сервисов совпадают с именами их модулей,
+    поэтому сами модули (services.ai_service и т. п.) остаются доступны для импорта"""
+    return registry.get(name)
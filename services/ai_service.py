@@ -1,92 +1,258 @@
-import os
+import hashlib
+import json
 import threading
+import time
 from pathlib import Path
-from llama_cpp import Llama
+from typing import AsyncIterator, List, Optional
 import logging
-from config.settings import AI_ENABLED
+from config.settings import (
+    AI_ENABLED, AI_REQUEST_TIMEOUT, AI_WORKER_START_TIMEOUT, AI_QUEUE_LIMIT, AI_CANCEL_STALE,
+    AI_HISTORY_MAX_SESSIONS, AI_HISTORY_TTL, AI_HISTORY_MAX_TURNS, AI_KV_SESSION_SLOTS,
+    AI_CACHE_ENABLED, AI_CACHE_MAX_ENTRIES, AI_CACHE_TTL, AI_CACHE_ON_DISK, AI_CACHE_MAX_DISK_ENTRIES, CACHE_DIR,
+    AI_MODEL_PATH, AI_MODELS_DIR, AI_N_THREADS, AI_N_GPU_LAYERS, AI_USE_MMAP, AI_USE_MLOCK
+)
+from .conversation_memory import ConversationMemory, estimate_tokens
+from .inference_worker import InferenceWorker
+from .response_cache import ResponseCache
+from .llm_scheduler import LLMScheduler
+from .metrics import startup_profile
+from .registry import process_rss_bytes
 
 logger = logging.getLogger(__name__)
 
+def discover_model_path() -> Optional[Path]:
+    """Путь к модели из AI_MODEL_PATH или первый *.gguf в каталоге моделей"""
+    if AI_MODEL_PATH:
+        path = Path(AI_MODEL_PATH)
+        if path.exists():
+            return path
+        logger.error(f"Файл модели не найден: {path}")
+        return None
+
+    candidates = sorted(AI_MODELS_DIR.glob("*.gguf"))
+    if not candidates:
+        logger.error(f"В каталоге {AI_MODELS_DIR} нет моделей *.gguf")
+        return None
+    return candidates[0]
+
 class AIService:
     _lock = threading.Lock()
+
+    SYSTEM_PROMPT = (
+        "Ты Квартирка — профессиональный, дружелюбный консультант по недвижимости.\n"
+        "ПРАВИЛА:\n"
+        "1. Отвечай кратко (1-2 предложения)\n"
+        "2. Используй эмодзи для выразительности 😊\n"
+        "3. Задавай вопросы о предпочтениях клиента\n"
+        "4. Каждые 3-5 реплик предлагай квартиры\n"
+        "5. Начинай каждое предложение с большой буквы\n\n"
+        "Пример диалога:\n"
+        "User: Привет\n"
+        "You: Привет! 😊 Готов помочь найти идеальное жильё! Что интересует?"
+    )
+
+    N_CTX = 4096
+    # Запас на служебные токены шаблона чата
+    TEMPLATE_OVERHEAD_TOKENS = 64
+
+    GENERATION_PARAMS = {
+        "max_tokens": 384,
+        "temperature": 0.7,
+        "top_p": 0.9,
+        "stop": ["<|end_of_text|>"]
+    }
     
     def __init__(self):
-        self.llm = None
-        self.model_loaded = False
+        self.worker: Optional[InferenceWorker] = None
+        self.model_path = discover_model_path() if AI_ENABLED else None
+        self._first_token_recorded = False
+        # Модель одна и обрабатывает запросы последовательно
+        self.scheduler = LLMScheduler(
+            concurrency=1,
+            max_queue=AI_QUEUE_LIMIT,
+            cancel_stale=AI_CANCEL_STALE
+        )
+        self.memory = ConversationMemory(
+            max_sessions=AI_HISTORY_MAX_SESSIONS,
+            ttl=AI_HISTORY_TTL,
+            max_turns=AI_HISTORY_MAX_TURNS
+        )
+        self.cache: Optional[ResponseCache] = None
+        if AI_CACHE_ENABLED:
+            self.cache = ResponseCache(
+                version=self._cache_version(),
+                max_entries=AI_CACHE_MAX_ENTRIES,
+                ttl=AI_CACHE_TTL,
+                disk_path=CACHE_DIR / "ai_responses.sqlite3" if AI_CACHE_ON_DISK else None,
+                max_disk_entries=AI_CACHE_MAX_DISK_ENTRIES
+            )
+
+    @property
+    def model_loaded(self) -> bool:
+        return self.worker is not None and self.worker.is_ready
 
-    def _load_model(self):
+    @property
+    def is_warming_up(self) -> bool:
+        """Модель загружается в фоне — запросы к ней пока будут ждать"""
+        return self.worker is not None and self.worker.is_starting
+
+    def _get_worker(self) -> Optional[InferenceWorker]:
         with self._lock:
-            if self.llm or self.model_loaded:
-                return
-                
-            try:
-                if not AI_ENABLED:
-                    logger.info("AI отключен в настройках")
-                    return
+            if self.worker:
+                return self.worker
                 
-                model_path = "models/saiga_llama3_8b_ggml-model-q8_0.gguf"
-                if not Path(model_path).exists():
-                    logger.error("Файл модели не найден")
-                    return
-
-                logger.info("Загрузка AI модели...")
-                self.llm = Llama(
-                    model_path=model_path,
-                    n_ctx=4096,
-                    n_threads=8,
-                    chat_format="llama-3",
-                    n_gpu_layers=50,
-                    verbose=False
-                )
-                self.model_loaded = True
-                logger.info("Модель успешно загружена!")
-            except Exception as e:
-                logger.error(f"Ошибка загрузки модели: {str(e)}", exc_info=True)
-
-    def generate_response(self, prompt: str) -> str:
-        if not AI_ENABLED or not prompt.strip():
-            return ""
-            
-        if not self.model_loaded:
-            self._load_model()
+            if not AI_ENABLED:
+                logger.info("AI отключен в настройках")
+                return None
             
-        if not self.llm:
-            return ""
-            
-        try:
-            system_prompt = (
-                "Ты Квартирка — профессиональный, дружелюбный консультант по недвижимости.\n"
-                "ПРАВИЛА:\n"
-                "1. Отвечай кратко (1-2 предложения)\n"
-                "2. Используй эмодзи для выразительности 😊\n"
-                "3. Задавай вопросы о предпочтениях клиента\n"
-                "4. Каждые 3-5 реплик предлагай квартиры\n"
-                "5. Начинай каждое предложение с большой буквы\n\n"
-                "Пример диалога:\n"
-                "User: Привет\n"
-                "You: Привет! 😊 Готов помочь найти идеальное жильё! Что интересует?"
-            )
+            if not self.model_path:
+                return None
 
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ]
-            
-            response = self.llm.create_chat_completion(
-                messages=messages,
-                max_tokens=384,
-                temperature=0.7,
-                top_p=0.9,
-                stop=["<|end_of_text|>"]
+            logger.info(f"Запуск AI воркера с моделью {self.model_path}...")
+            self.worker = InferenceWorker(
+                model_kwargs={
+                    "model_path": str(self.model_path),
+                    "n_ctx": self.N_CTX,
+                    "n_threads": AI_N_THREADS,
+                    "chat_format": "llama-3",
+                    "n_gpu_layers": AI_N_GPU_LAYERS,
+                    "use_mmap": AI_USE_MMAP,
+                    "use_mlock": AI_USE_MLOCK,
+                    "verbose": False
+                },
+                request_timeout=AI_REQUEST_TIMEOUT,
+                start_timeout=AI_WORKER_START_TIMEOUT,
+                # Системный промпт постоянен — его KV-кэш считается один раз
+                prefix_messages=[{"role": "system", "content": self.SYSTEM_PROMPT}],
+                session_slots=AI_KV_SESSION_SLOTS
             )
+            return self.worker
+
+    def resident_bytes(self) -> int:
+        """Память процесса-воркера с моделью"""
+        pid = self.worker.pid if self.worker else None
+        return process_rss_bytes(pid) if pid else 0
+
+    def warm_up(self) -> None:
+        """Запускает загрузку модели в фоне, не дожидаясь первого запроса"""
+        worker = self._get_worker()
+        if worker:
+            worker.start()
+
+    def shutdown(self) -> None:
+        if self.worker:
+            self.worker.stop()
+        if self.cache:
+            self.cache.close()
+
+    def _cache_version(self) -> str:
+        """Версия ответов: меняется вместе с моделью, промптом и параметрами генерации"""
+        fingerprint = json.dumps(
+            [self.model_path.name if self.model_path else "", self.SYSTEM_PROMPT, self.GENERATION_PARAMS],
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:16]
+
+    def cached_response(self, prompt: str, user_id: Optional[int] = None) -> Optional[str]:
+        """Готовый ответ из кэша для вопроса вне контекста диалога"""
+        if not self.cache or not AI_ENABLED:
+            return None
+        # Ответ на реплику внутри диалога зависит от истории — кэшировать его нельзя
+        if user_id is not None and self.memory.history(user_id, self.N_CTX):
+            return None
+
+        response = self.cache.get(prompt)
+        if response and user_id is not None:
+            self.memory.append(user_id, prompt, response)
+        return response
+
+    def _history_budget(self, prompt: str) -> int:
+        """Сколько токенов истории помещается в контекст вместе с новым вопросом и ответом"""
+        reserved = (
+            estimate_tokens(self.SYSTEM_PROMPT)
+            + estimate_tokens(prompt)
+            + self.GENERATION_PARAMS["max_tokens"]
+            + self.TEMPLATE_OVERHEAD_TOKENS
+        )
+        return max(0, self.N_CTX - reserved)
+
+    def _build_messages(self, prompt: str, user_id: Optional[int] = None) -> List[dict]:
+        history = []
+        if user_id is not None:
+            history = self.memory.history(user_id, self._history_budget(prompt))
+        return [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            *history,
+            {"role": "user", "content": prompt}
+        ]
+
+    def reset_conversation(self, user_id: int) -> None:
+        self.memory.reset(user_id)
+
+    def cancel_stale(self, user_id: int) -> None:
+        """Новое сообщение пользователя: его ожидающий или идущий запрос к модели больше не нужен"""
+        self.scheduler.cancel(user_id)
+
+    @staticmethod
+    def _capitalize(text: str) -> str:
+        # Гарантируем первую заглавную букву
+        if text and text[0].islower():
+            return text[0].upper() + text[1:]
+        return text
+
+    async def astream(self, prompt: str, user_id: Optional[int] = None) -> AsyncIterator[str]:
+        """Потоковая генерация ответа: фрагменты текста по мере появления токенов.
+
+        Таймауты и падения воркера пробрасываются как InferenceError,
+        переполнение очереди — как SchedulerBusy, отмена новым сообщением — как RequestCancelled.
+        """
+        if not AI_ENABLED or not prompt.strip():
+            return
             
-            content = response['choices'][0]['message']['content'].strip()
+        worker = self._get_worker()
+        if not worker:
+            return
             
-            # Гарантируем первую заглавную букву
-            if content and content[0].islower():
-                content = content[0].upper() + content[1:]
-                
-            return content
-        except Exception as e:
-            logger.error(f"Ошибка генерации: {str(e)}", exc_info=True)
-            return ""
+        messages = self._build_messages(prompt, user_id)
+        # Только системный промпт и вопрос — ответ можно переиспользовать
+        standalone = len(messages) == 2
+        stats = {}
+        chunks = []
+        requested_at = time.perf_counter()
+        async for delta in self.scheduler.stream(
+            user_id,
+            lambda: worker.stream(messages, session=user_id, stats=stats, **self.GENERATION_PARAMS)
+        ):
+            if not chunks:
+                delta = self._capitalize(delta.lstrip())
+                if not delta:
+                    continue
+                if not self._first_token_recorded:
+                    self._first_token_recorded = True
+                    startup_profile.mark("first_token", time.perf_counter() - requested_at)
+                    logger.info(f"Startup profile: {startup_profile.summary()}")
+            chunks.append(delta)
+            yield delta
+
+        answer = "".join(chunks).strip()
+        if answer and standalone and self.cache:
+            self.cache.put(prompt, answer)
+        if user_id is not None and answer:
+            self.memory.append(
+                user_id,
+                prompt,
+                answer,
+                user_tokens=stats.get("user_tokens"),
+                answer_tokens=stats.get("completion_tokens")
+            )
+
+    async def agenerate(self, prompt: str, user_id: Optional[int] = None) -> str:
+        """Генерация ответа в процессе-воркере.
+
+        Таймауты и падения воркера пробрасываются как InferenceError.
+        """
+        chunks = []
+        async for delta in self.astream(prompt, user_id):
+            chunks.append(delta)
+        return "".join(chunks).strip()
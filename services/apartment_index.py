@@ -0,0 +1,158 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from .apartment_query import ApartmentQuery
+from .catalog import CatalogPage, city_of
+from .listing_cards import dedup_records
+
+logger = logging.getLogger(__name__)
+
+STYLES = ("luxury", "standard", "budget")
+
+
+class ApartmentIndex:
+    """Каталог квартир в виде столбцов NumPy с отсортированными индексами.
+
+    Для каждого числового столбца хранится перестановка, упорядочивающая его
+    значения, и сами значения в этом порядке. Диапазонный фильтр — два
+    searchsorted и срез, равенство по городу/стилю — сравнение кодов, а
+    сортировка выдачи — проход по готовой перестановке с маской, без argsort
+    найденных строк на каждый запрос.
+    """
+
+    NUMERIC = ("price", "area", "rooms")
+
+    def __init__(self, apartments: Iterable[dict]):
+        # Повторяющиеся объявления отбрасываются по хэшу содержимого
+        unique = list(dedup_records(apartments))
+        self.hashes: List[str] = [digest for digest, _ in unique]
+        self.apartments: List[dict] = [record for _, record in unique]
+        n = len(self.apartments)
+
+        self.columns: Dict[str, np.ndarray] = {
+            "price": np.fromiter((apt.get("price", 0) for apt in self.apartments), dtype=np.int64, count=n),
+            "area": np.fromiter((apt.get("area", 0) for apt in self.apartments), dtype=np.float32, count=n),
+            "rooms": np.fromiter((apt.get("rooms", 0) for apt in self.apartments), dtype=np.int16, count=n),
+        }
+        self.rental = np.fromiter((bool(apt.get("rental", False)) for apt in self.apartments), dtype=bool, count=n)
+
+        self.cities: List[str] = sorted({city_of(apt) for apt in self.apartments})
+        city_codes = {city: code for code, city in enumerate(self.cities)}
+        self.city_codes = np.fromiter((city_codes[city_of(apt)] for apt in self.apartments), dtype=np.int32, count=n)
+        style_codes = {style: code for code, style in enumerate(STYLES)}
+        self.style_codes = np.fromiter(
+            (style_codes.get(apt.get("style", "standard"), -1) for apt in self.apartments), dtype=np.int8, count=n
+        )
+
+        self._order: Dict[str, np.ndarray] = {}
+        self._sorted: Dict[str, np.ndarray] = {}
+        # Место каждой строки в перестановке — для курсора страницы без поиска по выдаче
+        self._rank: Dict[str, np.ndarray] = {}
+        for name, values in self.columns.items():
+            order = np.argsort(values, kind="stable")
+            self._order[name] = order
+            self._sorted[name] = values[order]
+            rank = np.empty(n, dtype=np.int64)
+            rank[order] = np.arange(n)
+            self._rank[name] = rank
+
+    def __len__(self) -> int:
+        return len(self.apartments)
+
+    def _range_mask(self, name: str, low, high) -> np.ndarray:
+        values = self._sorted[name]
+        start = np.searchsorted(values, low, side="left") if low is not None else 0
+        end = np.searchsorted(values, high, side="right") if high is not None else len(values)
+        mask = np.zeros(len(values), dtype=bool)
+        mask[self._order[name][start:end]] = True
+        return mask
+
+    def filter_mask(self, query: ApartmentQuery) -> np.ndarray:
+        mask = np.ones(len(self.apartments), dtype=bool)
+        for name in self.NUMERIC:
+            bounds = getattr(query, name)
+            if bounds is not None:
+                mask &= self._range_mask(name, *bounds)
+        if query.city is not None:
+            if query.city not in self.cities:
+                mask[:] = False
+            else:
+                mask &= self.city_codes == self.cities.index(query.city)
+        if query.style is not None:
+            mask &= self.style_codes == (STYLES.index(query.style) if query.style in STYLES else -2)
+        if query.rental is not None:
+            mask &= self.rental == query.rental
+        return mask
+
+    def _sort_order(self, sort: str) -> np.ndarray:
+        order = self._order[sort.lstrip("-")]
+        return order[::-1] if sort.startswith("-") else order
+
+    def _ordered_ids(self, mask: np.ndarray, sort: Optional[str]) -> np.ndarray:
+        if sort:
+            order = self._sort_order(sort)
+            return order[mask[order]]
+        return np.flatnonzero(mask)
+
+    def search(
+        self,
+        query: ApartmentQuery,
+        limit: int = 3,
+        offset: int = 0,
+        sort: Optional[str] = None
+    ) -> Tuple[int, np.ndarray]:
+        """(число найденных, номера строк страницы) с учётом фильтров и сортировки"""
+        ids = self._ordered_ids(self.filter_mask(query), sort or query.sort)
+        return len(ids), ids[offset:offset + limit]
+
+    def _cursor_position(self, mask: np.ndarray, sort: str, cursor: int) -> int:
+        """Сколько найденных строк стоит в выдаче перед строкой cursor"""
+        rank = int(self._rank[sort.lstrip("-")][cursor])
+        if sort.startswith("-"):
+            rank = len(mask) - 1 - rank
+        return int(np.count_nonzero(mask[self._sort_order(sort)[:rank]]))
+
+    def page(
+        self,
+        query: ApartmentQuery,
+        after: Optional[int] = None,
+        before: Optional[int] = None,
+        limit: int = 3
+    ) -> CatalogPage:
+        """Страница выдачи относительно строки-курсора; тот же интерфейс, что у SQLiteCatalog"""
+        # Порядок по умолчанию тот же, что у SQLiteCatalog: сначала дешёвые
+        sort = query.sort or "price"
+        mask = self.filter_mask(query)
+        ids = self._ordered_ids(mask, sort)
+        total = len(ids)
+        n = len(self.apartments)
+        start = 0
+        if after is not None:
+            if 0 <= after < n:
+                start = self._cursor_position(mask, sort, after) + int(mask[after])
+            else:
+                start = total
+        elif before is not None and 0 <= before < n:
+            start = max(0, self._cursor_position(mask, sort, before) - limit)
+        page_ids = ids[start:start + limit].tolist()
+        return CatalogPage(
+            items=[self.apartments[i] for i in page_ids],
+            ids=page_ids,
+            hashes=[self.hashes[i] for i in page_ids],
+            cards=[None] * len(page_ids),
+            total=total,
+            has_prev=start > 0,
+            has_next=start + limit < total
+        )
+
+    def image_names(self) -> List[str]:
+        return [apt["image"] for apt in self.apartments if apt.get("image")]
+
+    def random(self) -> Optional[Tuple[str, dict, Optional[str]]]:
+        if not self.apartments:
+            return None
+        i = int(np.random.default_rng().integers(len(self.apartments)))
+        return self.hashes[i], self.apartments[i], None
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,266 @@
+import re
+from typing import Iterable, List, Optional, Tuple
+from .text_normalization import normalize_text
+
+# Множители для "15 млн", "80 тыс" и т.п.
+_UNITS = {
+    "млрд": 1_000_000_000,
+    "млн": 1_000_000, "миллион": 1_000_000, "миллиона": 1_000_000, "миллионов": 1_000_000, "м": 1_000_000,
+    "тыс": 1_000, "тысяч": 1_000, "тысячи": 1_000, "тысяча": 1_000, "т": 1_000, "к": 1_000,
+}
+_UNIT_PATTERN = r"(?:млрд|млн|миллион(?:а|ов)?|тыс(?:яч[аи]?)?|т|к|м)\b"
+_NUMBER = r"(\d+(?:[.,]\d+)?)"
+
+_ROOM_WORDS = {
+    "студия": 1, "студию": 1, "однушка": 1, "однушку": 1, "однокомнатная": 1, "однокомнатную": 1,
+    "двушка": 2, "двушку": 2, "двухкомнатная": 2, "двухкомнатную": 2,
+    "трешка": 3, "трешку": 3, "трехкомнатная": 3, "трехкомнатную": 3,
+    "четырехкомнатная": 4, "четырехкомнатную": 4,
+}
+# Слова сравниваются целиком: основа плюс окончание, чтобы "обычно" не значило "обычная"
+_STYLE_WORDS = (
+    ("luxury", re.compile(r"\b(?:люкс\w*|элитн\w*|премиум\w*|роскошн\w*)\b")),
+    ("budget", re.compile(r"\b(?:бюджетн\w*|эконом\w*|недорог\w*)\b")),
+    ("standard", re.compile(r"\b(?:стандартн\w*|обычн(?:ая|ую|ой|ый|ое|ые|ых|ого|ом))\b")),
+)
+_RENTAL_RE = re.compile(
+    r"\b(?:аренд\w*|снять|сниму|снимать|снимаю|снимем|сдает\w*|сдается|сдаю|посуточн\w*|в месяц)\b"
+)
+_SALE_RE = re.compile(r"\b(?:купить|куплю|покупк\w*|продаж\w*|продает\w*|ипотек\w*|в собственность)\b")
+# Что ищут — объект: без такого слова (или числа комнат) сообщение не поиск. "Аренда" и
+# "ипотека" сами по себе встречаются в вопросах ("как оформить ипотеку?"), поэтому сюда не входят
+_LISTING_RE = re.compile(
+    r"\b(?:квартир\w*|комнат\w*|студи[яюиейо]\w*|однушк\w*|двушк\w*|трешк\w*|"
+    r"жиль\w*|жилье|новостройк\w*|вторичк\w*|апартамент\w*)\b"
+)
+_CITY_ALIASES = {"мск": "москва", "питер": "санкт-петербург", "спб": "санкт-петербург", "петербург": "санкт-петербург"}
+# Падежные окончания названий городов: "в москве", "по казани", "под нижним новгородом"
+_CASE_ENDINGS = r"(?:а|я|у|ю|е|и|ы|о|ь|ой|ей|ью|ом|ем|ий|ый|ая|ого|его|ому|ему|им|ым)?"
+
+# "2 комнаты", "2-х комнатная", "2-к"; слитное "2к" — только перед "кв"/"квартира",
+# иначе это деньги: "бюджет 5к"
+_ROOMS_RE = re.compile(r"(\d+)(?:\s*-?\s*(?:х\s*)?-?комн\w*|\s*-\s*к\b|\s*к(?=\s+(?:кв\b|квартир)))")
+_AREA_RE = re.compile(
+    r"(?:(от|больше|более|не меньше|до|меньше|менее|не больше)\s+)?" + _NUMBER +
+    r"(?:\s*-\s*" + _NUMBER + r")?\s*(?:м2|м²|кв\.?\s*м|квадрат\w*|метр\w*)"
+)
+_PRICE_RE = re.compile(
+    r"(от|дороже|до|дешевле|не дороже|за)?\s*" + _NUMBER + r"(?:\s*-\s*" + _NUMBER + r")?\s*(" + _UNIT_PATTERN + r"|руб\w*|р\b|₽)?"
+)
+_SORT_PATTERNS = (
+    ("price", re.compile(r"сначала дешев|подешевле|по возрастанию цен|дешевые сначала")),
+    ("-price", re.compile(r"сначала дорог|подороже|по убыванию цен|дорогие сначала")),
+    ("-area", re.compile(r"сначала больш|побольше|по площади|просторн")),
+    ("area", re.compile(r"сначала меньш|поменьше")),
+)
+
+_LOWER = ("от", "дороже", "больше", "более", "не меньше")
+
+
+class ApartmentQuery:
+    """Фильтры поиска квартир; None — фильтр не задан"""
+
+    SORT_KEYS = ("price", "-price", "area", "-area", "rooms", "-rooms")
+
+    def __init__(
+        self,
+        city: Optional[str] = None,
+        rooms: Optional[Tuple[int, int]] = None,
+        price: Optional[Tuple[int, int]] = None,
+        area: Optional[Tuple[float, float]] = None,
+        style: Optional[str] = None,
+        rental: Optional[bool] = None,
+        sort: Optional[str] = None
+    ):
+        self.city = city
+        self.rooms = rooms
+        self.price = price
+        self.area = area
+        self.style = style
+        self.rental = rental
+        self.sort = sort
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={value!r}" for name, value in vars(self).items() if value is not None)
+        return f"ApartmentQuery({fields})"
+
+    @property
+    def is_empty(self) -> bool:
+        return all(value is None for value in vars(self).values())
+
+    @property
+    def has_filters(self) -> bool:
+        """Есть условия, сужающие выдачу (а не только сортировка)"""
+        return any(value is not None for name, value in vars(self).items() if name != "sort")
+
+    def describe(self) -> str:
+        """Человекочитаемое описание фильтров для ответа пользователю"""
+        parts = []
+        if self.city:
+            parts.append(self.city)
+        if self.rooms:
+            parts.append(_range_text(self.rooms, "комн."))
+        if self.price:
+            parts.append(_range_text(self.price, "руб.", money=True))
+        if self.area:
+            parts.append(_range_text(self.area, "м²"))
+        if self.style:
+            parts.append({"luxury": "люкс", "standard": "стандарт", "budget": "бюджет"}.get(self.style, self.style))
+        if self.rental is not None:
+            parts.append("аренда" if self.rental else "продажа")
+        return ", ".join(parts)
+
+
+def _range_text(bounds: tuple, unit: str, money: bool = False) -> str:
+    low, high = bounds
+
+    def fmt(value):
+        if money:
+            return f"{value:,.0f}".replace(",", " ")
+        return f"{value:g}"
+
+    if low is None:
+        return f"до {fmt(high)} {unit}"
+    if high is None:
+        return f"от {fmt(low)} {unit}"
+    if low == high:
+        return f"{fmt(low)} {unit}"
+    return f"{fmt(low)}–{fmt(high)} {unit}"
+
+
+def _to_number(raw: str) -> float:
+    return float(raw.replace(",", "."))
+
+
+def _bounds(word: Optional[str], first: float, second: Optional[float]) -> tuple:
+    if second is not None:
+        return (min(first, second), max(first, second))
+    if word in _LOWER:
+        return (first, None)
+    # "до 15 млн", "за 15 млн" и просто "15 млн" — верхняя граница
+    return (None, first)
+
+
+def _word_pattern(word: str) -> str:
+    """Слово названия в любом падеже: основа без гласного окончания плюс окончание, целиком"""
+    if len(word) <= 4:
+        return re.escape(word)
+    return re.escape(re.sub(r"[аеийоуыьэюя]{1,2}$", "", word)) + _CASE_ENDINGS
+
+
+def _name_re(normalized: str) -> "re.Pattern":
+    return re.compile(r"\b" + r"\s+".join(_word_pattern(word) for word in normalized.split()) + r"\b")
+
+
+def _match_city(tokens: List[str], cities: Iterable[str]) -> Optional[str]:
+    """Город из каталога, в том числе в падеже: "в москве", "по казани" """
+    by_normalized = {normalize_text(city): city for city in cities}
+    text = " ".join(tokens)
+    for name, alias in _CITY_ALIASES.items():
+        # Короткие сокращения — только целиком, "питере" -> "питер"
+        pattern = re.compile(r"\b" + re.escape(name) + r"\b") if len(name) < 5 else _name_re(name)
+        if pattern.search(text):
+            city = by_normalized.get(normalize_text(alias))
+            if city:
+                return city
+    for normalized, city in sorted(by_normalized.items(), key=lambda item: -len(item[0])):
+        if _name_re(normalized).search(text):
+            return city
+    return None
+
+
+def _prepare(text: str) -> str:
+    # Числа и единицы разбираются по исходному тексту: normalize_text разбил бы "15,5" и "кв.м"
+    return re.sub(r"\s+", " ", text.lower().replace("ё", "е")).strip()
+
+
+def parse_query(text: str, cities: Iterable[str] = (), explicit: bool = False) -> ApartmentQuery:
+    """Фильтры из аргументов /search или свободного текста.
+
+    Пример: "2 комнаты Москва до 15 млн" -> город Москва, 2 комнаты, цена до 15 000 000.
+    Число без единиц после "до/от" меньше тысячи считается миллионами, но только
+    в явном поиске (explicit) или рядом со словом о квартире: "до 18 часов" — не цена.
+    """
+    query = ApartmentQuery()
+    normalized = normalize_text(text)
+    if not normalized:
+        return query
+    raw = _prepare(text)
+
+    for word, rooms in _ROOM_WORDS.items():
+        if re.search(r"\b" + word + r"\b", raw):
+            query.rooms = (rooms, rooms)
+            break
+    consumed = []
+    match = _ROOMS_RE.search(raw)
+    if match:
+        rooms = int(match.group(1))
+        query.rooms = (rooms, rooms)
+        consumed.append(match.span())
+    bare_price = explicit or query.rooms is not None or bool(_LISTING_RE.search(raw))
+
+    match = _AREA_RE.search(raw)
+    if match:
+        word = match.group(1)
+        low = _to_number(match.group(2))
+        high = _to_number(match.group(3)) if match.group(3) else None
+        if high is not None:
+            query.area = (min(low, high), max(low, high))
+        elif word in ("до", "меньше", "менее", "не больше"):
+            query.area = (None, low)
+        else:
+            # "от 50 м2" и просто "50 м2" — нижняя граница
+            query.area = (low, None)
+        consumed.append(match.span())
+
+    for match in _PRICE_RE.finditer(raw):
+        if any(start <= match.start(2) < end for start, end in consumed):
+            continue
+        word, unit = match.group(1), match.group(4)
+        if not unit and (not word or not bare_price):
+            continue
+        first = _to_number(match.group(2))
+        second = _to_number(match.group(3)) if match.group(3) else None
+        if unit and unit in _UNITS:
+            multiplier = _UNITS[unit]
+        elif unit:
+            multiplier = 1
+        else:
+            multiplier = 1_000_000 if max(first, second or 0) < 1000 else 1
+        low, high = _bounds(word and word.strip(), first * multiplier, second * multiplier if second else None)
+        # "от 5 до 10 млн": вторая граница дополняет первую
+        if query.price:
+            low = low if low is not None else query.price[0]
+            high = high if high is not None else query.price[1]
+        query.price = (int(low) if low is not None else None, int(high) if high is not None else None)
+
+    for style, pattern in _STYLE_WORDS:
+        if pattern.search(raw):
+            query.style = style
+            break
+
+    if _RENTAL_RE.search(raw):
+        query.rental = True
+    elif _SALE_RE.search(raw):
+        query.rental = False
+
+    for key, pattern in _SORT_PATTERNS:
+        if pattern.search(raw):
+            query.sort = key
+            break
+
+    query.city = _match_city(normalized.split(), cities)
+    return query
+
+
+def parse_search_request(text: str, cities: Iterable[str] = ()) -> Optional[ApartmentQuery]:
+    """Фильтры свободного сообщения, если оно похоже на поиск жилья, иначе None.
+
+    Города, цены, площади или слов "аренда", "ипотека" мало: "сколько стоит
+    ремонт 50 м2" и "что лучше: аренда или ипотека?" — не поиск. Нужно слово
+    об объекте — "квартира", "студия", "2-к" — и хотя бы один фильтр.
+    """
+    query = parse_query(text, cities)
+    if not query.has_filters or not (query.rooms or _LISTING_RE.search(_prepare(text))):
+        return None
+    return query
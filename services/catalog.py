@@ -0,0 +1,394 @@
+import csv
+import json
+import logging
+import random
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+from .apartment_query import ApartmentQuery
+from .listing_cards import CARD_FORMAT_VERSION, dedup_records, render_card
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Столбцы, по которым фильтруется и сортируется выдача; остальное хранится в data (JSON)
+_COLUMNS = ("city", "address", "area", "rooms", "price", "style", "rental")
+_SORT_COLUMNS = ("price", "area", "rooms")
+COUNT_CACHE_SIZE = 256
+SCHEMA_VERSION = 2
+
+
+class CatalogPage:
+    """Страница выдачи: квартиры, их идентификаторы (курсоры), хэши и готовые карточки"""
+
+    def __init__(
+        self,
+        items: List[dict],
+        ids: List[int],
+        hashes: List[str],
+        cards: List[Optional[str]],
+        total: int,
+        has_prev: bool,
+        has_next: bool
+    ):
+        self.items = items
+        self.ids = ids
+        self.hashes = hashes
+        self.cards = cards
+        self.total = total
+        self.has_prev = has_prev
+        self.has_next = has_next
+
+
+def city_of(apartment: dict) -> str:
+    """Город — первая часть адреса: "Москва, Рублёвское шоссе, 25" -> "Москва" """
+    return apartment.get("city") or apartment.get("address", "").split(",", 1)[0].strip()
+
+
+def _parse_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "да", "аренда")
+    return bool(value)
+
+
+def iter_csv_records(path: Path) -> Iterator[dict]:
+    """Квартиры из CSV с заголовком; особенности перечисляются через ";" """
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            record = {key: value for key, value in row.items() if value not in (None, "")}
+            for key, cast in (("area", float), ("rooms", int), ("price", int)):
+                if key in record:
+                    record[key] = cast(float(record[key]))
+            if "rental" in record:
+                record["rental"] = _parse_bool(record["rental"])
+            if "features" in record:
+                record["features"] = [item.strip() for item in record["features"].split(";") if item.strip()]
+            yield record
+
+
+def iter_records(path: Path) -> Iterator[dict]:
+    if path.suffix.lower() == ".csv":
+        yield from iter_csv_records(path)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+
+
+class SQLiteCatalog:
+    """Каталог квартир в SQLite: индексы по полям фильтров и постраничная выдача по курсору.
+
+    Страница выбирается условием (поле сортировки, id) > (значение последней
+    показанной квартиры) вместо OFFSET, поэтому стоимость перехода на
+    следующую страницу не растёт с её номером. Каталог не держится в памяти:
+    при старте файл источника перечитывается, только если он изменился.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cities: Optional[List[str]] = None
+        # Число найденных по условию: при листании страниц условие то же, пересчёт не нужен
+        self._counts: "OrderedDict[tuple, int]" = OrderedDict()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            # Каталог — производные данные: при смене схемы пересоздаётся из источника
+            self._db.executescript(
+                "DROP TABLE IF EXISTS apartments;"
+                "DROP TABLE IF EXISTS meta;"
+                f"PRAGMA user_version = {SCHEMA_VERSION};"
+            )
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS apartments ("
+            " id INTEGER PRIMARY KEY,"
+            " content_hash TEXT NOT NULL UNIQUE,"
+            " city TEXT NOT NULL, address TEXT NOT NULL,"
+            " area REAL NOT NULL, rooms INTEGER NOT NULL, price INTEGER NOT NULL,"
+            " style TEXT NOT NULL, rental INTEGER NOT NULL,"
+            " data TEXT NOT NULL, card TEXT);"
+            "CREATE INDEX IF NOT EXISTS apartments_price ON apartments (price, id);"
+            "CREATE INDEX IF NOT EXISTS apartments_area ON apartments (area, id);"
+            "CREATE INDEX IF NOT EXISTS apartments_rooms ON apartments (rooms, price, id);"
+            "CREATE INDEX IF NOT EXISTS apartments_city ON apartments (city, price, id);"
+            "CREATE INDEX IF NOT EXISTS apartments_style ON apartments (style, price, id);"
+            "CREATE INDEX IF NOT EXISTS apartments_rental ON apartments (rental, price, id);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+        )
+        self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM apartments").fetchone()[0]
+
+    @property
+    def cities(self) -> List[str]:
+        cities = self._cities
+        if cities is None:
+            with self._lock:
+                rows = self._db.execute("SELECT DISTINCT city FROM apartments ORDER BY city").fetchall()
+            cities = self._cities = [row[0] for row in rows]
+        return cities
+
+    def import_records(self, records: Iterable[dict], batch_size: int = 5000) -> int:
+        """Загрузка каталога одной транзакцией: поиск видит либо старый, либо новый каталог.
+
+        Объявления дедуплицируются по хэшу содержимого. Неизменённые объявления
+        сохраняют id и готовую карточку, удаляются только исчезнувшие из
+        источника, карточки рисуются только для новых и изменённых.
+        """
+        started = time.perf_counter()
+
+        def rows():
+            for digest, record in dedup_records(records):
+                yield (
+                    digest,
+                    city_of(record),
+                    record.get("address", ""),
+                    float(record.get("area", 0)),
+                    int(record.get("rooms", 0)),
+                    int(record.get("price", 0)),
+                    record.get("style", "standard"),
+                    int(_parse_bool(record.get("rental", False))),
+                    json.dumps(record, ensure_ascii=False),
+                )
+
+        count = 0
+        with self._lock:
+            try:
+                self._db.execute("BEGIN")
+                self._db.execute(
+                    f"CREATE TEMP TABLE incoming (content_hash TEXT PRIMARY KEY, {', '.join(_COLUMNS)}, data)"
+                )
+                batch = []
+                for row in rows():
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        self._insert(batch)
+                        count += len(batch)
+                        batch = []
+                if batch:
+                    self._insert(batch)
+                    count += len(batch)
+
+                removed = self._db.execute(
+                    "DELETE FROM apartments WHERE content_hash NOT IN (SELECT content_hash FROM incoming)"
+                ).rowcount
+                added = self._db.execute(
+                    f"INSERT INTO apartments (content_hash, {', '.join(_COLUMNS)}, data) "
+                    f"SELECT content_hash, {', '.join(_COLUMNS)}, data FROM incoming "
+                    "WHERE content_hash NOT IN (SELECT content_hash FROM apartments) ORDER BY rowid"
+                ).rowcount
+                self._db.execute("DROP TABLE incoming")
+
+                row = self._db.execute("SELECT value FROM meta WHERE key = 'card_version'").fetchone()
+                if row is None or int(row[0]) != CARD_FORMAT_VERSION:
+                    self._db.execute("UPDATE apartments SET card = NULL")
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES ('card_version', ?)", (str(CARD_FORMAT_VERSION),)
+                    )
+                rendered = self._render_missing_cards(batch_size)
+                self._db.commit()
+                # Статистика по индексам: без неё планировщик выбирает индекс rental и сортирует выдачу заново
+                self._db.execute("ANALYZE")
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                self._db.execute("DROP TABLE IF EXISTS temp.incoming")
+                raise
+            self._cities = None
+            self._counts.clear()
+
+        metrics.inc("catalog_cards_rendered_total", rendered)
+        logger.info(
+            f"Catalog ingest: {count} unique listings, +{added} -{removed}, "
+            f"{rendered} cards rendered in {time.perf_counter() - started:.2f}s"
+        )
+        return count
+
+    def _insert(self, batch: list) -> None:
+        self._db.executemany(
+            f"INSERT INTO incoming (content_hash, {', '.join(_COLUMNS)}, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            batch
+        )
+
+    def _render_missing_cards(self, batch_size: int) -> int:
+        rendered = 0
+        while True:
+            rows = self._db.execute(
+                "SELECT id, data FROM apartments WHERE card IS NULL LIMIT ?", (batch_size,)
+            ).fetchall()
+            if not rows:
+                return rendered
+            self._db.executemany(
+                "UPDATE apartments SET card = ? WHERE id = ?",
+                [(render_card(json.loads(data)), row_id) for row_id, data in rows]
+            )
+            rendered += len(rows)
+
+    def import_file(self, source: Path) -> int:
+        started = time.perf_counter()
+        count = self.import_records(iter_records(source))
+        stat = source.stat()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('source', ?)",
+                (json.dumps(self._source_stamp(source, stat)),)
+            )
+            self._db.commit()
+        logger.info(f"🏢 Imported {count} apartments from {source} in {time.perf_counter() - started:.2f}s")
+        return count
+
+    @staticmethod
+    def _source_stamp(source: Path, stat) -> list:
+        # Версия шаблона карточки входит в отметку: смена шаблона перерисовывает карточки при старте
+        return [str(source.resolve()), stat.st_mtime_ns, stat.st_size, CARD_FORMAT_VERSION]
+
+    def sync(self, source: Path) -> bool:
+        """Импорт источника, если он изменился с прошлого импорта; True — каталог обновлён"""
+        if not source.exists():
+            logger.warning(f"Catalog source not found: {source}")
+            return False
+        stat = source.stat()
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        if row and json.loads(row[0]) == self._source_stamp(source, stat):
+            return False
+        self.import_file(source)
+        return True
+
+    @staticmethod
+    def _where(query: ApartmentQuery) -> Tuple[List[str], list]:
+        conditions, params = [], []
+        for name in _SORT_COLUMNS:
+            bounds = getattr(query, name)
+            if bounds is None:
+                continue
+            low, high = bounds
+            if low is not None:
+                conditions.append(f"{name} >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append(f"{name} <= ?")
+                params.append(high)
+        if query.city is not None:
+            conditions.append("city = ?")
+            params.append(query.city)
+        if query.style is not None:
+            conditions.append("style = ?")
+            params.append(query.style)
+        if query.rental is not None:
+            conditions.append("rental = ?")
+            params.append(int(query.rental))
+        return conditions, params
+
+    def count(self, query: ApartmentQuery) -> int:
+        conditions, params = self._where(query)
+        key = (tuple(conditions), tuple(params))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            total = self._counts.get(key)
+            if total is None:
+                total = self._db.execute(f"SELECT COUNT(*) FROM apartments {where}", params).fetchone()[0]
+                self._counts[key] = total
+                while len(self._counts) > COUNT_CACHE_SIZE:
+                    self._counts.popitem(last=False)
+            else:
+                self._counts.move_to_end(key)
+            return total
+
+    def page(
+        self,
+        query: ApartmentQuery,
+        after: Optional[int] = None,
+        before: Optional[int] = None,
+        limit: int = 3
+    ) -> CatalogPage:
+        """Страница после квартиры after (вперёд) или перед квартирой before (назад)"""
+        # По умолчанию — сначала дешёвые: порядок (price, id) есть во всех составных индексах
+        sort = query.sort or "price"
+        column = sort.lstrip("-")
+        if column not in _SORT_COLUMNS:
+            column = "price"
+        descending = sort.startswith("-")
+
+        conditions, params = self._where(query)
+        backwards = before is not None
+        cursor = before if backwards else after
+        if cursor is not None:
+            # Ключ курсора берётся из самой строки: в callback_data помещается только id
+            operator = ">" if descending == backwards else "<"
+            conditions.append(f"({column}, id) {operator} (SELECT {column}, id FROM apartments WHERE id = ?)")
+            params.append(cursor)
+
+        direction = "DESC" if descending != backwards else "ASC"
+        order = f"{column} {direction}, id {direction}"
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, content_hash, data, card FROM apartments {where} ORDER BY {order} LIMIT ?",
+                params + [limit + 1]
+            ).fetchall()
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+        return CatalogPage(
+            items=[json.loads(data) for _, _, data, _ in rows],
+            ids=[row[0] for row in rows],
+            hashes=[row[1] for row in rows],
+            cards=[row[3] for row in rows],
+            total=self.count(query),
+            has_prev=more if backwards else cursor is not None,
+            has_next=True if backwards else more
+        )
+
+    def image_names(self) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT json_extract(data, '$.image') FROM apartments WHERE json_extract(data, '$.image') IS NOT NULL"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def random(self) -> Optional[Tuple[str, dict, Optional[str]]]:
+        """(хэш, квартира, карточка) случайной квартиры, все квартиры равновероятны.
+
+        Случайный id из диапазона чаще попадал бы на квартиру после дыры от удалённых
+        строк, поэтому берётся случайное смещение по компактному индексу (price, id).
+        """
+        total = self.count(ApartmentQuery())
+        if not total:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content_hash, data, card FROM apartments WHERE id = "
+                "(SELECT id FROM apartments ORDER BY price, id LIMIT 1 OFFSET ?)",
+                (random.randrange(total),)
+            ).fetchone()
+        return (row[0], json.loads(row[1]), row[2]) if row else None
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def main() -> None:
+    """Массовый импорт: python -m services.catalog listings.csv [catalog.sqlite3]"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2:
+        print(main.__doc__)
+        sys.exit(2)
+    from config.settings import CATALOG_DB_PATH
+    catalog = SQLiteCatalog(Path(sys.argv[2]) if len(sys.argv) > 2 else CATALOG_DB_PATH)
+    catalog.import_file(Path(sys.argv[1]))
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ContentReloader:
+    """Перезагрузка контента из data/* без перезапуска бота.
+
+    Каждая цель — набор файлов и функция перезагрузки. Цель перезагружается,
+    когда у одного из её файлов изменились mtime или размер. Новые данные
+    строятся в фоновом потоке и подменяют старые одной ссылкой, поэтому
+    запросы в процессе обработки продолжают работать со старой версией.
+    """
+
+    def __init__(self, interval: float, targets: Sequence[Tuple[str, Sequence[Path], Callable[[], Optional[int]]]]):
+        self.interval = interval
+        self.targets = [(name, [Path(path) for path in paths], reload) for name, paths, reload in targets]
+        self._lock = threading.Lock()
+        self._stamps: Dict[str, tuple] = {name: self._stamp(paths) for name, paths, _ in self.targets}
+
+    @staticmethod
+    def _stamp(paths: List[Path]) -> tuple:
+        stamp = []
+        for path in paths:
+            try:
+                stat = path.stat()
+                stamp.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _reload_target(self, name: str, reload: Callable[[], Optional[int]]) -> bool:
+        started = time.perf_counter()
+        try:
+            version = reload()
+        except Exception as e:
+            # Старая версия данных остаётся в работе
+            logger.error(f"Reload of {name} failed: {str(e)}")
+            metrics.inc("content_reload_errors_total")
+            return False
+        if version is None:
+            # Сервис ещё не создан: он прочитает свежие данные сам при первом обращении
+            logger.debug(f"Reload of {name} skipped: service is not loaded")
+            return False
+        seconds = time.perf_counter() - started
+        metrics.inc("content_reloads_total")
+        metrics.observe("content_reload_seconds", seconds)
+        logger.info(f"Reloaded {name}: version {version} in {seconds:.2f}s")
+        return True
+
+    def check(self) -> List[str]:
+        """Перезагружает цели с изменившимися файлами; возвращает их имена"""
+        reloaded = []
+        with self._lock:
+            for name, paths, reload in self.targets:
+                stamp = self._stamp(paths)
+                if stamp == self._stamps[name]:
+                    continue
+                # Отметка сохраняется до перезагрузки: сломанный файл не перечитывается каждый цикл
+                self._stamps[name] = stamp
+                if self._reload_target(name, reload):
+                    reloaded.append(name)
+        return reloaded
+
+    def reload_all(self) -> List[str]:
+        """Принудительная перезагрузка всех целей (команда /reload)"""
+        reloaded = []
+        with self._lock:
+            for name, paths, reload in self.targets:
+                self._stamps[name] = self._stamp(paths)
+                if self._reload_target(name, reload):
+                    reloaded.append(name)
+        return reloaded
+
+    async def run(self) -> None:
+        """Периодическая проверка файлов; перезагрузка идёт в потоке, не блокируя обработку сообщений"""
+        logger.info(f"Content reloader watching {sum(len(paths) for _, paths, _ in self.targets)} files every {self.interval:.0f}s")
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.check)
+            except Exception as e:
+                logger.error(f"Content reload check failed: {str(e)}")
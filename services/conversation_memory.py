@@ -0,0 +1,108 @@
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Hashable, List, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов, пока нет точного значения от модели"""
+    return max(1, len(text) // 3)
+
+
+class _Turn:
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str, tokens: int):
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+
+
+class _Session:
+    __slots__ = ("turns", "last_seen")
+
+    def __init__(self, max_turns: int):
+        # Реплики хранятся парами (вопрос, ответ)
+        self.turns: Deque[_Turn] = deque(maxlen=max_turns * 2)
+        self.last_seen = time.monotonic()
+
+
+class ConversationMemory:
+    """История диалога с моделью для каждого пользователя.
+
+    Сессии хранятся в порядке последнего обращения: самые давние вытесняются
+    при превышении max_sessions, простаивающие дольше ttl — удаляются.
+    Число токенов каждой реплики вычисляется один раз и хранится вместе с ней.
+    """
+
+    def __init__(self, max_sessions: int = 10000, ttl: float = 1800, max_turns: int = 20):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self._sessions: "OrderedDict[Hashable, _Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _purge_expired(self, now: float) -> None:
+        # Сессии упорядочены по времени обращения — истёкшие всегда в начале
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if now - session.last_seen < self.ttl:
+                break
+            del self._sessions[user_id]
+
+    def _get(self, user_id: Hashable, create: bool) -> Optional[_Session]:
+        now = time.monotonic()
+        self._purge_expired(now)
+        session = self._sessions.get(user_id)
+        if session is None:
+            if not create:
+                return None
+            session = _Session(self.max_turns)
+            self._sessions[user_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(user_id)
+        session.last_seen = now
+        return session
+
+    def history(self, user_id: Hashable, token_budget: int) -> List[dict]:
+        """Последние реплики пользователя, укладывающиеся в бюджет токенов"""
+        with self._lock:
+            session = self._get(user_id, create=False)
+            if session is None:
+                return []
+
+            selected: List[_Turn] = []
+            used = 0
+            turns = list(session.turns)
+            # Берём пары (вопрос, ответ) с конца, чтобы роли чередовались
+            for i in range(len(turns) - 2, -1, -2):
+                pair = turns[i:i + 2]
+                pair_tokens = sum(turn.tokens for turn in pair)
+                if used + pair_tokens > token_budget:
+                    break
+                selected[:0] = pair
+                used += pair_tokens
+
+            return [{"role": turn.role, "content": turn.content} for turn in selected]
+
+    def append(
+        self,
+        user_id: Hashable,
+        user_text: str,
+        answer: str,
+        user_tokens: Optional[int] = None,
+        answer_tokens: Optional[int] = None
+    ) -> None:
+        with self._lock:
+            session = self._get(user_id, create=True)
+            session.turns.append(_Turn("user", user_text, user_tokens or estimate_tokens(user_text)))
+            session.turns.append(_Turn("assistant", answer, answer_tokens or estimate_tokens(answer)))
+
+    def reset(self, user_id: Hashable) -> None:
+        with self._lock:
+            self._sessions.pop(user_id, None)
@@ -0,0 +1,186 @@
+import hashlib
+import heapq
+import logging
+import math
+import pickle
+from array import array
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from .text_normalization import normalize_text, tokenize
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT_VERSION = 1
+
+
+def iter_dialogue_pairs(path: Path) -> Iterator[Tuple[str, str]]:
+    """Пары (реплика человека, следующая за ней реплика бота) из my_dialogues.txt"""
+    with open(path, 'r', encoding='utf-8') as f:
+        previous = None
+        for line in f:
+            line = line.strip()
+            if line.startswith("=" * 10):
+                previous = None
+                continue
+            if ":" not in line:
+                continue
+
+            speaker, text = line.split(":", 1)
+            speaker = speaker.strip().upper()
+            text = text.strip()
+            if previous is not None and speaker in ("B", "BOT") and text:
+                yield previous, text
+            previous = text if speaker == "H" and text else None
+
+
+def _file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DialogueIndex:
+    """Инвертированный индекс BM25 по репликам человека из корпуса диалогов.
+
+    Вклад каждого документа в оценку по термину (impact) вычисляется при
+    построении, списки вхождений отсортированы по убыванию вклада и обрезаны
+    до max_postings. Поэтому стоимость поиска зависит от длины запроса, а не
+    от размера корпуса.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.replies: List[str] = []
+        self.exact: Dict[str, int] = {}
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.idf: Dict[str, float] = {}
+        self.default_idf = 0.0
+        self.source_mtime = 0.0
+        self.source_size = 0
+        self.source_hash = ""
+
+    def __len__(self) -> int:
+        return len(self.replies)
+
+    @classmethod
+    def build(cls, pairs: Iterator[Tuple[str, str]], max_postings: int = 1000) -> "DialogueIndex":
+        index = cls()
+        term_docs: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        doc_lengths: List[int] = []
+
+        for human, reply in pairs:
+            terms = tokenize(human)
+            if not terms:
+                continue
+            doc_id = len(index.replies)
+            index.replies.append(reply)
+            index.exact.setdefault(normalize_text(human), doc_id)
+            doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                term_docs[term].append((doc_id, tf))
+
+        n_docs = len(doc_lengths)
+        if not n_docs:
+            return index
+
+        avg_length = sum(doc_lengths) / n_docs
+        index.default_idf = math.log(1 + n_docs)
+        for term, docs in term_docs.items():
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            index.idf[term] = idf
+            impacts = []
+            for doc_id, tf in docs:
+                norm = cls.K1 * (1 - cls.B + cls.B * doc_lengths[doc_id] / avg_length)
+                impacts.append((idf * tf * (cls.K1 + 1) / (tf + norm), doc_id))
+            impacts.sort(key=lambda item: (-item[0], item[1]))
+            impacts = impacts[:max_postings]
+            index.postings[term] = (
+                array('i', (doc_id for _, doc_id in impacts)),
+                array('f', (impact for impact, _ in impacts))
+            )
+        return index
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[float, str]]:
+        """Top-k ответов: (относительная оценка, ответ бота), лучшие первыми.
+
+        Оценка нормирована на сумму idf терминов запроса: около 1.0 — в
+        реплике есть все слова запроса, точное совпадение реплики — не ниже 2.0.
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.replies:
+            return []
+
+        ideal = sum(self.idf.get(term, self.default_idf) for term in terms)
+        exact_id = self.exact.get(normalize_text(query))
+
+        scores: Dict[int, float] = defaultdict(float)
+        for term in terms:
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            for doc_id, impact in zip(*entry):
+                scores[doc_id] += impact
+        if exact_id is not None:
+            scores[exact_id] = max(scores[exact_id], ideal) + ideal
+
+        best = heapq.nsmallest(k, scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(score / ideal, self.replies[doc_id]) for doc_id, score in best]
+
+    def best(self, query: str, min_score: float) -> Optional[str]:
+        results = self.search(query, k=1)
+        if results and results[0][0] >= min_score:
+            return results[0][1]
+        return None
+
+    def _is_fresh(self, source: Path) -> bool:
+        stat = source.stat()
+        if stat.st_mtime == self.source_mtime and stat.st_size == self.source_size:
+            return True
+        # mtime изменился — сверяем содержимое, прежде чем перестраивать
+        if self.source_hash and stat.st_size == self.source_size and _file_hash(source) == self.source_hash:
+            self.source_mtime = stat.st_mtime
+            return True
+        return False
+
+    @classmethod
+    def load_or_build(cls, source: Path, cache_path: Path, max_postings: int = 1000) -> "DialogueIndex":
+        """Индекс с диска, если корпус не менялся, иначе построение и сохранение"""
+        index = None
+        if cache_path.exists():
+            try:
+                with open(cache_path, 'rb') as f:
+                    payload = pickle.load(f)
+                if payload.get("version") == INDEX_FORMAT_VERSION and payload.get("max_postings") == max_postings:
+                    index = payload["index"]
+            except Exception as e:
+                logger.warning(f"Dialogue index cache is unreadable: {str(e)}")
+
+        if index is not None and index._is_fresh(source):
+            logger.info(f"Dialogue index loaded from {cache_path} ({len(index)} replies)")
+            return index
+
+        stat = source.stat()
+        index = cls.build(iter_dialogue_pairs(source), max_postings=max_postings)
+        index.source_mtime = stat.st_mtime
+        index.source_size = stat.st_size
+        index.source_hash = _file_hash(source)
+        logger.info(f"Dialogue index built: {len(index)} replies, {len(index.postings)} terms")
+
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_suffix(".tmp")
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(
+                    {"version": INDEX_FORMAT_VERSION, "max_postings": max_postings, "index": index},
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL
+                )
+            tmp_path.replace(cache_path)
+        except OSError as e:
+            logger.warning(f"Failed to save dialogue index: {str(e)}")
+        return index
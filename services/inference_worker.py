@@ -0,0 +1,515 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Deque, Dict, Hashable, List, Optional, Tuple
+from .metrics import metrics, startup_profile
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceError(Exception):
+    """Ошибка генерации ответа моделью"""
+
+
+class InferenceTimeoutError(InferenceError):
+    """Модель не уложилась в отведённое время"""
+
+
+class InferenceWorkerCrashed(InferenceError):
+    """Процесс с моделью завершился аварийно"""
+
+
+def _common_prefix_len(a, b) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class _PromptCache:
+    """Снимки KV-кэша для повторно используемых префиксов промпта.
+
+    Постоянный префикс (системное сообщение) вычисляется один раз при старте
+    воркера. Дополнительно хранятся снимки состояния после ответа для
+    нескольких самых активных сессий, чтобы следующая реплика диалога не
+    пересчитывала всю историю. Перед запросом восстанавливается снимок с
+    самым длинным общим префиксом, и llama.cpp досчитывает только остаток.
+
+    Токены, уже лежащие в KV-кэше, llama-cpp-python публично не отдаёт:
+    кэш читает приватный атрибут Llama._input_ids и отключается, если его
+    нет в установленной версии библиотеки.
+    """
+
+    def __init__(self, llm, chat_format: str, prefix_messages: List[dict], session_slots: int = 0):
+        self.llm = llm
+        self.session_slots = session_slots
+        self.prefix_tokens: List[int] = []
+        self.prefix_state = None
+        # session -> (токены снимка, состояние)
+        self.sessions: "OrderedDict[Hashable, Tuple[List[int], object]]" = OrderedDict()
+        self._formatter = None
+
+        if not prefix_messages:
+            return
+        try:
+            from llama_cpp import llama_chat_format
+            if chat_format == "llama-3":
+                self._formatter = llama_chat_format.format_llama3
+            if self._formatter is None:
+                logger.warning(f"Prompt prefix cache disabled: chat format {chat_format} is not supported")
+                return
+            if not hasattr(llm, "_input_ids"):
+                raise AttributeError("Llama._input_ids is not available in this llama-cpp-python version")
+
+            # Общая часть промптов "только префикс" и "префикс + реплика"
+            bare = self.tokenize(prefix_messages)
+            extended = self.tokenize(prefix_messages + [{"role": "user", "content": "."}])
+            self.prefix_tokens = bare[:_common_prefix_len(bare, extended)]
+
+            llm.reset()
+            llm.eval(self.prefix_tokens)
+            self.prefix_state = llm.save_state()
+        except Exception as e:
+            logger.warning(f"Prompt prefix cache disabled: {str(e)}", exc_info=True)
+            self._formatter = None
+            self.prefix_tokens = []
+            self.prefix_state = None
+
+    def tokenize(self, messages: List[dict]) -> List[int]:
+        prompt = self._formatter(messages=messages).prompt
+        return self.llm.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+
+    def _evaluated_tokens(self) -> List[int]:
+        """Токены, состояние которых сейчас в KV-кэше модели (приватный API llama-cpp-python)"""
+        return self.llm._input_ids.tolist()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def prepare(self, messages: List[dict], session: Optional[Hashable] = None) -> Tuple[int, int]:
+        """Восстанавливает лучший снимок при необходимости.
+
+        Возвращает (число токенов промпта, число токенов, взятых из KV-кэша).
+        """
+        if self.prefix_state is None:
+            return 0, 0
+
+        tokens = self.tokenize(messages)
+        cached = _common_prefix_len(self._evaluated_tokens(), tokens)
+
+        best_state = None
+        prefix_len = len(self.prefix_tokens)
+        if cached < prefix_len and tokens[:prefix_len] == self.prefix_tokens:
+            best_state, cached = self.prefix_state, prefix_len
+
+        if session is not None and session in self.sessions:
+            session_tokens, session_state = self.sessions[session]
+            self.sessions.move_to_end(session)
+            reusable = _common_prefix_len(session_tokens, tokens)
+            if reusable > cached:
+                best_state, cached = session_state, reusable
+
+        if best_state is not None:
+            self.llm.load_state(best_state)
+        # Последний токен промпта llama.cpp всегда вычисляет заново
+        return len(tokens), max(0, min(cached, len(tokens) - 1))
+
+    def remember(self, session: Optional[Hashable]) -> None:
+        """Сохраняет состояние после ответа для следующей реплики сессии"""
+        if session is None or self.prefix_state is None or self.session_slots <= 0:
+            return
+        self.sessions[session] = (self._evaluated_tokens(), self.llm.save_state())
+        self.sessions.move_to_end(session)
+        while len(self.sessions) > self.session_slots:
+            self.sessions.popitem(last=False)
+
+
+def _worker_main(conn, model_kwargs: dict, prefix_messages: List[dict], session_slots: int) -> None:
+    """Точка входа процесса-воркера: владеет экземпляром Llama и обслуживает запросы"""
+    try:
+        started = time.perf_counter()
+        from llama_cpp import Llama
+        llm = Llama(**model_kwargs)
+        loaded = time.perf_counter()
+        prompt_cache = _PromptCache(llm, model_kwargs.get("chat_format"), prefix_messages, session_slots)
+        prefix_evaluated = time.perf_counter()
+    except Exception as e:
+        conn.send({"type": "load_error", "error": str(e)})
+        return
+
+    conn.send({
+        "type": "ready",
+        "prefix_tokens": len(prompt_cache.prefix_tokens),
+        "load_seconds": loaded - started,
+        "prefix_seconds": prefix_evaluated - loaded
+    })
+
+    # Запросы, прочитанные из канала во время генерации предыдущего
+    backlog: Deque[Optional[dict]] = deque()
+
+    def poll_control(current_id: int) -> bool:
+        """Разбирает входящие сообщения во время генерации; True — текущий запрос отменён"""
+        cancelled = False
+        while conn.poll():
+            message = conn.recv()
+            if message is not None and message["type"] == "cancel":
+                if message["id"] == current_id:
+                    cancelled = True
+                else:
+                    for queued in list(backlog):
+                        if queued is not None and queued["id"] == message["id"]:
+                            backlog.remove(queued)
+            else:
+                backlog.append(message)
+        return cancelled
+
+    while True:
+        try:
+            request = backlog.popleft() if backlog else conn.recv()
+        except (EOFError, OSError):
+            break
+        if request is None:
+            break
+        if request["type"] != "generate":
+            continue
+
+        request_id = request["id"]
+        session = request.get("session")
+        try:
+            prompt_tokens, cached_tokens = prompt_cache.prepare(request["messages"], session)
+
+            # Всегда генерируем потоково: токены уходят клиенту по мере появления,
+            # а между токенами проверяем, не отменён ли запрос
+            cancelled = False
+            pieces: List[str] = []
+            started = time.perf_counter()
+            first_token_at = None
+            for chunk in llm.create_chat_completion(
+                messages=request["messages"],
+                stream=True,
+                **request["params"]
+            ):
+                if poll_control(request_id):
+                    cancelled = True
+                    break
+                delta = chunk['choices'][0]['delta'].get('content')
+                if delta:
+                    if first_token_at is None:
+                        # До первого токена модель прогоняет промпт (prompt eval)
+                        first_token_at = time.perf_counter()
+                    pieces.append(delta)
+                    conn.send({"type": "delta", "id": request_id, "text": delta})
+            if cancelled:
+                continue
+            finished = time.perf_counter()
+            first_token_at = first_token_at or finished
+            # Кусок потока — не обязательно один токен (многобайтные символы приходят
+            # склеенными), поэтому ответ считается токенизатором, как и реплика пользователя
+            conn.send({
+                "type": "done",
+                "id": request_id,
+                "prompt_tokens": prompt_tokens,
+                "cached_tokens": cached_tokens,
+                "user_tokens": prompt_cache.count_tokens(request["messages"][-1]["content"]),
+                "completion_tokens": prompt_cache.count_tokens("".join(pieces)),
+                "prompt_eval_seconds": first_token_at - started,
+                "generation_seconds": finished - first_token_at
+            })
+            # Снимок KV-кэша — копия всего состояния модели: делается уже после ответа,
+            # чтобы не задерживать его, но до следующего запроса
+            prompt_cache.remember(session)
+        except (EOFError, OSError):
+            break
+        except Exception as e:
+            conn.send({"type": "error", "id": request_id, "error": str(e)})
+
+
+class _WorkerHandle:
+    """Состояние одного запущенного процесса-воркера"""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.started_at = time.perf_counter()
+        self.ready = threading.Event()
+        self.load_error: Optional[str] = None
+        self.pending: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = {}
+
+    @property
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+
+class InferenceWorker:
+    """Асинхронный клиент к отдельному процессу с LLM.
+
+    Модель живёт в дочернем процессе, поэтому генерация не блокирует event loop,
+    а падение llama.cpp не роняет бота: ожидающие запросы получают
+    InferenceWorkerCrashed, а воркер перезапускается при следующем обращении.
+    """
+
+    def __init__(
+        self,
+        model_kwargs: dict,
+        request_timeout: float,
+        start_timeout: float,
+        prefix_messages: Optional[List[dict]] = None,
+        session_slots: int = 0
+    ):
+        self._model_kwargs = model_kwargs
+        self._prefix_messages = prefix_messages or []
+        self._session_slots = session_slots
+        self._request_timeout = request_timeout
+        self._start_timeout = start_timeout
+        self._ctx = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._handle: Optional[_WorkerHandle] = None
+
+    @property
+    def pid(self) -> Optional[int]:
+        handle = self._handle
+        return handle.process.pid if handle is not None and handle.is_alive else None
+
+    @property
+    def is_starting(self) -> bool:
+        """Процесс запущен, но модель ещё загружается"""
+        handle = self._handle
+        return handle is not None and not handle.ready.is_set() and handle.is_alive
+
+    @property
+    def is_ready(self) -> bool:
+        handle = self._handle
+        return (
+            handle is not None
+            and handle.ready.is_set()
+            and handle.load_error is None
+            and handle.is_alive
+        )
+
+    def start(self) -> _WorkerHandle:
+        """Запуск процесса-воркера (модель загружается в фоне)"""
+        with self._lock:
+            if self._handle is not None and self._handle.is_alive:
+                return self._handle
+
+            parent_conn, child_conn = self._ctx.Pipe()
+            process = self._ctx.Process(
+                target=_worker_main,
+                args=(child_conn, self._model_kwargs, self._prefix_messages, self._session_slots),
+                name="llm-worker",
+                daemon=True
+            )
+            process.start()
+            child_conn.close()
+
+            handle = _WorkerHandle(process, parent_conn)
+            self._handle = handle
+            threading.Thread(
+                target=self._read_loop,
+                args=(handle,),
+                name="llm-worker-reader",
+                daemon=True
+            ).start()
+            logger.info(f"LLM worker started (pid={process.pid})")
+            return handle
+
+    def stop(self) -> None:
+        with self._lock:
+            handle, self._handle = self._handle, None
+        if handle is None:
+            return
+        try:
+            with self._send_lock:
+                handle.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        handle.process.join(timeout=5)
+        if handle.process.is_alive():
+            handle.process.kill()
+        logger.info("LLM worker stopped")
+
+    def _kill(self, handle: _WorkerHandle, reason: str) -> None:
+        with self._lock:
+            if self._handle is handle:
+                self._handle = None
+        if handle.is_alive:
+            logger.warning(f"Killing LLM worker (pid={handle.process.pid}): {reason}")
+            handle.process.kill()
+
+    def _cancel(self, handle: _WorkerHandle, request_id: int) -> None:
+        """Просит воркер прекратить генерацию, результат которой уже не нужен"""
+        try:
+            with self._send_lock:
+                handle.conn.send({"type": "cancel", "id": request_id})
+        except (OSError, ValueError):
+            pass
+
+    def _read_loop(self, handle: _WorkerHandle) -> None:
+        while True:
+            try:
+                message = handle.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            message_type = message["type"]
+            if message_type == "ready":
+                logger.info(
+                    f"LLM worker: модель загружена за {message['load_seconds']:.1f} с, "
+                    f"префикс промпта в KV-кэше: {message['prefix_tokens']} токенов"
+                )
+                startup_profile.mark("model_load", message["load_seconds"])
+                startup_profile.mark("prompt_prefix_eval", message["prefix_seconds"])
+                startup_profile.mark("worker_ready", time.perf_counter() - handle.started_at)
+                logger.info(f"Startup profile: {startup_profile.summary()}")
+                handle.ready.set()
+            elif message_type == "load_error":
+                logger.error(f"LLM worker: ошибка загрузки модели: {message['error']}")
+                handle.load_error = message["error"]
+                handle.ready.set()
+            else:
+                self._resolve(handle, message)
+
+        handle.process.join(timeout=5)
+        self._on_worker_exit(handle)
+
+    def _resolve(self, handle: _WorkerHandle, message: dict) -> None:
+        entry = handle.pending.get(message["id"])
+        if entry is None:
+            return
+        loop, queue = entry
+        message_type = message["type"]
+        if message_type == "delta":
+            event = ("delta", message["text"])
+        elif message_type == "done":
+            event = ("done", message)
+            self._record_prompt_stats(message["prompt_tokens"], message["cached_tokens"])
+            self._record_generation_stats(message)
+        else:
+            event = ("error", InferenceError(message["error"]))
+        loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    @staticmethod
+    def _record_prompt_stats(prompt_tokens: int, cached_tokens: int) -> None:
+        if not prompt_tokens:
+            return
+        metrics.inc("llm_requests_total")
+        metrics.inc("llm_prompt_tokens_total", prompt_tokens)
+        metrics.inc("llm_prompt_tokens_saved_total", cached_tokens)
+        metrics.observe("llm_prompt_tokens_saved", cached_tokens)
+        logger.info(f"LLM prompt: {prompt_tokens} токенов, из KV-кэша {cached_tokens}")
+
+    @staticmethod
+    def _record_generation_stats(message: dict) -> None:
+        metrics.observe("llm_prompt_eval_seconds", message.get("prompt_eval_seconds", 0.0))
+        generation_seconds = message.get("generation_seconds", 0.0)
+        metrics.observe("llm_generation_seconds", generation_seconds)
+        completion_tokens = message.get("completion_tokens", 0)
+        metrics.inc("llm_completion_tokens_total", completion_tokens)
+        if completion_tokens > 1 and generation_seconds > 0:
+            # Первый токен приходит вместе с концом prompt eval и в скорость генерации не входит
+            tokens_per_second = (completion_tokens - 1) / generation_seconds
+            metrics.observe("llm_tokens_per_second", tokens_per_second)
+            metrics.set_gauge("llm_last_tokens_per_second", tokens_per_second)
+
+    def _on_worker_exit(self, handle: _WorkerHandle) -> None:
+        with self._lock:
+            if self._handle is handle:
+                self._handle = None
+            pending, handle.pending = handle.pending, {}
+
+        exitcode = handle.process.exitcode
+        if exitcode:
+            logger.error(f"LLM worker exited (pid={handle.process.pid}, exitcode={exitcode})")
+        handle.ready.set()
+        if not pending:
+            return
+        error = InferenceWorkerCrashed(f"LLM worker exited with code {exitcode}")
+        for loop, queue in pending.values():
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", error))
+
+    async def wait_ready(self) -> _WorkerHandle:
+        handle = self.start()
+        if not handle.ready.is_set():
+            loop = asyncio.get_running_loop()
+            ready = await loop.run_in_executor(None, handle.ready.wait, self._start_timeout)
+            if not ready:
+                raise InferenceTimeoutError("Модель не загрузилась за отведённое время")
+        if handle.load_error is not None:
+            raise InferenceError(f"Модель не загружена: {handle.load_error}")
+        if not handle.is_alive:
+            raise InferenceWorkerCrashed("LLM worker is not running")
+        return handle
+
+    async def stream(
+        self,
+        messages: List[dict],
+        session: Optional[Hashable] = None,
+        stats: Optional[dict] = None,
+        **params
+    ) -> AsyncIterator[str]:
+        """Потоковая генерация: отдаёт фрагменты текста по мере их появления.
+
+        session — ключ диалога для повторного использования KV-кэша,
+        в stats по завершении записывается статистика по токенам.
+        """
+        handle = await self.wait_ready()
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        request_id = next(self._ids)
+        handle.pending[request_id] = (loop, queue)
+        finished = False
+
+        try:
+            try:
+                with self._send_lock:
+                    handle.conn.send({
+                        "type": "generate",
+                        "id": request_id,
+                        "messages": messages,
+                        "session": session,
+                        "params": params
+                    })
+            except (OSError, ValueError) as e:
+                raise InferenceWorkerCrashed(f"Не удалось отправить запрос воркеру: {e}")
+
+            deadline = loop.time() + self._request_timeout
+            while True:
+                try:
+                    kind, payload = await asyncio.wait_for(
+                        queue.get(), max(deadline - loop.time(), 0)
+                    )
+                except asyncio.TimeoutError:
+                    # Воркер занят зависшей генерацией — перезапускаем его
+                    self._kill(handle, "request timeout")
+                    raise InferenceTimeoutError(
+                        f"Генерация заняла больше {self._request_timeout:.0f} с"
+                    )
+
+                if kind == "delta":
+                    yield payload
+                elif kind == "done":
+                    finished = True
+                    if stats is not None:
+                        stats.update(payload)
+                    return
+                else:
+                    finished = True
+                    raise payload
+        finally:
+            if handle.pending.pop(request_id, None) is not None and not finished:
+                self._cancel(handle, request_id)
+
+    async def generate(self, messages: List[dict], **params) -> str:
+        chunks = []
+        async for delta in self.stream(messages, **params):
+            chunks.append(delta)
+        return "".join(chunks)
@@ -3,85 +3,123 @@ from pathlib import Path
 import logging
 from typing import Tuple, Optional
 import re
+import time
+from config.settings import CACHE_DIR, DIALOGUE_MIN_SCORE, DIALOGUE_MAX_POSTINGS, ML_MIN_CONFIDENCE
+from .dialogue_index import DialogueIndex
+from .intent_matcher import IntentMatcher
+from .metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+# Уровни каскада classify_with_tier
+TIER_AI_DIRECT = "ai_direct"
+TIER_EMPTY = "empty"
+TIER_INTENT_MATCH = "intent_match"
+TIER_DIALOGUE = "dialogue"
+TIER_SIMILAR = "similar"
+TIER_ML = "ml"
+TIER_FALLTHROUGH = "fallthrough"
+
+class ClassifierData:
+    """Неизменяемый снимок данных классификатора; при перезагрузке заменяется целиком"""
+
+    def __init__(self, version: int, intents: dict, dialogue_index: DialogueIndex):
+        self.version = version
+        self.intents = intents
+        self.matcher = IntentMatcher(intents)
+        self.dialogue_index = dialogue_index
+
+
 class IntentClassifier:
-    def __init__(self):
-        self.intents = {}
-        self.dialogues = []
-        self._load_data()
-        logger.info(f"IntentClassifier initialized with {len(self.intents)} intents and {len(self.dialogues)} dialogues")
+    def __init__(self, ml_service=None):
+        # Необязательный ML-классификатор: последний шанс ответить без модели
+        self.ml_service = ml_service
+        self._data = self._load_data(version=1)
+        logger.info(f"IntentClassifier initialized with {len(self.intents)} intents and {len(self.dialogue_index)} dialogue replies")
+
+    @property
+    def version(self) -> int:
+        return self._data.version
+
+    @property
+    def intents(self) -> dict:
+        return self._data.intents
+
+    @property
+    def matcher(self) -> IntentMatcher:
+        return self._data.matcher
+
+    @property
+    def dialogue_index(self) -> DialogueIndex:
+        return self._data.dialogue_index
 
-    def _load_data(self):
+    def _load_data(self, version: int, strict: bool = False) -> ClassifierData:
+        """Снимок данных из data/*.
+
+        При запуске ошибки только логируются и классификатор работает с тем,
+        что удалось загрузить. strict (перезагрузка) — любая ошибка или
+        отсутствующий файл пробрасываются, чтобы в работе остался прежний снимок.
+        """
         base_path = Path(__file__).parent.parent / "data"
+        intents = {}
+        dialogue_index = DialogueIndex()
         
         # Загрузка intents.json
         intents_path = base_path / "intents.json"
         if intents_path.exists():
             try:
                 with open(intents_path, 'r', encoding='utf-8') as f:
-                    self.intents = json.load(f)
-                    logger.info(f"Loaded {len(self.intents)} intents")
+                    intents = json.load(f)
+                    logger.info(f"Loaded {len(intents)} intents")
             except Exception as e:
+                if strict:
+                    raise
                 logger.error(f"Intent loading error: {str(e)}")
+        elif strict:
+            raise FileNotFoundError(f"Intents file not found: {intents_path}")
 
-        # Загрузка диалогов
+        # Загрузка диалогов: индекс строится один раз и сохраняется на диск
         dialogues_path = base_path / "my_dialogues.txt"
         if dialogues_path.exists():
             try:
-                self.dialogues = []
-                with open(dialogues_path, 'r', encoding='utf-8') as f:
-                    current_dialog = []
-                    for line in f:
-                        line = line.strip()
-                        if line.startswith("="*10):
-                            if current_dialog:
-                                self.dialogues.append(current_dialog)
-                                current_dialog = []
-                        elif ":" in line:
-                            speaker, text = line.split(":", 1)
-                            current_dialog.append((speaker.strip(), text.strip()))
-                    # Добавляем последний диалог
-                    if current_dialog:
-                        self.dialogues.append(current_dialog)
-                
-                logger.info(f"💬 Loaded {len(self.dialogues)} dialogues")
+                dialogue_index = DialogueIndex.load_or_build(
+                    dialogues_path,
+                    CACHE_DIR / "dialogue_index.pickle",
+                    max_postings=DIALOGUE_MAX_POSTINGS
+                )
+                logger.info(f"💬 Loaded {len(dialogue_index)} dialogue replies")
             except Exception as e:
+                if strict:
+                    raise
                 logger.error(f"Dialogue loading error: {str(e)}")
+        elif strict:
+            raise FileNotFoundError(f"Dialogues file not found: {dialogues_path}")
         else:
             logger.warning("Dialogues file not found")
 
-    def _find_in_dialogues(self, user_input: str) -> Optional[str]:
-        cleaned_input = user_input.lower().strip()
-        if not cleaned_input:
+        return ClassifierData(version, intents, dialogue_index)
+
+    def reload(self) -> int:
+        """Перечитывает интенты и диалоги; запросы в процессе продолжают работать со старым снимком"""
+        data = self._load_data(version=self._data.version + 1, strict=True)
+        # Замена одной ссылкой атомарна: classify видит либо старый, либо новый снимок целиком
+        self._data = data
+        return data.version
+
+    def _find_in_dialogues(self, user_input: str, data: Optional[ClassifierData] = None) -> Optional[str]:
+        if not user_input.strip():
             return None
-            
-        for dialog in self.dialogues:
-            for i, (speaker, line) in enumerate(dialog):
-                # Конвертируем в верхний регистр для надежности
-                speaker = speaker.strip().upper()
-                
-                # Проверяем строки пользователя только в Human репликах
-                if speaker == "H":
-                    # Ищем комбинации слов
-                    line_text = line.lower()
-                    if cleaned_input in line_text or line_text in cleaned_input:
-                        # Ищем следующую реплику бота
-                        if i + 1 < len(dialog):
-                            next_speaker, next_line = dialog[i+1]
-                            next_speaker = next_speaker.strip().upper()
-                            
-                            if next_speaker in ["B", "BOT"]:
-                                return self.normalize_response(next_line)
-        return None
+        data = data or self._data
+        with metrics.timer("dialogue_lookup_seconds"):
+            response = data.dialogue_index.best(user_input, DIALOGUE_MIN_SCORE)
+        return self.normalize_response(response) if response else None
 
-    def _find_similar_in_dialogues(self, user_input: str) -> Optional[str]:
+    def _find_similar_in_dialogues(self, user_input: str, data: Optional[ClassifierData] = None) -> Optional[str]:
         """Поиск по основным ключевым словам"""
         keywords = ["привет", "пока", "спасибо", "кто"]
         for word in keywords:
             if word in user_input:
-                result = self._find_in_dialogues(word)
+                result = self._find_in_dialogues(word, data)
                 if result:
                     return result
         return None
@@ -97,33 +135,52 @@ class IntentClassifier:
 
     def classify(self, text: str, ai_mode: bool = False) -> Tuple[str, Optional[str]]:
         """Определение типа сообщения с улучшенным порядком"""
+        intent, response, _ = self.classify_with_tier(text, ai_mode)
+        return intent, response
+
+    def classify_with_tier(self, text: str, ai_mode: bool = False) -> Tuple[str, Optional[str], str]:
+        """То же, что classify, плюс уровень каскада, давший ответ (для логов и бенчмарков)"""
+        started = time.perf_counter()
+        result = self._classify(text, ai_mode)
+        metrics.observe("classify_seconds", time.perf_counter() - started, {"tier": result[2]})
+        return result
+
+    def _classify(self, text: str, ai_mode: bool) -> Tuple[str, Optional[str], str]:
         if ai_mode:
-            return "ai_direct", None
+            return "ai_direct", None, TIER_AI_DIRECT
             
         cleaned_text = text.lower().strip()
         if not cleaned_text:
-            return "unknown", None
+            return "unknown", None, TIER_EMPTY
         
         logger.debug(f"Classifying text: '{text}'")
+        # Один снимок данных на весь запрос, даже если параллельно идёт перезагрузка
+        data = self._data
         
-        # 1. Сначала пробуем определить интент
-        for intent, examples in self.intents.items():
-            for example in examples:
-                # Проверяем вхождение примеров в очищенный текст
-                if example in cleaned_text:
-                    logger.debug(f"Matched intent: {intent} with example: {example}")
-                    return intent, None
+        # 1. Сначала пробуем определить интент (все примеры за один проход)
+        match = data.matcher.match(cleaned_text)
+        if match:
+            intent, example = match
+            logger.debug(f"Matched intent: {intent} with example: {example}")
+            return intent, None, TIER_INTENT_MATCH
         
         # 2. Пробуем найти ответ в диалогах
-        dialog_response = self._find_in_dialogues(cleaned_text)
+        dialog_response = self._find_in_dialogues(cleaned_text, data)
         if dialog_response:
             logger.debug(f"Found dialog response: {dialog_response}")
-            return "dialogue_answer", dialog_response
+            return "dialogue_answer", dialog_response, TIER_DIALOGUE
         
         # 3. Пробуем похожие базовые фразы
-        similar_response = self._find_similar_in_dialogues(cleaned_text)
+        similar_response = self._find_similar_in_dialogues(cleaned_text, data)
         if similar_response:
             logger.debug(f"Found similar response: {similar_response}")
-            return "dialogue_answer", similar_response
+            return "dialogue_answer", similar_response, TIER_SIMILAR
+        
+        # 4. ML-классификатор: только уверенные предсказания, остальное уходит в AI
+        if self.ml_service is not None:
+            intent, confidence = self.ml_service.predict_intent(cleaned_text)
+            if intent in data.intents and confidence >= ML_MIN_CONFIDENCE:
+                logger.debug(f"ML intent: {intent} ({confidence:.2f})")
+                return intent, None, TIER_ML
             
-        return "unknown", None
+        return "unknown", None, TIER_FALLTHROUGH
@@ -0,0 +1,93 @@
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class AhoCorasick:
+    """Автомат Ахо-Корасик: поиск всех вхождений набора шаблонов за один проход по тексту"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, object]]] = [[]]
+        self._built = False
+
+    def add(self, pattern: str, value: object) -> None:
+        if self._built:
+            raise RuntimeError("Automaton is already built")
+        if not pattern:
+            return
+
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((len(pattern), value))
+
+    def build(self) -> None:
+        """Вычисление суффиксных ссылок обходом в ширину"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fallback = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fallback if fallback != next_state else 0
+                # Выходы суффиксной ссылки наследуются, чтобы не ходить по цепочке при поиске
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, object]]:
+        """(позиция конца, длина шаблона, значение) для каждого вхождения"""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, value in output[state]:
+                yield position, length, value
+
+
+class IntentMatcher:
+    """Поиск интентов по примерам из intents.json.
+
+    Все примеры компилируются в один автомат. Пример должен начинаться с начала
+    слова ("хай" не находится в "отдыхай"), а конец может приходиться на середину
+    слова: в intents.json есть основы вроде "квартир". Если в тексте нашлось
+    несколько примеров, побеждает самый длинный, при равной длине — интент,
+    объявленный в intents.json раньше.
+    """
+
+    def __init__(self, intents: Dict[str, List[str]]):
+        self._automaton = AhoCorasick()
+        self.patterns = 0
+        for order, (intent, examples) in enumerate(intents.items()):
+            for example in examples:
+                example = example.lower().strip()
+                if example:
+                    self._automaton.add(example, (order, intent, example))
+                    self.patterns += 1
+        self._automaton.build()
+
+    def match(self, text: str) -> Optional[Tuple[str, str]]:
+        """(интент, пример) с наивысшим приоритетом или None"""
+        best = None
+        best_key = None
+        for end, length, (order, intent, example) in self._automaton.iter_matches(text):
+            start = end - length + 1
+            if start and text[start - 1].isalnum():
+                continue
+            key = (-length, order)
+            if best_key is None or key < best_key:
+                best_key = key
+                best = (intent, example)
+        return best
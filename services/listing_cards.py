@@ -0,0 +1,136 @@
+import hashlib
+import html
+import json
+import threading
+from collections import OrderedDict
+from typing import Iterable, Iterator, Optional, Tuple
+from .metrics import metrics
+from .text_normalization import normalize_text
+
+# Меняется вместе с шаблоном карточки: сохранённые карточки старого вида перерисовываются
+CARD_FORMAT_VERSION = 1
+
+STYLE_EMOJIS = {
+    "luxury": "💎 Люкс",
+    "standard": "🏠 Стандарт",
+    "budget": "💰 Бюджетный вариант"
+}
+
+
+def content_hash(record: dict) -> str:
+    """Хэш содержимого объявления: одинаковые объявления дают один и тот же хэш"""
+    canonical = json.dumps(record, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+def listing_key(record: dict) -> str:
+    """Хэш полей, определяющих объект: повторная выгрузка того же объявления без фото или
+    с другим описанием считается дубликатом"""
+    identity = [
+        normalize_text(str(record.get("address", ""))),
+        float(record.get("area", 0)),
+        int(record.get("rooms", 0)),
+        int(record.get("price", 0)),
+        bool(record.get("rental", False)),
+    ]
+    return hashlib.sha256(json.dumps(identity, ensure_ascii=False).encode("utf-8")).hexdigest()[:32]
+
+
+def dedup_records(records: Iterable[dict]) -> Iterator[Tuple[str, dict]]:
+    """(хэш содержимого, объявление) без дубликатов; остаётся первое вхождение"""
+    seen = set()
+    for record in records:
+        key = listing_key(record)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield content_hash(record), record
+
+
+def render_card(apt: dict) -> str:
+    """HTML-карточка объявления для parse_mode="HTML" """
+    style = STYLE_EMOJIS.get(apt.get("style", "standard"))
+    features = "\n".join(f"• {html.escape(str(feat))}" for feat in apt.get("features", []))
+
+    return (
+        f"{style}\n"
+        f"📍 {html.escape(str(apt['address']))}\n"
+        f"📏 {apt['area']} м² | 🛏️ {apt['rooms']} комнаты\n"
+        f"💵 {apt['price']:,} руб.{' в месяц' if apt.get('rental', False) else ''}\n\n"
+        f"🔮 Особенности:\n{features}\n\n"
+        f"📝 {html.escape(str(apt.get('description', '')))}\n\n"
+        f"👤 {html.escape(str(apt.get('contact', 'Контакты отсутствуют')))}"
+    )
+
+
+class CardCache:
+    """Готовые карточки объявлений по хэшу содержимого.
+
+    Карточка рисуется один раз — при загрузке каталога или первом показе — и
+    дальше отдаётся готовой строкой. Изменённое объявление получает новый хэш,
+    поэтому перерисовывается только оно. Попадание — карточка уже была готова
+    (в памяти или сохранена в каталоге), промах — пришлось рисовать.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cards: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._cards)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _count(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+            metrics.inc("card_cache_hits_total")
+        else:
+            self.misses += 1
+            metrics.inc("card_cache_misses_total")
+
+    def _store(self, digest: str, card: str) -> None:
+        self._cards[digest] = card
+        self._cards.move_to_end(digest)
+        while len(self._cards) > self.max_entries:
+            self._cards.popitem(last=False)
+
+    def get(self, digest: str, record: dict, stored: Optional[str] = None) -> str:
+        with self._lock:
+            card = self._cards.get(digest)
+            if card is not None:
+                self._cards.move_to_end(digest)
+                self._count(True)
+                return card
+            if stored is not None:
+                self._store(digest, stored)
+                self._count(True)
+                return stored
+
+        card = render_card(record)
+        with self._lock:
+            self._store(digest, card)
+            self._count(False)
+        return card
+
+    def prerender(self, items: Iterable[Tuple[str, dict]]) -> int:
+        """Отрисовка карточек при загрузке каталога; готовые карточки не перерисовываются"""
+        rendered = 0
+        for digest, record in items:
+            # Больше, чем помещается в кэш, рисовать заранее бессмысленно — остальные нарисуются при показе
+            if rendered >= self.max_entries:
+                break
+            with self._lock:
+                if digest in self._cards:
+                    continue
+            card = render_card(record)
+            with self._lock:
+                self._store(digest, card)
+            rendered += 1
+        return rendered
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import suppress
+from typing import AsyncIterator, Callable, Deque, Dict, Hashable, Optional
+from .inference_worker import InferenceError
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerBusy(InferenceError):
+    """Очередь к модели переполнена"""
+
+
+class RequestCancelled(InferenceError):
+    """Запрос отменён более новым сообщением того же пользователя"""
+
+
+class _Ticket:
+    def __init__(self, user_id: Hashable):
+        self.user_id = user_id
+        self.enqueued_at = time.monotonic()
+        self.granted = asyncio.Event()
+        self.cancelled = asyncio.Event()
+        self.running = False
+
+
+class LLMScheduler:
+    """Планировщик запросов к модели.
+
+    Ограниченная очередь с отказом при переполнении, круговой обход
+    пользователей (один активный пользователь не занимает модель у остальных)
+    и отмена устаревших запросов: новое сообщение пользователя снимает
+    его предыдущий запрос из очереди или прерывает уже идущую генерацию.
+    """
+
+    def __init__(self, concurrency: int = 1, max_queue: int = 16, cancel_stale: bool = True):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.cancel_stale = cancel_stale
+        self._queues: Dict[Hashable, Deque[_Ticket]] = {}
+        self._rotation: Deque[Hashable] = deque()
+        self._running: Dict[Hashable, _Ticket] = {}
+        self._active = 0
+        self._queued = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def _update_gauges(self) -> None:
+        metrics.set_gauge("llm_queue_depth", self._queued)
+        metrics.set_gauge("llm_active_requests", self._active)
+
+    def _cancel_user(self, user_id: Hashable) -> None:
+        queue = self._queues.pop(user_id, None)
+        if queue:
+            for ticket in queue:
+                ticket.cancelled.set()
+            self._queued -= len(queue)
+            metrics.inc("llm_requests_cancelled_total", len(queue))
+            with suppress(ValueError):
+                self._rotation.remove(user_id)
+
+        running = self._running.get(user_id)
+        if running is not None and not running.cancelled.is_set():
+            running.cancelled.set()
+            metrics.inc("llm_requests_cancelled_total")
+
+    def cancel(self, user_id: Hashable) -> None:
+        """Отмена запросов пользователя, который прислал новое сообщение.
+
+        Вызывается до того, как новое сообщение дойдёт до обработчика: иначе
+        оно ждало бы в очереди обновлений пользователя конца генерации,
+        которую должно прервать.
+        """
+        if not self.cancel_stale:
+            return
+        self._cancel_user(user_id)
+        self._update_gauges()
+
+    def _dispatch(self) -> None:
+        while self._active < self.concurrency and self._rotation:
+            user_id = self._rotation.popleft()
+            queue = self._queues[user_id]
+            ticket = queue.popleft()
+            if queue:
+                self._rotation.append(user_id)
+            else:
+                del self._queues[user_id]
+
+            self._queued -= 1
+            self._active += 1
+            ticket.running = True
+            self._running[user_id] = ticket
+            metrics.observe("llm_queue_wait_seconds", time.monotonic() - ticket.enqueued_at)
+            ticket.granted.set()
+        self._update_gauges()
+
+    def _release(self, ticket: _Ticket) -> None:
+        if ticket.running:
+            ticket.running = False
+            self._active -= 1
+            if self._running.get(ticket.user_id) is ticket:
+                del self._running[ticket.user_id]
+        self._dispatch()
+
+    def _enqueue(self, user_id: Hashable) -> _Ticket:
+        if self.cancel_stale:
+            self._cancel_user(user_id)
+
+        if self._queued >= self.max_queue:
+            metrics.inc("llm_requests_rejected_total")
+            self._update_gauges()
+            raise SchedulerBusy(f"Очередь к модели заполнена ({self._queued})")
+
+        ticket = _Ticket(user_id)
+        if user_id not in self._queues:
+            self._queues[user_id] = deque()
+            self._rotation.append(user_id)
+        self._queues[user_id].append(ticket)
+        self._queued += 1
+        self._dispatch()
+        return ticket
+
+    def _withdraw(self, ticket: _Ticket) -> None:
+        """Снимает запрос, чей обработчик был отменён до начала генерации"""
+        queue = self._queues.get(ticket.user_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self._queued -= 1
+            if not queue:
+                del self._queues[ticket.user_id]
+                with suppress(ValueError):
+                    self._rotation.remove(ticket.user_id)
+        self._release(ticket)
+
+    async def _wait_granted(self, ticket: _Ticket) -> None:
+        if ticket.granted.is_set():
+            return
+
+        cancel_wait = asyncio.ensure_future(ticket.cancelled.wait())
+        grant_wait = asyncio.ensure_future(ticket.granted.wait())
+        try:
+            await asyncio.wait({cancel_wait, grant_wait}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            cancel_wait.cancel()
+            grant_wait.cancel()
+
+        if not ticket.granted.is_set():
+            raise RequestCancelled("Запрос заменён более новым")
+
+    async def stream(
+        self,
+        user_id: Optional[Hashable],
+        make_stream: Callable[[], AsyncIterator[str]]
+    ) -> AsyncIterator[str]:
+        """Выполняет потоковую генерацию, когда до пользователя дойдёт очередь"""
+        if user_id is None:
+            user_id = object()
+
+        ticket = self._enqueue(user_id)
+        try:
+            await self._wait_granted(ticket)
+        except asyncio.CancelledError:
+            self._withdraw(ticket)
+            raise
+
+        source = make_stream()
+        cancel_wait = asyncio.ensure_future(ticket.cancelled.wait())
+        try:
+            while True:
+                next_item = asyncio.ensure_future(source.__anext__())
+                await asyncio.wait({next_item, cancel_wait}, return_when=asyncio.FIRST_COMPLETED)
+                if not next_item.done():
+                    # Пришло новое сообщение: прерываем генерацию в воркере
+                    next_item.cancel()
+                    with suppress(asyncio.CancelledError, StopAsyncIteration, InferenceError):
+                        await next_item
+                    raise RequestCancelled("Генерация прервана более новым запросом")
+                try:
+                    delta = next_item.result()
+                except StopAsyncIteration:
+                    return
+                yield delta
+        finally:
+            cancel_wait.cancel()
+            await source.aclose()
+            self._release(ticket)
@@ -0,0 +1,226 @@
+import bisect
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Границы корзин гистограмм длительностей (секунды): от миллисекунд до минуты генерации
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+_NAME_RE = re.compile(r"[^a-zA-Z0-9_:]")
+
+
+def _key(name: str, labels: Optional[dict]) -> _Key:
+    if not labels:
+        return name, ()
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _display(key: _Key) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{_NAME_RE.sub("_", label)}="{_escape(value)}"' for label, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "labels", "started")
+
+    def __init__(self, metrics: "Metrics", name: str, labels: Optional[dict]):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.metrics.observe(self.name, time.perf_counter() - self.started, self.labels)
+
+
+class Metrics:
+    """Потокобезопасный реестр счётчиков, текущих значений и распределений.
+
+    У каждой метрики могут быть метки (labels). Наблюдения за метриками с
+    суффиксом _seconds попадают в гистограмму с корзинами LATENCY_BUCKETS,
+    остальные — в сводку (число, сумма, максимум). Запись — одна блокировка
+    и поиск корзины, поэтому метрики можно вызывать на горячем пути.
+    Значения, которые дорого поддерживать постоянно (RSS, доли попаданий),
+    вычисляют сборщики в момент выгрузки.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[_Key, float] = defaultdict(float)
+        self._gauges: Dict[_Key, float] = {}
+        # ключ -> [count, sum, max]
+        self._summaries: Dict[_Key, List[float]] = {}
+        # ключ -> число наблюдений по корзинам (последняя — +Inf)
+        self._histograms: Dict[_Key, List[int]] = {}
+        self._buckets: Dict[str, Sequence[float]] = {}
+        self._collectors: List[Callable[["Metrics"], None]] = []
+
+    def set_buckets(self, name: str, buckets: Sequence[float]) -> None:
+        """Свои корзины гистограммы (по умолчанию — только для метрик *_seconds)"""
+        with self._lock:
+            self._buckets[name] = tuple(sorted(buckets))
+
+    def _bucket_bounds(self, name: str) -> Optional[Sequence[float]]:
+        buckets = self._buckets.get(name)
+        if buckets is None and name.endswith("_seconds"):
+            buckets = self._buckets[name] = LATENCY_BUCKETS
+        return buckets
+
+    def inc(self, name: str, value: float = 1.0, labels: Optional[dict] = None) -> None:
+        with self._lock:
+            self._counters[_key(name, labels)] += value
+
+    def set_gauge(self, name: str, value: float, labels: Optional[dict] = None) -> None:
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, labels: Optional[dict] = None) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                self._summaries[key] = [1, value, value]
+            else:
+                summary[0] += 1
+                summary[1] += value
+                summary[2] = max(summary[2], value)
+
+            buckets = self._bucket_bounds(name)
+            if buckets is not None:
+                counts = self._histograms.get(key)
+                if counts is None:
+                    counts = self._histograms[key] = [0] * (len(buckets) + 1)
+                counts[bisect.bisect_left(buckets, value)] += 1
+
+    def timer(self, name: str, labels: Optional[dict] = None) -> _Timer:
+        """with metrics.timer("classify_seconds"): ... — длительность блока в гистограмму"""
+        return _Timer(self, name, labels)
+
+    def counter(self, name: str, labels: Optional[dict] = None) -> float:
+        with self._lock:
+            return self._counters.get(_key(name, labels), 0.0)
+
+    def add_collector(self, collector: Callable[["Metrics"], None]) -> None:
+        """Функция, обновляющая метрики перед выгрузкой"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> None:
+        with self._lock:
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                collector(self)
+            except Exception:
+                # Сборщик не должен ломать выгрузку остальных метрик
+                self.inc("metrics_collector_errors_total")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": {_display(key): value for key, value in self._counters.items()},
+                "gauges": {_display(key): value for key, value in self._gauges.items()},
+                "summaries": {
+                    _display(key): {"count": count, "sum": total, "avg": total / count, "max": peak}
+                    for key, (count, total, peak) in self._summaries.items()
+                }
+            }
+
+    def render_prometheus(self) -> str:
+        """Текстовый формат Prometheus (version 0.0.4)"""
+        self.collect()
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            summaries = sorted((key, list(value)) for key, value in self._summaries.items())
+            histograms = {key: list(counts) for key, counts in self._histograms.items()}
+            buckets = dict(self._buckets)
+
+        # Все строки одной метрики должны идти подряд под одной строкой TYPE
+        families: Dict[str, Tuple[str, List[str]]] = {}
+
+        def family(name: str, kind: str) -> Tuple[str, List[str]]:
+            name = _NAME_RE.sub("_", name)
+            if name not in families:
+                families[name] = (kind, [])
+            return name, families[name][1]
+
+        for (name, labels), value in counters:
+            name, lines = family(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), value in gauges:
+            name, lines = family(name, "gauge")
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for key, (count, total, peak) in summaries:
+            name, labels = key
+            counts = histograms.get(key)
+            if counts is not None:
+                metric, lines = family(name, "histogram")
+                cumulative = 0
+                for bound, observed in zip(list(buckets[name]) + [math.inf], counts):
+                    cumulative += observed
+                    le = ("le", _format_value(bound))
+                    lines.append(f"{metric}_bucket{_format_labels(labels, le)} {cumulative}")
+            else:
+                metric, lines = family(name, "summary")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {_format_value(count)}")
+            peak_name, peak_lines = family(f"{name}_max", "gauge")
+            peak_lines.append(f"{peak_name}{_format_labels(labels)} {_format_value(peak)}")
+
+        output = []
+        for name, (kind, lines) in families.items():
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(lines)
+        return "\n".join(output) + "\n"
+
+
+metrics = Metrics()
+
+
+class StartupProfile:
+    """Длительность этапов запуска бота"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def mark(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            if stage in self.stages:
+                return
+            self.stages[stage] = seconds
+        metrics.set_gauge(f"startup_{stage}_seconds", seconds)
+
+    def summary(self) -> str:
+        with self._lock:
+            return ", ".join(f"{stage}={seconds:.2f}s" for stage, seconds in self.stages.items())
+
+
+startup_profile = StartupProfile()
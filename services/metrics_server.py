@@ -0,0 +1,53 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from .metrics import Metrics, metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsServer:
+    """HTTP-эндпоинт /metrics для Prometheus в отдельном потоке.
+
+    Метрики собираются только при запросе, поэтому сервер ничего не стоит
+    обработчикам сообщений. Слушает локальный адрес: наружу метрики
+    отдаются через прокси или агент сбора.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9108, registry: Optional[Metrics] = None):
+        self.host = host
+        self.port = port
+        self.registry = registry or default_metrics
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def start(self) -> None:
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info(f"Metrics endpoint: http://{self.host}:{self.port}/metrics")
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -1,48 +1,159 @@
 # services/ml_service.py
+from sklearn.calibration import CalibratedClassifierCV
 from sklearn.svm import LinearSVC
 from sklearn.feature_extraction.text import TfidfVectorizer
+import sklearn
 import numpy as np
+import hashlib
+import joblib
 import json
 import logging
+from collections import Counter
 from pathlib import Path
-from typing import Tuple
+from typing import List, Optional, Sequence, Tuple
 
 logger = logging.getLogger(__name__)
 
+MODEL_FORMAT_VERSION = 1
+# Меньше примеров на интент — калибровка по фолдам невозможна, уверенность через softmax
+MIN_CALIBRATION_FOLDS = 2
+MAX_CALIBRATION_FOLDS = 3
+
+
+class _Model:
+    """Обученная пара векторизатор + классификатор; заменяется целиком при переобучении"""
+
+    def __init__(self, vectorizer: TfidfVectorizer, clf, calibrated: bool, data_hash: str):
+        self.vectorizer = vectorizer
+        self.clf = clf
+        self.calibrated = calibrated
+        self.data_hash = data_hash
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
 class MLService:
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer(analyzer='char', ngram_range=(3, 3))
-        self.clf = LinearSVC(dual=False, random_state=42)
-        self._load_data()
+    """TF-IDF по символьным триграммам + LinearSVC по примерам из intents.json.
+
+    Обученная модель сохраняется на диск вместе с хэшем обучающих данных и
+    при старте загружается, а не обучается заново, пока intents.json не
+    изменится.
+    """
+
+    def __init__(self, data_path: Optional[Path] = None, model_path: Optional[Path] = None):
+        self.data_path = data_path or Path(__file__).parent.parent / "data" / "intents.json"
+        self.model_path = model_path
+        self._model = self._load_data()
+
+    @property
+    def vectorizer(self) -> TfidfVectorizer:
+        return self._model.vectorizer
+
+    @property
+    def clf(self):
+        return self._model.clf
 
-    def _load_data(self):
+    def _data_hash(self, raw: bytes) -> str:
+        digest = hashlib.sha256(raw)
+        # Модель, сохранённая другой версией scikit-learn, может не загрузиться или вести себя иначе
+        digest.update(f"\n{MODEL_FORMAT_VERSION}\n{sklearn.__version__}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _load_data(self) -> _Model:
         try:
-            data_path = Path(__file__).parent.parent / "data" / "intents.json"
-            with open(data_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            with open(self.data_path, 'rb') as f:
+                raw = f.read()
+            data_hash = self._data_hash(raw)
+
+            model = self._load_saved(data_hash)
+            if model is not None:
+                logger.info(f"ML model loaded from {self.model_path}")
+                return model
 
+            data = json.loads(raw.decode("utf-8"))
             X = []
             y = []
             for intent, examples in data.items():
                 X.extend(examples)
                 y.extend([intent] * len(examples))
 
-            self.X = self.vectorizer.fit_transform(X)
-            self.clf.fit(self.X, y)
-            logger.info("ML model loaded successfully")
+            model = self._train(X, y, data_hash)
+            logger.info(f"ML model trained on {len(X)} examples (calibrated: {model.calibrated})")
+            self._save(model)
+            return model
         except Exception as e:
             logger.error(f"Failed to load ML model: {e}")
             raise
 
-    def predict_intent(self, text: str) -> Tuple[str, float]:
+    def _train(self, X: List[str], y: List[str], data_hash: str) -> _Model:
+        vectorizer = TfidfVectorizer(analyzer='char', ngram_range=(3, 3))
+        features = vectorizer.fit_transform(X)
+        folds = min(MAX_CALIBRATION_FOLDS, min(Counter(y).values()))
+        if folds >= MIN_CALIBRATION_FOLDS:
+            clf = CalibratedClassifierCV(LinearSVC(dual=False, random_state=42), cv=folds)
+            calibrated = True
+        else:
+            clf = LinearSVC(dual=False, random_state=42)
+            calibrated = False
+        clf.fit(features, y)
+        return _Model(vectorizer, clf, calibrated, data_hash)
+
+    def _load_saved(self, data_hash: str) -> Optional[_Model]:
+        if self.model_path is None or not self.model_path.exists():
+            return None
         try:
-            vec = self.vectorizer.transform([text])
-            decision = self.clf.decision_function(vec)
-            confidence = np.max(decision)
-            intent = self.clf.predict(vec)[0]
-            return intent, float(confidence)
+            model = joblib.load(self.model_path)
+        except Exception as e:
+            logger.warning(f"Saved ML model is unreadable: {e}")
+            return None
+        if not isinstance(model, _Model) or model.data_hash != data_hash:
+            return None
+        return model
+
+    def _save(self, model: _Model) -> None:
+        if self.model_path is None:
+            return
+        try:
+            self.model_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.model_path.with_suffix(".tmp")
+            joblib.dump(model, tmp_path)
+            tmp_path.replace(self.model_path)
+        except OSError as e:
+            logger.warning(f"Failed to save ML model: {e}")
+
+    def reload(self) -> str:
+        """Переобучение после изменения intents.json; запросы в процессе используют старую модель"""
+        self._model = self._load_data()
+        return self._model.data_hash[:12]
+
+    def predict_batch(self, texts: Sequence[str]) -> List[Tuple[str, float]]:
+        """(интент, уверенность 0..1) для каждого текста за один проход векторизатора и классификатора"""
+        if not texts:
+            return []
+        model = self._model
+        try:
+            vec = model.vectorizer.transform(texts)
+            if model.calibrated:
+                probabilities = model.clf.predict_proba(vec)
+            else:
+                scores = model.clf.decision_function(vec)
+                if scores.ndim == 1:
+                    # Два класса: decision_function возвращает одну колонку
+                    scores = np.column_stack([-scores, scores])
+                probabilities = _softmax(scores)
+            best = probabilities.argmax(axis=1)
+            classes = model.clf.classes_
+            return [
+                (str(classes[index]), float(probabilities[row, index]))
+                for row, index in enumerate(best)
+            ]
         except Exception as e:
             logger.error(f"Prediction error: {e}")
-            return "unknown", 0.0
+            return [("unknown", 0.0)] * len(texts)
 
-ml_service = MLService()
\ No newline at end of file
+    def predict_intent(self, text: str) -> Tuple[str, float]:
+        return self.predict_batch([text])[0]
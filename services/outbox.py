@@ -0,0 +1,303 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from telegram.error import RetryAfter
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Telegram на длину текста одного сообщения
+MAX_MESSAGE_LENGTH = 4096
+MESSAGE_SEPARATOR = "\n\n"
+
+# Меньше — раньше: ответ на сообщение пользователя идёт впереди рекомендаций
+PRIORITY_INTERACTIVE = 0
+PRIORITY_RECOMMENDATION = 10
+
+# Как часто (секунды) удаляются вёдра чатов, в которых давно ничего не отправлялось
+BUCKET_SWEEP_INTERVAL = 60.0
+
+
+def split_text(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Разбиение длинного текста по абзацам и строкам (HTML-теги не переходят через строку)"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind(MESSAGE_SEPARATOR, 0, limit)
+        if cut <= 0:
+            cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip("\n")
+    if text:
+        parts.append(text)
+    return parts
+
+
+class TokenBucket:
+    """Ведро токенов: rate в секунду, не больше burst подряд"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Сколько ждать до следующего токена (0 — можно отправлять)"""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """retry_after от Telegram: до его истечения токенов нет"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    @property
+    def idle(self) -> bool:
+        return self.delay() == 0 and self.tokens >= self.burst
+
+
+class _Item:
+    __slots__ = ("method", "args", "kwargs", "text", "coalesce", "futures", "enqueued_at")
+
+    def __init__(self, method: Callable[..., Awaitable], args: tuple, kwargs: dict,
+                 text: Optional[str] = None, coalesce: bool = False):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.text = text
+        self.coalesce = coalesce
+        self.futures: List[asyncio.Future] = [asyncio.get_running_loop().create_future()]
+        self.enqueued_at = time.monotonic()
+
+    def can_absorb(self, other: "_Item", limit: int) -> bool:
+        return (
+            self.coalesce and other.coalesce
+            and self.method == other.method
+            and self.kwargs == other.kwargs
+            and len(self.text) + len(MESSAGE_SEPARATOR) + len(other.text) <= limit
+        )
+
+    def absorb(self, other: "_Item") -> None:
+        self.text = f"{self.text}{MESSAGE_SEPARATOR}{other.text}"
+        self.futures.extend(other.futures)
+
+    def resolve(self, result: Any = None, error: Optional[BaseException] = None) -> None:
+        for future in self.futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+class Outbox:
+    """Очередь исходящих сообщений Telegram.
+
+    У каждого чата своя очередь, которую разбирает одна задача, поэтому
+    порядок сообщений в чате сохраняется. Подряд идущие тексты чата с
+    одинаковыми параметрами склеиваются в одно сообщение в пределах
+    4096 символов. Отправка ограничена ведром токенов чата и общим ведром
+    бота; общее ведро выдаёт токены по приоритету, так что ответы
+    пользователям не ждут за рекомендациями. RetryAfter приостанавливает
+    чат на указанное Telegram время, после чего отправка повторяется.
+    """
+
+    def __init__(
+        self,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3,
+        group_rate: float = 20 / 60,
+        global_rate: float = 30.0,
+        max_retries: int = 5,
+        max_length: int = MAX_MESSAGE_LENGTH
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.max_length = max_length
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets: Dict[int, TokenBucket] = {}
+        # chat_id -> куча (приоритет, порядковый номер, элемент)
+        self._queues: Dict[int, list] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        # Ожидающие общего токена: (приоритет, порядковый номер, future)
+        self._waiters: list = []
+        self._granter: Optional[asyncio.Task] = None
+        self._seq = itertools.count()
+        self._queued = 0
+        self._swept_at = time.monotonic()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def send_message(
+        self,
+        bot,
+        chat_id: int,
+        text: str,
+        priority: int = PRIORITY_INTERACTIVE,
+        coalesce: bool = True,
+        **kwargs
+    ) -> asyncio.Future:
+        """Текст в очередь чата; future завершается отправленным сообщением.
+
+        Сообщения с клавиатурой и coalesce=False (например, то, что потом
+        редактируется) не склеиваются с соседними.
+        """
+        coalesce = coalesce and kwargs.get("reply_markup") is None
+        parts = split_text(text, self.max_length)
+        futures = [
+            self._put(chat_id, priority, _Item(bot.send_message, (chat_id,), kwargs, text=part, coalesce=coalesce))
+            for part in parts
+        ]
+        # Длинный текст уходит несколькими сообщениями — результат по последнему
+        for future in futures[:-1]:
+            future.add_done_callback(_consume)
+        return futures[-1]
+
+    def call(self, chat_id: int, method: Callable[..., Awaitable], *args,
+             priority: int = PRIORITY_INTERACTIVE, **kwargs) -> asyncio.Future:
+        """Любой другой запрос к Bot API в чат (фото, голос, правка, удаление) в общей очереди"""
+        return self._put(chat_id, priority, _Item(method, args, kwargs))
+
+    def _put(self, chat_id: int, priority: int, item: _Item) -> asyncio.Future:
+        heapq.heappush(self._queues.setdefault(chat_id, []), (priority, next(self._seq), item))
+        self._queued += 1
+        metrics.set_gauge("outbox_queue_depth", self._queued)
+        worker = self._workers.get(chat_id)
+        if worker is None or worker.done():
+            self._workers[chat_id] = asyncio.get_running_loop().create_task(self._drain(chat_id))
+        return item.futures[0]
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            self._sweep_buckets()
+            # Отрицательный id — группа: там лимит Telegram около 20 сообщений в минуту
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.chat_burst if chat_id > 0 else 1)
+        return bucket
+
+    def _sweep_buckets(self) -> None:
+        """Удаление вёдер простаивающих чатов; сразу после отправки ведро ещё не полное,
+        поэтому чистка идёт не в _drain, а периодически при появлении нового чата"""
+        now = time.monotonic()
+        if now - self._swept_at < BUCKET_SWEEP_INTERVAL:
+            return
+        self._swept_at = now
+        idle = [
+            chat_id for chat_id, bucket in self._buckets.items()
+            if chat_id not in self._queues and chat_id not in self._workers and bucket.idle
+        ]
+        for chat_id in idle:
+            del self._buckets[chat_id]
+
+    def _next_item(self, chat_id: int) -> tuple:
+        queue = self._queues[chat_id]
+        priority, _, item = heapq.heappop(queue)
+        taken = 1
+        if item.coalesce:
+            while queue and item.can_absorb(queue[0][2], self.max_length):
+                item.absorb(heapq.heappop(queue)[2])
+                taken += 1
+        if taken > 1:
+            metrics.inc("outbox_coalesced_total", taken - 1)
+        self._queued -= taken
+        metrics.set_gauge("outbox_queue_depth", self._queued)
+        return priority, item
+
+    async def _drain(self, chat_id: int) -> None:
+        bucket = self._bucket(chat_id)
+        try:
+            while self._queues.get(chat_id):
+                delay = bucket.delay()
+                if delay > 0:
+                    # Пока чат ждёт, в очередь успевают встать новые тексты для склейки
+                    await asyncio.sleep(delay)
+                    continue
+                priority, item = self._next_item(chat_id)
+                await self._send(chat_id, bucket, priority, item)
+        finally:
+            self._workers.pop(chat_id, None)
+            if not self._queues.get(chat_id):
+                self._queues.pop(chat_id, None)
+                if bucket.idle:
+                    self._buckets.pop(chat_id, None)
+
+    async def _send(self, chat_id: int, bucket: TokenBucket, priority: int, item: _Item) -> None:
+        for attempt in range(self.max_retries + 1):
+            await self._acquire_global(priority)
+            bucket.take()
+            started = time.perf_counter()
+            method = getattr(item.method, "__name__", "call")
+            try:
+                if item.text is not None:
+                    result = await item.method(*item.args, item.text, **item.kwargs)
+                else:
+                    result = await item.method(*item.args, **item.kwargs)
+            except RetryAfter as e:
+                retry_after = float(getattr(e.retry_after, "total_seconds", lambda: e.retry_after)())
+                metrics.inc("outbox_retry_after_total")
+                if attempt == self.max_retries:
+                    logger.warning(f"Chat {chat_id} is still throttled after {attempt} retries")
+                    item.resolve(error=e)
+                    return
+                logger.warning(f"Telegram flood control in chat {chat_id}: retry in {retry_after}s")
+                bucket.pause(retry_after)
+                await asyncio.sleep(bucket.delay())
+                continue
+            except Exception as e:
+                metrics.inc("outbox_errors_total")
+                item.resolve(error=e)
+                return
+            metrics.observe("telegram_send_seconds", time.perf_counter() - started, {"method": method})
+            metrics.inc("outbox_sent_total")
+            metrics.observe("outbox_wait_seconds", time.monotonic() - item.enqueued_at)
+            item.resolve(result)
+            return
+
+    async def _acquire_global(self, priority: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._granter is None or self._granter.done():
+            self._granter = asyncio.get_running_loop().create_task(self._grant())
+        await future
+
+    async def _grant(self) -> None:
+        """Раздача общих токенов: первым получает ожидающий с меньшим приоритетом"""
+        while self._waiters:
+            delay = self._global.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._global.take()
+                future.set_result(None)
+
+
+def _consume(future: asyncio.Future) -> None:
+    # Ошибка промежуточной части уже видна по последней; не даём asyncio ругаться на неё
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Message part send error: {str(future.exception())}")
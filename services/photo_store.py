@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow необязателен: без него фото отправляются как есть
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Telegram сам ужимает фото до 1280 px по большей стороне — больше отправлять незачем
+MAX_SIDE = 1280
+JPEG_QUALITY = 85
+
+
+class PhotoStore:
+    """Фотографии объявлений: подготовка один раз при загрузке каталога и повторное
+    использование file_id Telegram вместо повторной загрузки.
+
+    Подготовленный файл и file_id привязаны к хэшу содержимого исходного фото,
+    поэтому замена картинки под тем же именем приводит к новой загрузке.
+    """
+
+    def __init__(self, images_dir: Path, cache_dir: Path, db_path: Path):
+        self.images_dir = images_dir
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        # имя фото -> (mtime_ns, size, хэш содержимого)
+        self._digests: Dict[str, Tuple[int, int, str]] = {}
+        self._file_ids: Dict[str, str] = {}
+        self._db = None
+        self._open_db(db_path)
+        if Image is None:
+            logger.warning("Pillow is not installed, listing photos are sent without resizing")
+
+    def _open_db(self, path: Path) -> None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS photo_ids ("
+                "digest TEXT PRIMARY KEY, file_id TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+            self._db.commit()
+            self._file_ids = dict(self._db.execute("SELECT digest, file_id FROM photo_ids").fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"Photo file_id store disabled: {str(e)}")
+            self._db = None
+
+    def _digest(self, name: str) -> Optional[str]:
+        # Хэш считается без блокировки: под ней — только словарь
+        source = self.images_dir / name
+        try:
+            stat = source.stat()
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._digests.get(name)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        digest = hashlib.sha256(source.read_bytes()).hexdigest()[:32]
+        with self._lock:
+            self._digests[name] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def _prepared_path(self, digest: str) -> Path:
+        return self.cache_dir / f"{digest}.jpg"
+
+    def prepare(self, name: str) -> Optional[Path]:
+        """Уменьшенная и пережатая копия фото (исходный файл, если Pillow нет)"""
+        if not name:
+            return None
+        digest = self._digest(name)
+        if digest is None:
+            return None
+        source = self.images_dir / name
+        if Image is None:
+            return source
+
+        target = self._prepared_path(digest)
+        if target.exists():
+            return target
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with Image.open(source) as image:
+                image = ImageOps.exif_transpose(image).convert("RGB")
+                image.thumbnail((MAX_SIDE, MAX_SIDE))
+                # Своё имя временного файла: то же фото может готовиться и при отправке
+                tmp_path = target.with_suffix(f".{threading.get_ident()}.tmp")
+                image.save(tmp_path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+            tmp_path.replace(target)
+        except Exception as e:
+            logger.warning(f"Failed to prepare photo {name}: {str(e)}")
+            return source
+        return target
+
+    def prepare_all(self, names: Iterable[str]) -> int:
+        """Подготовка фото при загрузке каталога, а не при каждой отправке.
+
+        Блокировка не берётся: отправка фото в это время не ждёт пережатия всего каталога.
+        """
+        started = time.perf_counter()
+        prepared = 0
+        for name in set(names):
+            if name and self.prepare(name) is not None:
+                prepared += 1
+        if prepared:
+            logger.info(f"Prepared {prepared} listing photos in {time.perf_counter() - started:.2f}s")
+        return prepared
+
+    def media(self, name: str) -> Optional[Union[str, Path]]:
+        """file_id, если фото уже загружалось в Telegram, иначе путь к подготовленному файлу"""
+        if not name:
+            return None
+        digest = self._digest(name)
+        if digest is None:
+            return None
+        with self._lock:
+            file_id = self._file_ids.get(digest)
+        if file_id:
+            return file_id
+        return self.prepare(name)
+
+    def remember(self, items: Iterable[Tuple[str, str]]) -> None:
+        """file_id загруженных фото (имя, file_id) — одной транзакцией"""
+        now = time.time()
+        rows = []
+        for name, file_id in items:
+            digest = self._digest(name)
+            if digest is not None:
+                rows.append((digest, file_id, now))
+        with self._lock:
+            rows = [row for row in rows if self._file_ids.get(row[0]) != row[1]]
+            if not rows:
+                return
+            self._file_ids.update((digest, file_id) for digest, file_id, _ in rows)
+            if self._db is not None:
+                try:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO photo_ids (digest, file_id, updated) VALUES (?, ?, ?)", rows
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"Photo file_id write error: {str(e)}")
+
+    def forget(self, names: Iterable[str]) -> None:
+        """file_id отклонены Telegram — следующая отправка загрузит файлы заново"""
+        digests = [digest for digest in map(self._digest, names) if digest is not None]
+        with self._lock:
+            digests = [digest for digest in digests if self._file_ids.pop(digest, None) is not None]
+            if not digests or self._db is None:
+                return
+            try:
+                self._db.executemany("DELETE FROM photo_ids WHERE digest = ?", [(digest,) for digest in digests])
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Photo file_id write error: {str(e)}")
+
+    def album(self, names: List[str]) -> List[Tuple[str, Union[str, Path]]]:
+        """(имя, file_id или путь) для фото, которые есть на диске, без повторов"""
+        album = []
+        for name in dict.fromkeys(name for name in names if name):
+            media = self.media(name)
+            if media is not None:
+                album.append((name, media))
+        return album
@@ -0,0 +1,120 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def process_rss_bytes(pid: Optional[int] = None) -> int:
+    """Резидентная память процесса (0, если /proc недоступен)"""
+    path = f"/proc/{pid or 'self'}/statm"
+    try:
+        with open(path, 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class ServiceRegistry:
+    """Ленивый реестр сервисов: ровно один экземпляр каждого сервиса на процесс.
+
+    Сервис создаётся при первом обращении. Объём памяти сервиса оценивается
+    приростом RSS процесса при создании за вычетом сервисов, созданных внутри
+    его фабрики (они учитываются отдельно под своими именами); сервисы, держащие память вне процесса
+    (например, модель в процессе-воркере), сообщают её методом resident_bytes().
+    """
+
+    def __init__(self, memory_budget_mb: int = 0):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._load_rss: Dict[str, int] = {}
+        self._load_seconds: Dict[str, float] = {}
+        # (RSS, секунды) вложенных созданий для каждой фабрики, которая сейчас выполняется
+        self._nested: List[List[float]] = []
+        self._lock = threading.RLock()
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        with self._lock:
+            if name in self._instances:
+                raise RuntimeError(f"Service {name} is already created")
+            self._factories[name] = factory
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._factories
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            if name in self._instances:
+                return self._instances[name]
+            if name not in self._factories:
+                raise KeyError(f"Unknown service: {name}")
+
+            rss_before = process_rss_bytes()
+            started = time.perf_counter()
+            self._nested.append([0, 0.0])
+            try:
+                instance = self._factories[name]()
+            finally:
+                nested_rss, nested_seconds = self._nested.pop()
+            seconds = time.perf_counter() - started
+            rss = max(0, process_rss_bytes() - rss_before)
+            if self._nested:
+                # Внешняя фабрика не должна записать эту память и время ещё раз на себя
+                self._nested[-1][0] += rss
+                self._nested[-1][1] += seconds
+            self._load_seconds[name] = max(0.0, seconds - nested_seconds)
+            self._load_rss[name] = max(0, rss - nested_rss)
+            self._instances[name] = instance
+
+            logger.info(
+                f"Service {name} created in {self._load_seconds[name]:.2f}s, "
+                f"RSS +{self._load_rss[name] / 2**20:.1f} MB"
+            )
+            self._check_budget()
+            return instance
+
+    def resident_bytes(self, name: str) -> int:
+        instance = self._instances.get(name)
+        if instance is None:
+            return 0
+        external = getattr(instance, "resident_bytes", None)
+        if callable(external):
+            return self._load_rss.get(name, 0) + external()
+        return self._load_rss.get(name, 0)
+
+    def memory_report(self) -> Dict[str, int]:
+        """Оценка занимаемой памяти по сервисам, байты"""
+        return {name: self.resident_bytes(name) for name in list(self._instances)}
+
+    def total_load_seconds(self, exclude: tuple = ()) -> float:
+        return sum(seconds for name, seconds in self._load_seconds.items() if name not in exclude)
+
+    def _check_budget(self) -> None:
+        if not self.memory_budget:
+            return
+        report = self.memory_report()
+        total = sum(report.values())
+        if total > self.memory_budget:
+            details = ", ".join(f"{name}={size / 2**20:.0f}MB" for name, size in report.items())
+            logger.warning(
+                f"Services exceed memory budget: {total / 2**20:.0f} MB > "
+                f"{self.memory_budget / 2**20:.0f} MB ({details})"
+            )
+
+    def log_memory_report(self) -> None:
+        report = self.memory_report()
+        details = ", ".join(f"{name}={size / 2**20:.1f}MB" for name, size in report.items())
+        logger.info(f"Services memory: {details}")
+        self._check_budget()
@@ -0,0 +1,186 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from .metrics import metrics
+from .text_normalization import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Кэш ответов модели по нормализованному тексту вопроса.
+
+    Ключ включает версию промпта и модели, поэтому их смена автоматически
+    делает старые ответы недоступными. В памяти — LRU с TTL, опционально
+    второй уровень в SQLite, чтобы попадания переживали перезапуск.
+    Новые ответы пишутся на диск пачкой фоновым потоком раз в flush_interval
+    секунд; там же удаляются истёкшие и самые старые строки сверх
+    max_disk_entries.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        max_entries: int = 2000,
+        ttl: float = 86400,
+        disk_path: Optional[Path] = None,
+        max_disk_entries: int = 20000,
+        flush_interval: float = 5.0
+    ):
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        # Ответы, ещё не записанные на диск: key -> (created, response)
+        self._pending: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._db = None
+        if disk_path is not None:
+            self._open_disk(disk_path)
+        if self._db is not None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="response-cache-flush", daemon=True)
+            self._flusher.start()
+
+    def _open_disk(self, path: Path) -> None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            # WAL и synchronous=NORMAL делают запись дешёвой для горячего пути
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, created REAL NOT NULL, response TEXT NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+            self._trim()
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Response cache disk tier disabled: {str(e)}")
+            self._db = None
+
+    def _key(self, text: str) -> Optional[str]:
+        normalized = normalize_text(text)
+        if not normalized:
+            return None
+        return hashlib.sha256(f"{self.version}\n{normalized}".encode("utf-8")).hexdigest()
+
+    def _count(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+            metrics.inc("response_cache_hits_total")
+        else:
+            self.misses += 1
+            metrics.inc("response_cache_misses_total")
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, text: str) -> Optional[str]:
+        key = self._key(text)
+        if key is None:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, response = entry
+                if now - created < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._count(True)
+                    return response
+                del self._entries[key]
+
+            # Вытесненный из памяти ответ может ещё ждать записи на диск
+            row = self._pending.get(key)
+            if row is None and self._db is not None:
+                try:
+                    with self._db_lock:
+                        row = self._db.execute(
+                            "SELECT created, response FROM responses WHERE key = ?", (key,)
+                        ).fetchone()
+                except sqlite3.Error as e:
+                    logger.warning(f"Response cache read error: {str(e)}")
+                    row = None
+            if row is not None and now - row[0] < self.ttl:
+                self._store(key, row[0], row[1])
+                self._count(True)
+                return row[1]
+
+            self._count(False)
+            return None
+
+    def _store(self, key: str, created: float, response: str) -> None:
+        self._entries[key] = (created, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, text: str, response: str) -> None:
+        key = self._key(text)
+        if key is None or not response:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._store(key, now, response)
+            if self._db is not None:
+                self._pending[key] = (now, response)
+
+    def _trim(self) -> None:
+        """Удаление истёкших строк и самых старых сверх max_disk_entries (под _db_lock или при открытии)"""
+        self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        self._db.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+
+    def flush(self) -> int:
+        """Запись накопленных ответов одной транзакцией; возвращает число строк"""
+        with self._lock:
+            if self._db is None or not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+
+        try:
+            with self._db_lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO responses (key, created, response) VALUES (?, ?, ?)",
+                    [(key, created, response) for key, (created, response) in pending.items()]
+                )
+                self._trim()
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache write error: {str(e)}")
+            return 0
+        return len(pending)
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval + 1)
+        self.flush()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
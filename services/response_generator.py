@@ -1,56 +1,122 @@
 import random
-from pathlib import Path
-import json
 import logging
-from typing import List, Optional
+from typing import List, Optional, Tuple
+from config.settings import (
+    CATALOG_BACKEND, CATALOG_DB_PATH, CATALOG_SOURCE, SEARCH_PAGE_SIZE, CARD_CACHE_SIZE,
+    CACHE_DIR, LISTING_IMAGES_DIR
+)
+from .apartment_index import ApartmentIndex
+from .apartment_query import ApartmentQuery, parse_query, parse_search_request
+from .catalog import CatalogPage, SQLiteCatalog, iter_records
+from .listing_cards import CardCache
+from .photo_store import PhotoStore
 
 logger = logging.getLogger(__name__)
 
 class ResponseGenerator:
-    STYLE_EMOJIS = {
-        "luxury": "💎 Люкс",
-        "standard": "🏠 Стандарт",
-        "budget": "💰 Бюджетный вариант"
-    }
-    
     def __init__(self):
-        self.apartments = []
-        self._load_apartments()
-        logger.info(f"ResponseGenerator loaded {len(self.apartments)} apartments")
+        self.version = 1
+        # Готовые карточки по хэшу объявления: горячий путь отправляет строки, а не форматирует их
+        self.cards = CardCache(CARD_CACHE_SIZE)
+        self.photos = PhotoStore(LISTING_IMAGES_DIR, CACHE_DIR / "photos", CACHE_DIR / "photos.sqlite3")
+        self.catalog = self._open_catalog()
+        logger.info(f"ResponseGenerator catalog: {CATALOG_BACKEND}, {len(self.catalog)} apartments")
 
-    def _load_apartments(self):
-        apt_path = Path(__file__).parent.parent / "data" / "apartments.json"
-        if apt_path.exists():
+    def _open_catalog(self):
+        if CATALOG_BACKEND == "memory":
+            return self._build_index()
+        # SQLite: файл источника импортируется, только если изменился с прошлого запуска
+        catalog = SQLiteCatalog(CATALOG_DB_PATH)
+        try:
+            if catalog.sync(CATALOG_SOURCE):
+                self.photos.prepare_all(catalog.image_names())
+        except Exception as e:
+            logger.error(f"🚨 Apartment import error: {str(e)}")
+        return catalog
+
+    def _build_index(self, strict: bool = False) -> ApartmentIndex:
+        index = ApartmentIndex(self._load_apartments(strict))
+        # Карточки рисуются при загрузке; неизменённые объявления берут готовые из кэша
+        rendered = self.cards.prerender(zip(index.hashes, index.apartments))
+        logger.info(f"Catalog ingest: {len(index)} unique listings, {rendered} cards rendered")
+        self.photos.prepare_all(index.image_names())
+        return index
+
+    def _load_apartments(self, strict: bool = False) -> List[dict]:
+        """Объявления из источника; strict (перезагрузка) — ошибки пробрасываются,
+        чтобы битый или недописанный файл не заменил каталог пустым"""
+        apartments = []
+        if CATALOG_SOURCE.exists():
             try:
-                with open(apt_path, 'r', encoding='utf-8') as f:
-                    self.apartments = json.load(f)
-                    logger.info(f"🏢 Loaded {len(self.apartments)} apartments")
+                apartments = list(iter_records(CATALOG_SOURCE))
+                logger.info(f"🏢 Loaded {len(apartments)} apartments")
             except Exception as e:
+                if strict:
+                    raise
                 logger.error(f"🚨 Apartment loading error: {str(e)}")
+        elif strict:
+            raise FileNotFoundError(f"Apartments file not found: {CATALOG_SOURCE}")
         else:
             logger.warning("Apartments file not found")
+        return apartments
 
-    def _format_apartment(self, apt: dict) -> str:
-        style = self.STYLE_EMOJIS.get(apt.get("style", "standard"))
-        features = "\n".join(f"• {feat}" for feat in apt.get("features", []))
-        
-        return (
-            f"{style}\n"
-            f"📍 {apt['address']}\n"
-            f"📏 {apt['area']} м² | 🛏️ {apt['rooms']} комнаты\n"
-            f"💵 {apt['price']:,} руб.{' в месяц' if apt.get('rental', False) else ''}\n\n"
-            f"🔮 Особенности:\n{features}\n\n"
-            f"📝 {apt['description']}\n\n"
-            f"👤 {apt.get('contact', 'Контакты отсутствуют')}"
-        )
+    def reload(self) -> int:
+        """Перечитывает каталог; поиск видит либо старый, либо новый каталог целиком"""
+        if isinstance(self.catalog, SQLiteCatalog):
+            # Импорт идёт одной транзакцией, читатели до коммита видят прежние данные
+            if self.catalog.sync(CATALOG_SOURCE):
+                self.photos.prepare_all(self.catalog.image_names())
+        else:
+            # Индекс строится целиком до замены ссылки
+            self.catalog = self._build_index(strict=True)
+        self.version += 1
+        return self.version
 
     def get_random_apartment(self) -> Optional[str]:
-        if not self.apartments:
+        picked = self.catalog.random()
+        if picked is None:
             return None
-        apt = random.choice(self.apartments)
-        return self._format_apartment(apt)
+        digest, apt, card = picked
+        return self.cards.get(digest, apt, card)
+
+    def parse_query(self, text: str) -> ApartmentQuery:
+        """Фильтры явного поиска: аргументы /search или сообщение с интентом apartment"""
+        return parse_query(text, self.catalog.cities, explicit=True)
 
-    def generate(self, intent: str) -> List[str]:
+    def parse_search_request(self, text: str) -> Optional[ApartmentQuery]:
+        """Фильтры свободного сообщения, если это поиск жилья (см. apartment_query.parse_search_request)"""
+        return parse_search_request(text, self.catalog.cities)
+
+    def search(
+        self,
+        query: ApartmentQuery,
+        after: Optional[int] = None,
+        before: Optional[int] = None
+    ) -> Tuple[str, Optional[CatalogPage]]:
+        """Текст страницы выдачи и сама страница (None — показывать нечего)"""
+        page = self.catalog.page(query, after=after, before=before, limit=SEARCH_PAGE_SIZE)
+        if not page.items:
+            if not page.total and not query.has_filters:
+                return "⛔ К сожалению, у меня нет доступных предложений сейчас.", None
+            if not page.total:
+                return f"😔 Не нашёл квартир по запросу: {query.describe()}\nПопробуйте смягчить условия.", None
+            return "⌛ Эта подборка устарела, повторите поиск: /search", None
+
+        header = "🏙️ Вот актуальные варианты:"
+        if query.has_filters:
+            header = f"🔎 {query.describe()} — найдено {page.total}:"
+        cards = "\n\n➖➖➖➖➖\n\n".join(
+            self.cards.get(digest, apt, card) for digest, apt, card in zip(page.hashes, page.items, page.cards)
+        )
+        return f"{header}\n\n{cards}", page
+
+    def page_photos(self, page: Optional[CatalogPage]) -> list:
+        """(имя, file_id или путь) фотографий квартир страницы"""
+        if page is None:
+            return []
+        return self.photos.album([apt.get("image") for apt in page.items])
+
+    def generate(self, intent: str, text: Optional[str] = None) -> List[str]:
         responses = []
         
         if intent == "greeting":
@@ -74,14 +140,9 @@ class ResponseGenerator:
             responses.append("Отличного дня! Возвращайтесь, когда понадобится недвижимость. 👋")
             
         elif intent == "apartment":
-            if not self.apartments:
-                responses.append("⛔ К сожалению, у меня нет доступных предложений сейчас.")
-                return responses
-                
-            responses.append("🏙️ Вот актуальные варианты:")
-            # Берем максимум 3 случайных квартиры
-            for apt in random.sample(self.apartments, min(3, len(self.apartments))):
-                responses.append(self._format_apartment(apt))
+            # Фильтры из текста сообщения; первая страница выдачи
+            query = self.parse_query(text) if text else ApartmentQuery()
+            responses.append(self.search(query)[0])
                 
         else:  # unknown intent
             return []  # Пустой ответ отправится в AI-обработчик
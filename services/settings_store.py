@@ -0,0 +1,190 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Булевы настройки хранятся битами одного целого: запись пользователя — два числа
+FLAGS = {"ai_mode": 1, "voice_mode": 2}
+DEFAULTS = {"ai_mode": False, "voice_mode": False}
+SCHEMA_VERSION = 1
+
+# (флаги, прочие настройки или None)
+_Record = Tuple[int, Optional[dict]]
+
+
+def _to_record(settings: dict) -> _Record:
+    flags = 0
+    extra = {}
+    for key, value in settings.items():
+        if key in FLAGS:
+            if value:
+                flags |= FLAGS[key]
+        else:
+            extra[key] = value
+    return flags, extra or None
+
+
+def _to_dict(record: _Record) -> dict:
+    flags, extra = record
+    settings = {key: bool(flags & bit) for key, bit in FLAGS.items()}
+    if extra:
+        settings.update(extra)
+    return settings
+
+
+class UserSettingsStore:
+    """Настройки пользователей в SQLite с отложенной записью.
+
+    Запись пользователя загружается при первом обращении и держится в LRU
+    ограниченного размера, поэтому в памяти только активные пользователи.
+    Изменения копятся в памяти и сбрасываются на диск пачкой одной
+    транзакцией фоновым потоком раз в flush_interval секунд и при остановке:
+    обработчик сообщения не ждёт диска.
+    """
+
+    def __init__(self, path: Path, flush_interval: float = 5.0, cache_size: int = 100000,
+                 legacy_json: Optional[Path] = None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[int, _Record]" = OrderedDict()
+        self._dirty: Dict[int, _Record] = {}
+        # Пачка, которая пишется на диск прямо сейчас: до коммита в БД ещё старые значения
+        self._flushing: Dict[int, _Record] = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._stop = threading.Event()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS user_settings ("
+            "user_id INTEGER PRIMARY KEY, flags INTEGER NOT NULL, extra TEXT)"
+        )
+        self._db.commit()
+        if self._db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self._migrate(legacy_json)
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="settings-flush", daemon=True)
+        self._flusher.start()
+
+    def _migrate(self, legacy_json: Optional[Path]) -> None:
+        """Однократный перенос data/user_settings.json"""
+        imported = 0
+        if legacy_json is not None and legacy_json.exists():
+            try:
+                with open(legacy_json, 'r', encoding='utf-8') as f:
+                    legacy = json.load(f)
+                rows = []
+                for user_id, settings in legacy.items():
+                    if not str(user_id).lstrip("-").isdigit() or not isinstance(settings, dict):
+                        continue
+                    flags, extra = _to_record(settings)
+                    rows.append((int(user_id), flags, json.dumps(extra, ensure_ascii=False) if extra else None))
+                self._db.executemany("INSERT OR IGNORE INTO user_settings VALUES (?, ?, ?)", rows)
+                imported = len(rows)
+            except (OSError, ValueError) as e:
+                logger.error(f"User settings migration error: {str(e)}")
+        self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._db.commit()
+        logger.info(f"User settings store initialized, {imported} users migrated")
+
+    def _load(self, user_id: int) -> _Record:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT flags, extra FROM user_settings WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None:
+            return _to_record(DEFAULTS)
+        return row[0], json.loads(row[1]) if row[1] else None
+
+    def _remember(self, user_id: int, record: _Record) -> None:
+        self._cache[user_id] = record
+        self._cache.move_to_end(user_id)
+        # Несохранённые записи лежат в _dirty, поэтому вытеснение из кэша их не теряет
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _record(self, user_id: int) -> _Record:
+        with self._lock:
+            record = self._dirty.get(user_id) or self._flushing.get(user_id) or self._cache.get(user_id)
+            if record is not None:
+                if user_id in self._cache:
+                    self._cache.move_to_end(user_id)
+                return record
+        record = self._load(user_id)
+        with self._lock:
+            # Пока шло чтение, запись могла измениться — изменённая версия главнее
+            current = self._dirty.get(user_id) or self._flushing.get(user_id)
+            if current is not None:
+                return current
+            self._remember(user_id, record)
+        return record
+
+    def get(self, user_id: int) -> dict:
+        return _to_dict(self._record(user_id))
+
+    def set(self, user_id: int, key: str, value) -> None:
+        loaded = self._record(user_id)
+        with self._lock:
+            current = self._dirty.get(user_id) or self._flushing.get(user_id) or self._cache.get(user_id) or loaded
+            settings = _to_dict(current)
+            settings[key] = value
+            record = _to_record(settings)
+            self._dirty[user_id] = record
+            self._remember(user_id, record)
+
+    def flush(self) -> int:
+        """Запись накопленных изменений одной транзакцией; возвращает число пользователей"""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            dirty, self._dirty = self._dirty, {}
+            self._flushing = dirty
+
+        rows = [
+            (user_id, flags, json.dumps(extra, ensure_ascii=False) if extra else None)
+            for user_id, (flags, extra) in dirty.items()
+        ]
+        try:
+            with self._db_lock:
+                self._db.executemany(
+                    "INSERT INTO user_settings (user_id, flags, extra) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET flags = excluded.flags, extra = excluded.extra",
+                    rows
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"User settings flush error: {str(e)}")
+            with self._lock:
+                # Не потерять изменения: более свежие версии из _dirty имеют приоритет
+                for user_id, record in dirty.items():
+                    self._dirty.setdefault(user_id, record)
+                self._flushing = {}
+            return 0
+        with self._lock:
+            self._flushing = {}
+        return len(rows)
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            started = time.perf_counter()
+            flushed = self.flush()
+            if flushed:
+                logger.debug(f"Flushed settings of {flushed} users in {time.perf_counter() - started:.3f}s")
+
+    def close(self) -> None:
+        self._stop.set()
+        self._flusher.join(timeout=self.flush_interval + 1)
+        flushed = self.flush()
+        with self._db_lock:
+            self._db.close()
+        logger.info(f"User settings store closed, {flushed} users flushed")
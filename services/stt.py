@@ -0,0 +1,139 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Формат распознавания: моно 16 кГц, 16 бит
+STT_SAMPLE_RATE = 16000
+STT_SAMPLE_WIDTH = 2
+STT_LANGUAGE = "ru"
+
+
+class STTBackend:
+    """Движок распознавания: PCM (16 кГц, моно, s16le) -> текст или None.
+
+    Движки с моделью в памяти загружают её один раз в конструкторе и должны
+    допускать вызовы из нескольких потоков пула.
+    """
+
+    name = "base"
+
+    def recognize(self, pcm: bytes) -> Optional[str]:
+        raise NotImplementedError
+
+
+class GoogleSTT(STTBackend):
+    """recognize_google из speech_recognition: сетевой вызов, модель не нужна"""
+
+    name = "google"
+
+    def __init__(self):
+        import speech_recognition as sr
+        self._sr = sr
+        self.recognizer = sr.Recognizer()
+
+    def recognize(self, pcm: bytes) -> Optional[str]:
+        audio = self._sr.AudioData(pcm, STT_SAMPLE_RATE, STT_SAMPLE_WIDTH)
+        try:
+            return self.recognizer.recognize_google(audio, language='ru-RU')
+        except self._sr.UnknownValueError:
+            return None
+        except self._sr.RequestError as e:
+            logger.error(f"Ошибка сервиса распознавания: {str(e)}")
+            return None
+
+
+class VoskSTT(STTBackend):
+    """Vosk (Kaldi) на CPU без сети: модель общая, распознаватель на каждое голосовое"""
+
+    name = "vosk"
+
+    def __init__(self, model_path: str):
+        from vosk import Model, KaldiRecognizer, SetLogLevel
+        SetLogLevel(-1)
+        self._recognizer_class = KaldiRecognizer
+        self.model = Model(model_path)
+
+    def recognize(self, pcm: bytes) -> Optional[str]:
+        recognizer = self._recognizer_class(self.model, STT_SAMPLE_RATE)
+        recognizer.AcceptWaveform(pcm)
+        text = json.loads(recognizer.FinalResult()).get("text", "").strip()
+        return text or None
+
+
+class WhisperCppSTT(STTBackend):
+    """whisper.cpp (pywhispercpp) на CPU без сети.
+
+    Контекст модели не потокобезопасен, поэтому модель одна и вызовы идут
+    по очереди, а ядра занимает сам whisper.cpp (n_threads).
+    """
+
+    name = "whisper"
+
+    def __init__(self, model_path: str, n_threads: int = 0):
+        import numpy as np
+        from pywhispercpp.model import Model
+        self._np = np
+        self._lock = threading.Lock()
+        self.model = Model(
+            model_path,
+            n_threads=n_threads or os.cpu_count() or 4,
+            language=STT_LANGUAGE,
+            print_progress=False,
+            print_realtime=False
+        )
+
+    def recognize(self, pcm: bytes) -> Optional[str]:
+        samples = self._np.frombuffer(pcm, dtype=self._np.int16).astype(self._np.float32) / 32768.0
+        with self._lock:
+            segments = self.model.transcribe(samples)
+        text = " ".join(segment.text.strip() for segment in segments).strip()
+        return text or None
+
+
+def create_backend(name: str, model_path: str = "") -> STTBackend:
+    """Движок по имени; офлайн-движок, который не удалось загрузить, заменяется Google"""
+    name = name.lower()
+    try:
+        if name == "vosk":
+            return VoskSTT(model_path)
+        if name == "whisper":
+            return WhisperCppSTT(model_path)
+    except Exception as e:
+        logger.error(f"STT backend {name} is unavailable, falling back to Google: {str(e)}")
+        return GoogleSTT()
+    if name != "google":
+        logger.warning(f"Unknown STT backend {name}, using Google")
+    return GoogleSTT()
+
+
+class STTPool:
+    """Распознавание в пуле потоков.
+
+    Каждое голосовое распознаётся в своём потоке пула, и цикл событий не
+    блокируется; несколько голосовых идут параллельно, по потоку на каждое.
+    """
+
+    def __init__(self, backend: STTBackend, workers: int = 2):
+        self.backend = backend
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stt")
+
+    async def recognize(self, pcm: bytes) -> Optional[str]:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._run, pcm)
+
+    def _run(self, pcm: bytes) -> Optional[str]:
+        started = time.perf_counter()
+        text = self.backend.recognize(pcm)
+        metrics.observe("stt_seconds", time.perf_counter() - started)
+        metrics.inc("stt_requests_total")
+        return text
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
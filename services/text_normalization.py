@@ -0,0 +1,17 @@
+import re
+from typing import List
+
+_PUNCT_REGEX = re.compile(r"[^\w\s]+", flags=re.UNICODE)
+_SPACE_REGEX = re.compile(r"\s+")
+_WORD_REGEX = re.compile(r"\w+", flags=re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    """Приведение текста к каноническому виду: регистр, ё/е, пунктуация, пробелы"""
+    text = text.lower().replace("ё", "е")
+    text = _PUNCT_REGEX.sub(" ", text)
+    return _SPACE_REGEX.sub(" ", text).strip()
+
+
+def tokenize(text: str) -> List[str]:
+    return _WORD_REGEX.findall(text.lower().replace("ё", "е"))
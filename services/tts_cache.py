@@ -0,0 +1,205 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TTSCache:
+    """Синтезированная речь по хэшу очищенного текста, языка и голоса.
+
+    Аудио лежит на диске файлами <ключ>.<формат>, общий объём ограничен:
+    при переполнении удаляются давно не использованные файлы. После первой
+    отправки запоминается file_id Telegram — повторный ответ уходит без
+    синтеза и без загрузки, даже если файл уже вытеснен с диска.
+
+    file_id тоже ограничены: в SQLite — не больше max_file_ids самых недавно
+    использованных, в памяти — LRU из memory_file_ids, остальные читаются из
+    базы при обращении.
+    """
+
+    # Время использования file_id в базе обновляется не чаще раза в час
+    TOUCH_INTERVAL = 3600
+    # Лишние строки базы удаляются раз в столько новых file_id
+    TRIM_EVERY = 100
+
+    def __init__(self, cache_dir: Path, max_bytes: int, db_path: Path, audio_format: str = "mp3",
+                 max_file_ids: int = 50000, memory_file_ids: int = 5000):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.audio_format = audio_format
+        self.max_file_ids = max_file_ids
+        self.memory_file_ids = memory_file_ids
+        self._lock = threading.Lock()
+        # ключ -> размер файла; порядок — от давно использованных к недавним
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        # ключ -> (file_id, время использования, записанное в базе)
+        self._file_ids: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._remembered = 0
+        self._db = None
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._scan()
+        self._open_db(db_path)
+
+    def key(self, text: str, lang: str, voice: str) -> str:
+        # Формат входит в ключ: file_id файла другого формата не подходит
+        return hashlib.sha256(f"{self.audio_format}\0{lang}\0{voice}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.{self.audio_format}"
+
+    def _scan(self) -> None:
+        """Файлы с прошлых запусков; время изменения обновляется при каждом попадании"""
+        entries = []
+        for path in self.cache_dir.glob(f"*.{self.audio_format}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._files[key] = size
+            self._total += size
+        metrics.set_gauge("tts_cache_bytes", self._total)
+
+    def _open_db(self, path: Path) -> None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS voice_ids ("
+                "key TEXT PRIMARY KEY, file_id TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS voice_ids_updated ON voice_ids (updated)")
+            self._trim_file_ids()
+            self._db.commit()
+            # В память — только самые недавние; порядок LRU — от старых к новым
+            rows = self._db.execute(
+                "SELECT key, file_id, updated FROM voice_ids ORDER BY updated DESC LIMIT ?", (self.memory_file_ids,)
+            ).fetchall()
+            for key, file_id, updated in reversed(rows):
+                self._file_ids[key] = (file_id, updated)
+        except sqlite3.Error as e:
+            logger.error(f"Voice file_id store disabled: {str(e)}")
+            self._db = None
+
+    def _trim_file_ids(self) -> None:
+        self._db.execute(
+            "DELETE FROM voice_ids WHERE key IN ("
+            "SELECT key FROM voice_ids ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+            (self.max_file_ids,)
+        )
+
+    def _cache_file_id(self, key: str, file_id: str, updated: float) -> None:
+        self._file_ids[key] = (file_id, updated)
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > self.memory_file_ids:
+            self._file_ids.popitem(last=False)
+
+    def file_id(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._file_ids.get(key)
+            if entry is None and self._db is not None:
+                try:
+                    row = self._db.execute("SELECT file_id, updated FROM voice_ids WHERE key = ?", (key,)).fetchone()
+                except sqlite3.Error as e:
+                    logger.warning(f"Voice file_id read error: {str(e)}")
+                    row = None
+                entry = tuple(row) if row else None
+            if entry is None:
+                return None
+            file_id, updated = entry
+            if now - updated > self.TOUCH_INTERVAL and self._db is not None:
+                # Используемые file_id не должны вытесняться из базы как давние
+                try:
+                    self._db.execute("UPDATE voice_ids SET updated = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    updated = now
+                except sqlite3.Error as e:
+                    logger.warning(f"Voice file_id write error: {str(e)}")
+            self._cache_file_id(key, file_id, updated)
+        metrics.inc("tts_cache_file_id_hits_total")
+        return file_id
+
+    def get(self, key: str) -> Optional[Path]:
+        path = self._path(key)
+        with self._lock:
+            if key not in self._files:
+                metrics.inc("tts_cache_misses_total")
+                return None
+            self._files.move_to_end(key)
+        try:
+            os.utime(path)
+        except OSError:
+            # Файл удалили снаружи — считаем промахом
+            with self._lock:
+                self._total -= self._files.pop(key, 0)
+            metrics.inc("tts_cache_misses_total")
+            return None
+        metrics.inc("tts_cache_hits_total")
+        return path
+
+    def put(self, key: str, data: bytes) -> Path:
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+        with self._lock:
+            self._total += len(data) - self._files.pop(key, 0)
+            self._files[key] = len(data)
+            evicted = []
+            while self._total > self.max_bytes and len(self._files) > 1:
+                old_key, size = self._files.popitem(last=False)
+                self._total -= size
+                evicted.append(old_key)
+            metrics.set_gauge("tts_cache_bytes", self._total)
+        for old_key in evicted:
+            try:
+                self._path(old_key).unlink()
+            except OSError:
+                pass
+        if evicted:
+            metrics.inc("tts_cache_evictions_total", len(evicted))
+        return path
+
+    def remember(self, key: str, file_id: str) -> None:
+        now = time.time()
+        with self._lock:
+            entry = self._file_ids.get(key)
+            if entry is not None and entry[0] == file_id:
+                return
+            self._cache_file_id(key, file_id, now)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO voice_ids (key, file_id, updated) VALUES (?, ?, ?)",
+                        (key, file_id, now)
+                    )
+                    self._remembered += 1
+                    if self._remembered % self.TRIM_EVERY == 0:
+                        self._trim_file_ids()
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"Voice file_id write error: {str(e)}")
+
+    def forget(self, key: str) -> None:
+        """file_id отклонён Telegram — следующая отправка загрузит файл заново"""
+        with self._lock:
+            self._file_ids.pop(key, None)
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM voice_ids WHERE key = ?", (key,))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"Voice file_id write error: {str(e)}")
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка внутри пользователя.
+
+    Обновления разных пользователей обрабатываются одновременно (не больше
+    max_concurrent_updates), а обновления одного пользователя — строго по
+    очереди и в порядке поступления: второе сообщение не обгонит первое,
+    пока то ждёт модель или ffmpeg. Очередь пользователя ждёт своей очереди
+    до захвата общего слота, поэтому не занимает слоты других пользователей.
+
+    Команды и нажатия кнопок быстрые и упорядочены в своей отдельной очереди:
+    /ai_mode или "Далее" не ждут конца генерации. Новое сообщение до
+    постановки в очередь вызывает on_message(user_id) — так отменяется
+    устаревший запрос к модели, конца которого сообщение иначе бы ждало.
+    """
+
+    def __init__(self, max_concurrent_updates: int, on_message: Optional[Callable[[int], None]] = None):
+        super().__init__(max_concurrent_updates)
+        self.on_message = on_message
+        # ключ -> [замок, число обновлений в работе и в ожидании]
+        self._locks: Dict[Hashable, list] = {}
+
+    @staticmethod
+    def _is_message(update: Update) -> bool:
+        """Текст или голосовое пользователя, а не команда и не нажатие кнопки"""
+        message = update.message
+        if message is None:
+            return False
+        return message.voice is not None or (bool(message.text) and not message.text.startswith("/"))
+
+    @classmethod
+    def _key(cls, update: object) -> Optional[Hashable]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            key = update.effective_user.id
+        elif update.effective_chat is not None:
+            key = ("chat", update.effective_chat.id)
+        else:
+            return None
+        return key if cls._is_message(update) else ("control", key)
+
+    async def process_update(self, update: object, coroutine: Awaitable) -> None:
+        key = self._key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        if self.on_message is not None and isinstance(key, int):
+            try:
+                self.on_message(key)
+            except Exception as e:
+                logger.error(f"Stale request cancellation failed: {str(e)}")
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        metrics.set_gauge("updates_active_users", len(self._locks))
+        try:
+            # asyncio.Lock пропускает ожидающих в порядке прихода
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+            metrics.set_gauge("updates_active_users", len(self._locks))
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
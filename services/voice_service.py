@@ -1,85 +1,214 @@
-import os
+import asyncio
+import io
 import re
 import logging
-from pathlib import Path
-from datetime import datetime
-from typing import Optional
-import speech_recognition as sr
+import time
+from typing import AsyncIterator, List, Optional, Sequence, Tuple, Union
 from gtts import gTTS
-import subprocess
+from config.settings import (
+    TTS_CACHE_DIR, TTS_CACHE_MAX_MB, TTS_CACHE_MAX_FILE_IDS, FFMPEG_MAX_PROCESSES, STT_BACKEND, STT_MODEL_PATH,
+    STT_WORKERS, TTS_FIRST_CHUNK_CHARS, TTS_CHUNK_CHARS, TTS_MAX_PARALLEL
+)
+from .metrics import metrics
+from .stt import STTPool, STT_SAMPLE_RATE, create_backend
+from .tts_cache import TTSCache
 
 logger = logging.getLogger(__name__)
 
+TTS_LANG = "ru"
+# Голос gTTS: домен Google Translate, через который идёт синтез
+TTS_VOICE = "gtts:com"
+# Граница предложения или строки (пункты карточки объявления идут без точек)
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def _wrap(sentence: str, limit: int) -> List[str]:
+    """Слишком длинное предложение режется по пробелам"""
+    pieces = []
+    while len(sentence) > limit:
+        cut = sentence.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+        pieces.append(sentence[:cut].strip())
+        sentence = sentence[cut:].strip()
+    if sentence:
+        pieces.append(sentence)
+    return pieces
+
+
+def split_sentences(text: str, first_limit: int, limit: int) -> List[str]:
+    """Куски текста по границам предложений: первый короткий, чтобы первая
+    голосовая была готова быстро, остальные — до limit символов"""
+    chunks = []
+    current = ""
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        for piece in _wrap(" ".join(sentence.split()), first_limit):
+            cap = first_limit if not chunks else limit
+            if current and len(current) + 1 + len(piece) > cap:
+                chunks.append(current)
+                current = piece
+            else:
+                current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class FFmpegError(RuntimeError):
+    """ffmpeg завершился с ошибкой"""
+
+
 class VoiceService:
+    """Синтез и распознавание речи без временных файлов.
+
+    Аудио идёт через память: голосовое сообщение скачивается в буфер,
+    ffmpeg читает его из stdin и пишет результат в stdout. Число
+    одновременных процессов ffmpeg ограничено, синтез gTTS выполняется в
+    потоке, а распознавание — в пуле движка STT (services.stt).
+    """
+
     def __init__(self):
-        self.recognizer = sr.Recognizer()
         self.emoji_regex = re.compile(r"[\U00010000-\U0010ffff]", flags=re.UNICODE)
         self.clean_regex = re.compile(r'[^\w\s,.?!-]')
+        # Голосовые Telegram — OGG/Opus: такой файл показывается как голосовое, а не как аудио
+        self.tts_cache = TTSCache(
+            TTS_CACHE_DIR, TTS_CACHE_MAX_MB * 1024 * 1024, TTS_CACHE_DIR / "voice_ids.sqlite3", audio_format="ogg",
+            max_file_ids=TTS_CACHE_MAX_FILE_IDS
+        )
+        self._ffmpeg_slots = asyncio.Semaphore(FFMPEG_MAX_PROCESSES)
+        self._tts_slots = asyncio.Semaphore(TTS_MAX_PARALLEL)
+        # Модель офлайн-движка загружается один раз и остаётся в памяти
+        self.stt = STTPool(create_backend(STT_BACKEND, STT_MODEL_PATH), workers=STT_WORKERS)
+        logger.info(f"Speech recognition backend: {self.stt.backend.name}")
 
     def clean_text(self, text: str) -> str:
-        """Удаление эмодзи и спецсимволов"""
-        cleaned = re.sub(self.emoji_regex, '', text)
-        return re.sub(self.clean_regex, '', cleaned)
+        """Удаление эмодзи и спецсимволов; переводы строк сохраняются как границы фраз"""
+        cleaned = re.sub(self.clean_regex, '', re.sub(self.emoji_regex, '', text))
+        return "\n".join(" ".join(line.split()) for line in cleaned.splitlines() if line.strip())
+
+    async def _ffmpeg(self, args: Sequence[str], data: bytes, operation: str) -> bytes:
+        """Преобразование аудио в памяти: вход в stdin, результат из stdout"""
+        async with self._ffmpeg_slots:
+            started = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-hide_banner", "-loglevel", "error", *args,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            output, errors = await process.communicate(data)
+            metrics.observe("ffmpeg_seconds", time.perf_counter() - started, {"operation": operation})
+        if process.returncode != 0:
+            raise FFmpegError(errors.decode("utf-8", "replace").strip()[-300:] or f"exit code {process.returncode}")
+        return output
+
+    async def to_voice(self, mp3: bytes) -> bytes:
+        """MP3 -> OGG/Opus для send_voice"""
+        return await self._ffmpeg(
+            ["-f", "mp3", "-i", "pipe:0", "-ac", "1", "-c:a", "libopus", "-b:a", "32k", "-f", "ogg", "pipe:1"], mp3, "to_voice"
+        )
+
+    async def to_pcm(self, audio: bytes) -> bytes:
+        """Любой вход ffmpeg (OGG/Opus из Telegram) -> 16-битный PCM моно 16 кГц"""
+        return await self._ffmpeg(
+            ["-i", "pipe:0", "-ac", "1", "-ar", str(STT_SAMPLE_RATE), "-f", "s16le", "pipe:1"], audio, "to_pcm"
+        )
+
+    def _synthesize(self, text: str) -> bytes:
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=TTS_LANG, tld=TTS_VOICE.split(":")[1], slow=False).write_to_fp(buffer)
+        return buffer.getvalue()
+
+    async def _synthesize_chunk(self, text: str) -> bytes:
+        async with self._tts_slots:
+            started = time.perf_counter()
+            mp3 = await asyncio.to_thread(self._synthesize, text)
+            metrics.observe("tts_chunk_seconds", time.perf_counter() - started)
+            return mp3
+
+    async def _voice(self, chunks: List[str]) -> Optional[Tuple[str, Union[str, bytes]]]:
+        """Одна голосовая из нескольких кусков: куски синтезируются параллельно,
+        MP3-потоки склеиваются и за один проход ffmpeg превращаются в OGG/Opus"""
+        text = " ".join(chunks)
+        key = self.tts_cache.key(text, TTS_LANG, TTS_VOICE)
+        # Кэш читает и пишет SQLite и диск — в потоке, чтобы не блокировать цикл событий
+        file_id = await asyncio.to_thread(self.tts_cache.file_id, key)
+        if file_id:
+            return key, file_id
+        audio = await self.cached_audio(key)
+        if audio is not None:
+            return key, audio
 
-    def text_to_speech(self, text: str, user_id: int) -> Optional[str]:
+        started = time.perf_counter()
         try:
-            # Создаем временную директорию
-            temp_dir = Path("temp") / "voices"
-            temp_dir.mkdir(parents=True, exist_ok=True)
-            
-            # Генерируем уникальное имя файла
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            voice_path = temp_dir / f"voice_{user_id}_{timestamp}.ogg"
-            
-            # Очищаем текст
-            clean_text = self.clean_text(text)
-            if not clean_text or len(clean_text) < 3:
-                return None
-
-            # Синтез речи
-            tts = gTTS(text=clean_text[:300], lang='ru', slow=False)
-            tts.save(str(voice_path))
-            return str(voice_path)
+            # MP3 состоит из независимых кадров, поэтому потоки кусков склеиваются подряд
+            mp3 = b"".join(await asyncio.gather(*(self._synthesize_chunk(chunk) for chunk in chunks)))
+            voice = await self.to_voice(mp3)
+        except FFmpegError as e:
+            logger.error(f"Ошибка конвертации аудио: {str(e)}")
+            return None
         except Exception as e:
             logger.error(f"Ошибка синтеза речи: {str(e)}", exc_info=True)
             return None
+        metrics.observe("tts_seconds", time.perf_counter() - started)
+        await asyncio.to_thread(self.tts_cache.put, key, voice)
+        return key, voice
+
+    async def text_to_speech(self, text: str) -> AsyncIterator[Tuple[str, Union[str, bytes]]]:
+        """Голосовые для ответа: (ключ кэша, file_id Telegram или OGG/Opus).
+
+        Текст озвучивается целиком, без обрезки. Первая голосовая — первое
+        предложение, её можно отправить, пока синтезируется остальной текст,
+        который приходит второй голосовой. Повторяющиеся ответы (приветствия,
+        карточки объявлений) синтезируются один раз: дальше отдаётся file_id
+        или аудио из кэша.
+        """
+        clean_text = self.clean_text(text)
+        if not clean_text or len(clean_text) < 3:
+            return
 
-    def speech_to_text(self, ogg_path: str) -> Optional[str]:
+        chunks = split_sentences(clean_text, TTS_FIRST_CHUNK_CHARS, TTS_CHUNK_CHARS)
+        parts = [chunks[:1], chunks[1:]] if len(chunks) > 1 else [chunks]
+        tasks = [asyncio.create_task(self._voice(part)) for part in parts]
         try:
-            # Создаем временную директорию для конвертированных файлов
-            temp_dir = Path("temp") / "audio"
-            temp_dir.mkdir(parents=True, exist_ok=True)
-            
-            # Конвертация в WAV (требуется для speech_recognition)
-            wav_path = temp_dir / f"{Path(ogg_path).stem}.wav"
-            
-            # Используем ffmpeg для конвертации
-            subprocess.run(
-                ['ffmpeg', '-y', '-i', str(ogg_path), str(wav_path)],
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-            
-            # Распознавание речи
-            with sr.AudioFile(str(wav_path)) as source:
-                audio = self.recognizer.record(source)
-                text = self.recognizer.recognize_google(audio, language='ru-RU')
-                return text
-        except sr.UnknownValueError:
-            logger.warning("Не удалось распознать речь в аудио")
-        except sr.RequestError as e:
-            logger.error(f"Ошибка сервиса распознавания: {str(e)}")
-        except subprocess.CalledProcessError as e:
+            for task in tasks:
+                voice = await task
+                if voice is None:
+                    return
+                yield voice
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def cached_audio(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._read_cached_audio, key)
+
+    def _read_cached_audio(self, key: str) -> Optional[bytes]:
+        path = self.tts_cache.get(key)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except OSError:
+            return None
+
+    async def remember_voice(self, key: str, file_id: str) -> None:
+        await asyncio.to_thread(self.tts_cache.remember, key, file_id)
+
+    async def forget_voice(self, key: str) -> None:
+        await asyncio.to_thread(self.tts_cache.forget, key)
+
+    async def speech_to_text(self, audio: bytes) -> Optional[str]:
+        """Распознавание голосового сообщения, скачанного в память"""
+        try:
+            pcm = await self.to_pcm(audio)
+            with metrics.timer("speech_to_text_seconds", {"backend": self.stt.backend.name}):
+                text = await self.stt.recognize(pcm)
+            if not text:
+                logger.warning("Не удалось распознать речь в аудио")
+            return text
+        except FFmpegError as e:
             logger.error(f"Ошибка конвертации аудио: {str(e)}")
         except Exception as e:
             logger.error(f"Необработанная ошибка в speech_to_text: {str(e)}", exc_info=True)
-        finally:
-            # Удаляем временные файлы
-            for path in [ogg_path, wav_path]:
-                if path and Path(path).exists():
-                    try:
-                        Path(path).unlink()
-                    except:
-                        pass
         return None
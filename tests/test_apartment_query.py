@@ -0,0 +1,55 @@
+import pytest
+
+from services.apartment_query import parse_query, parse_search_request
+
+CITIES = ("Москва", "Казань")
+
+
+@pytest.mark.parametrize("text", [
+    "как оформить ипотеку?",
+    "что лучше: аренда или ипотека?",
+    "посоветуй район для аренды",
+    "у меня бюджет 5к",
+    "сколько стоит ремонт 50 м2",
+    "приду до 18 часов",
+    "расскажи про москву",
+])
+def test_questions_without_a_listing_are_not_searches(text):
+    assert parse_search_request(text, CITIES) is None
+
+
+def test_money_in_thousands_is_not_a_room_count():
+    query = parse_query("у меня бюджет 5к", CITIES, explicit=True)
+    assert query.rooms is None
+    assert query.price == (None, 5000)
+
+
+@pytest.mark.parametrize("text, rooms", [
+    ("2 комнаты", 2),
+    ("2-х комнатная", 2),
+    ("3 комн", 3),
+    ("2-к", 2),
+    ("2к квартира", 2),
+    ("двушка", 2),
+])
+def test_room_counts(text, rooms):
+    assert parse_query(text, CITIES).rooms == (rooms, rooms)
+
+
+def test_listing_with_filters_is_a_search():
+    query = parse_search_request("сниму 2к квартиру в москве до 50к в месяц", CITIES)
+    assert query is not None
+    assert query.city == "Москва"
+    assert query.rooms == (2, 2)
+    assert query.price == (None, 50000)
+    assert query.rental is True
+
+
+def test_room_count_alone_marks_a_listing():
+    query = parse_search_request("2-к в Казани до 8 млн", CITIES)
+    assert query is not None
+    assert query.price == (None, 8_000_000)
+
+
+def test_listing_word_without_filters_is_not_a_search():
+    assert parse_search_request("квартира", CITIES) is None
@@ -0,0 +1,79 @@
+import random
+from collections import Counter
+
+from services.apartment_query import ApartmentQuery
+from services.catalog import SQLiteCatalog
+
+
+def listing(number: int, price: int, rooms: int = 1) -> dict:
+    return {"address": f"Москва, улица {number}", "price": price, "area": 30 + number, "rooms": rooms}
+
+
+def make_catalog(tmp_path, records) -> SQLiteCatalog:
+    catalog = SQLiteCatalog(tmp_path / "catalog.sqlite3")
+    catalog.import_records(records)
+    return catalog
+
+
+def walk_forward(catalog: SQLiteCatalog, query: ApartmentQuery, limit: int) -> list:
+    pages = [catalog.page(query, limit=limit)]
+    while pages[-1].has_next:
+        pages.append(catalog.page(query, after=pages[-1].ids[-1], limit=limit))
+    return pages
+
+
+def test_pages_cover_ties_on_the_sort_key_exactly_once(tmp_path):
+    # По 4 квартиры на каждую цену: граница страницы проходит внутри группы равных цен
+    catalog = make_catalog(tmp_path, [listing(i, price=(i // 4) * 1_000_000) for i in range(22)])
+    pages = walk_forward(catalog, ApartmentQuery(), limit=3)
+
+    ids = [row_id for page in pages for row_id in page.ids]
+    prices = [item["price"] for page in pages for item in page.items]
+    assert len(ids) == len(set(ids)) == 22
+    assert prices == sorted(prices)
+    assert all(page.total == 22 for page in pages)
+
+
+def test_last_page_has_no_next(tmp_path):
+    catalog = make_catalog(tmp_path, [listing(i, price=1_000_000) for i in range(7)])
+    pages = walk_forward(catalog, ApartmentQuery(), limit=3)
+
+    assert [len(page.ids) for page in pages] == [3, 3, 1]
+    assert not pages[0].has_prev
+    assert pages[-1].has_prev and not pages[-1].has_next
+    assert catalog.page(ApartmentQuery(), after=pages[-1].ids[-1], limit=3).ids == []
+
+
+def test_backward_pages_mirror_forward_pages(tmp_path):
+    catalog = make_catalog(tmp_path, [listing(i, price=(i % 3) * 1_000_000) for i in range(10)])
+    query = ApartmentQuery(sort="-price")
+    pages = walk_forward(catalog, query, limit=3)
+
+    for previous, current in zip(pages, pages[1:]):
+        back = catalog.page(query, before=current.ids[0], limit=3)
+        assert back.ids == previous.ids
+        assert back.has_next
+
+
+def test_filtered_pages_stay_within_the_filter(tmp_path):
+    records = [listing(i, price=i * 100_000, rooms=1 + i % 3) for i in range(30)]
+    catalog = make_catalog(tmp_path, records)
+    pages = walk_forward(catalog, ApartmentQuery(rooms=(2, 2)), limit=4)
+
+    assert [item["rooms"] for page in pages for item in page.items] == [2] * 10
+
+
+def test_random_is_uniform_despite_id_gaps(tmp_path):
+    records = [listing(i, price=1_000_000 + i) for i in range(20)]
+    catalog = make_catalog(tmp_path, records)
+    # Удаление середины оставляет дыру в id: случайный id из диапазона чаще попадал бы на квартиру после неё
+    catalog.import_records(records[:1] + records[10:])
+    random.seed(1)
+    counts = Counter(catalog.random()[1]["address"] for _ in range(2200))
+
+    assert len(counts) == 11
+    assert max(counts.values()) < 2 * 2200 / 11
+
+
+def test_random_on_empty_catalog(tmp_path):
+    assert SQLiteCatalog(tmp_path / "catalog.sqlite3").random() is None
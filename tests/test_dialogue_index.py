@@ -0,0 +1,139 @@
+import math
+import os
+from collections import Counter
+
+import pytest
+
+from benchmarks.bench_intent_matcher import DATA_PATH
+from services.dialogue_index import DialogueIndex, iter_dialogue_pairs
+from services.text_normalization import normalize_text, tokenize
+
+CORPUS = DATA_PATH / "my_dialogues.txt"
+
+
+def brute_force_scores(pairs, query, max_postings):
+    """BM25 перебором всех реплик; в каждом термине — только max_postings лучших документов, как в индексе"""
+    docs = [(tokenize(human), reply) for human, reply in pairs]
+    docs = [(terms, reply) for terms, reply in docs if terms]
+    n_docs = len(docs)
+    avg_length = sum(len(terms) for terms, _ in docs) / n_docs
+    terms = set(tokenize(query))
+    doc_freq = Counter(term for doc_terms, _ in docs for term in set(doc_terms))
+    ideal = 0.0
+    scores = [0.0] * n_docs
+    for term in terms:
+        if not doc_freq[term]:
+            ideal += math.log(1 + n_docs)
+            continue
+        idf = math.log(1 + (n_docs - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+        ideal += idf
+        impacts = []
+        for doc_id, (doc_terms, _) in enumerate(docs):
+            tf = doc_terms.count(term)
+            if tf:
+                norm = DialogueIndex.K1 * (1 - DialogueIndex.B + DialogueIndex.B * len(doc_terms) / avg_length)
+                impacts.append((idf * tf * (DialogueIndex.K1 + 1) / (tf + norm), doc_id))
+        impacts.sort(key=lambda item: (-item[0], item[1]))
+        for impact, doc_id in impacts[:max_postings]:
+            scores[doc_id] += impact
+    exact = next((doc_id for doc_id, (human, _) in enumerate(pairs) if normalize_text(human) == normalize_text(query)), None)
+    if exact is not None:
+        scores[exact] = max(scores[exact], ideal) + ideal
+    return [(score / ideal, reply) for score, (_, reply) in zip(scores, docs)]
+
+
+def queries(pairs):
+    humans = [human for human, _ in pairs]
+    # Реплики целиком (точное совпадение) и их обрывки (только BM25)
+    return humans[::7] + [" ".join(human.split()[:2]) for human in humans[::5]]
+
+
+@pytest.mark.parametrize("max_postings", [1000, 3])
+def test_index_agrees_with_brute_force(max_postings):
+    pairs = [pair for pair in iter_dialogue_pairs(CORPUS) if tokenize(pair[0])]
+    index = DialogueIndex.build(iter(pairs), max_postings=max_postings)
+    for query in queries(pairs):
+        results = index.search(query, k=1)
+        expected = [item for item in brute_force_scores(pairs, query, max_postings) if item[0] > 0]
+        if not expected:
+            assert results == []
+            continue
+        top = max(score for score, _ in expected)
+        score, reply = results[0]
+        assert score == pytest.approx(top, rel=1e-5), query
+        # При равных оценках годится любой из лучших ответов
+        assert reply in {reply for value, reply in expected if value == pytest.approx(top, rel=1e-5)}, query
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    source = tmp_path / "dialogues.txt"
+    source.write_text("H: привет\nB: Здравствуйте!\nH: ищу квартиру\nB: Какой район?\n", encoding="utf-8")
+    return source
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    calls = []
+    original = DialogueIndex.build.__func__
+
+    def counting_build(cls, pairs, max_postings=1000):
+        calls.append(max_postings)
+        return original(cls, pairs, max_postings)
+
+    monkeypatch.setattr(DialogueIndex, "build", classmethod(counting_build))
+    return calls
+
+
+def test_unchanged_corpus_is_loaded_from_cache(corpus, tmp_path, builds):
+    cache = tmp_path / "index.pickle"
+    DialogueIndex.load_or_build(corpus, cache)
+    index = DialogueIndex.load_or_build(corpus, cache)
+    assert len(builds) == 1
+    assert index.best("привет", 0.5) == "Здравствуйте!"
+
+
+def test_touched_corpus_with_same_content_is_not_rebuilt(corpus, tmp_path, builds):
+    cache = tmp_path / "index.pickle"
+    DialogueIndex.load_or_build(corpus, cache)
+    stat = corpus.stat()
+    os.utime(corpus, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    DialogueIndex.load_or_build(corpus, cache)
+    assert len(builds) == 1
+
+
+def test_changed_size_rebuilds(corpus, tmp_path, builds):
+    cache = tmp_path / "index.pickle"
+    DialogueIndex.load_or_build(corpus, cache)
+    with open(corpus, 'a', encoding='utf-8') as f:
+        f.write("H: пока\nB: До встречи!\n")
+    index = DialogueIndex.load_or_build(corpus, cache)
+    assert len(builds) == 2
+    assert index.best("пока", 0.5) == "До встречи!"
+
+
+def test_same_size_different_content_rebuilds(corpus, tmp_path, builds):
+    cache = tmp_path / "index.pickle"
+    DialogueIndex.load_or_build(corpus, cache)
+    stat = corpus.stat()
+    corpus.write_text(corpus.read_text(encoding="utf-8").replace("Какой район?", "Какой город?"), encoding="utf-8")
+    assert corpus.stat().st_size == stat.st_size
+    os.utime(corpus, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    index = DialogueIndex.load_or_build(corpus, cache)
+    assert len(builds) == 2
+    assert index.best("ищу квартиру", 0.5) == "Какой город?"
+
+
+def test_cache_for_other_postings_limit_is_rejected(corpus, tmp_path, builds):
+    cache = tmp_path / "index.pickle"
+    DialogueIndex.load_or_build(corpus, cache, max_postings=1000)
+    DialogueIndex.load_or_build(corpus, cache, max_postings=10)
+    assert builds == [1000, 10]
+
+
+def test_corrupt_cache_is_rebuilt(corpus, tmp_path, builds):
+    cache = tmp_path / "index.pickle"
+    cache.write_bytes(b"not a pickle")
+    index = DialogueIndex.load_or_build(corpus, cache)
+    assert len(builds) == 1
+    assert len(index) == 2
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from benchmarks.bench_intent_matcher import DATA_PATH, load_messages, loop_match
+from services.intent_matcher import AhoCorasick, IntentMatcher
+
+
+@pytest.fixture(scope="module")
+def intents():
+    with open(DATA_PATH / "intents.json", 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_automaton_finds_overlapping_patterns():
+    automaton = AhoCorasick()
+    for pattern in ("he", "she", "his", "hers"):
+        automaton.add(pattern, pattern)
+    automaton.build()
+
+    found = sorted((end, value) for end, _, value in automaton.iter_matches("ushers"))
+    assert found == [(3, "he"), (3, "she"), (5, "hers")]
+
+
+def test_longest_example_wins(intents):
+    matcher = IntentMatcher(intents)
+    assert matcher.match("привет, ищу квартиру") == ("apartment", "ищу квартиру")
+
+
+def test_equal_length_resolved_by_intent_order():
+    text = "день и ночь"
+    assert IntentMatcher({"first": ["день"], "second": ["ночь"]}).match(text) == ("first", "день")
+    assert IntentMatcher({"second": ["ночь"], "first": ["день"]}).match(text) == ("second", "ночь")
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("хай всем", "greeting"),
+    ("отдыхай", None),
+    ("суперквартира", None),
+    # Основа "квартир" совпадает с началом слова в любом падеже
+    ("покажите квартиры", "apartment"),
+])
+def test_examples_start_on_a_word_boundary(intents, text, intent):
+    match = IntentMatcher(intents).match(text)
+    assert (match[0] if match else None) == intent
+
+
+def test_agrees_with_the_example_loop_on_data_phrases(intents):
+    matcher = IntentMatcher(intents)
+    phrases = load_messages() + [example for examples in intents.values() for example in examples]
+    for text in phrases:
+        match = matcher.match(text)
+        assert (match[0] if match else None) == loop_match(intents, text), text
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from services.llm_scheduler import LLMScheduler, RequestCancelled, SchedulerBusy
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout=5))
+
+
+def gated_stream(started: list, label: str, gate: asyncio.Event = None, closed: list = None):
+    """Фабрика потока: отмечает старт генерации, отдаёт метку и, если задан gate, ждёт его"""
+
+    async def stream():
+        started.append(label)
+        try:
+            yield label
+            if gate is not None:
+                await gate.wait()
+        finally:
+            if closed is not None:
+                closed.append(label)
+
+    return stream
+
+
+async def collect(scheduler: LLMScheduler, user_id, make_stream) -> list:
+    return [delta async for delta in scheduler.stream(user_id, make_stream)]
+
+
+async def settle():
+    # Даём задачам дойти до очереди планировщика
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_users_are_served_round_robin():
+    async def scenario():
+        scheduler = LLMScheduler(concurrency=1, max_queue=16, cancel_stale=False)
+        started, gate = [], asyncio.Event()
+        blocker = asyncio.create_task(collect(scheduler, "x", gated_stream(started, "x", gate)))
+        await settle()
+
+        tasks = []
+        for user_id, label in (("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"), ("c", "c1")):
+            tasks.append(asyncio.create_task(collect(scheduler, user_id, gated_stream(started, label))))
+            await settle()
+        assert scheduler.queue_depth == 5
+
+        gate.set()
+        await asyncio.gather(blocker, *tasks)
+        return started
+
+    assert run(scenario()) == ["x", "a1", "b1", "c1", "a2", "a3"]
+
+
+def test_full_queue_rejects_new_requests():
+    async def scenario():
+        scheduler = LLMScheduler(concurrency=1, max_queue=2, cancel_stale=False)
+        started, gate = [], asyncio.Event()
+        blocker = asyncio.create_task(collect(scheduler, "x", gated_stream(started, "x", gate)))
+        await settle()
+        queued = [asyncio.create_task(collect(scheduler, user_id, gated_stream(started, user_id))) for user_id in "ab"]
+        await settle()
+
+        with pytest.raises(SchedulerBusy):
+            await collect(scheduler, "c", gated_stream(started, "c"))
+        depth = scheduler.queue_depth
+
+        gate.set()
+        await asyncio.gather(blocker, *queued)
+        return depth, started
+
+    depth, started = run(scenario())
+    assert depth == 2
+    assert "c" not in started
+
+
+def test_cancel_removes_a_queued_request():
+    async def scenario():
+        scheduler = LLMScheduler(concurrency=1)
+        started, gate = [], asyncio.Event()
+        blocker = asyncio.create_task(collect(scheduler, "x", gated_stream(started, "x", gate)))
+        await settle()
+        queued = asyncio.create_task(collect(scheduler, "a", gated_stream(started, "a")))
+        await settle()
+
+        scheduler.cancel("a")
+        with pytest.raises(RequestCancelled):
+            await queued
+        depth = scheduler.queue_depth
+
+        gate.set()
+        await blocker
+        return depth, started
+
+    depth, started = run(scenario())
+    assert depth == 0
+    assert started == ["x"]
+
+
+def test_new_request_replaces_the_queued_one():
+    async def scenario():
+        scheduler = LLMScheduler(concurrency=1)
+        started, gate = [], asyncio.Event()
+        blocker = asyncio.create_task(collect(scheduler, "x", gated_stream(started, "x", gate)))
+        await settle()
+        stale = asyncio.create_task(collect(scheduler, "a", gated_stream(started, "a1")))
+        await settle()
+        fresh = asyncio.create_task(collect(scheduler, "a", gated_stream(started, "a2")))
+        await settle()
+
+        gate.set()
+        results = await asyncio.gather(blocker, stale, fresh, return_exceptions=True)
+        return results, started
+
+    results, started = run(scenario())
+    assert isinstance(results[1], RequestCancelled)
+    assert results[2] == ["a2"]
+    assert started == ["x", "a2"]
+
+
+def test_cancel_interrupts_a_running_generation():
+    async def scenario():
+        scheduler = LLMScheduler(concurrency=1)
+        started, closed, gate = [], [], asyncio.Event()
+        received = []
+
+        async def consume():
+            async for delta in scheduler.stream("a", gated_stream(started, "a", gate, closed)):
+                received.append(delta)
+
+        running = asyncio.create_task(consume())
+        await settle()
+        assert received == ["a"]
+
+        scheduler.cancel("a")
+        with pytest.raises(RequestCancelled):
+            await running
+        # Модель освобождена: следующий запрос выполняется сразу
+        after = await collect(scheduler, "b", gated_stream(started, "b"))
+        return received, closed, after
+
+    received, closed, after = run(scenario())
+    assert received == ["a"]
+    assert closed == ["a"]
+    assert after == ["b"]
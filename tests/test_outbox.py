@@ -0,0 +1,134 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+from services import outbox as outbox_module
+from services.outbox import Outbox, PRIORITY_INTERACTIVE, PRIORITY_RECOMMENDATION, split_text
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, text: str):
+        self.message_id = message_id
+        self.text = text
+
+
+class FakeBot:
+    """Записывает вызовы send_message; первые failures вызовов отвечают RetryAfter"""
+
+    def __init__(self, failures: int = 0, retry_after: float = 0.05):
+        self.sent = []
+        self.failures = failures
+        self.retry_after = retry_after
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise RetryAfter(self.retry_after)
+        self.sent.append((chat_id, text))
+        return FakeMessage(len(self.sent), text)
+
+
+def fast_outbox(**kwargs) -> Outbox:
+    params = dict(chat_rate=1000.0, chat_burst=1000, group_rate=1000.0, global_rate=1000.0)
+    params.update(kwargs)
+    return Outbox(**params)
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout=5))
+
+
+def test_split_text_keeps_paragraphs_within_limit():
+    parts = split_text("a" * 6 + "\n\n" + "b" * 6, limit=10)
+    assert parts == ["a" * 6, "b" * 6]
+
+
+def test_messages_of_a_chat_keep_their_order():
+    async def scenario():
+        bot = FakeBot()
+        outbox = fast_outbox()
+        futures = [outbox.send_message(bot, 1, str(i), coalesce=False) for i in range(20)]
+        await asyncio.gather(*futures)
+        return bot.sent
+
+    assert run(scenario()) == [(1, str(i)) for i in range(20)]
+
+
+def test_interactive_messages_overtake_queued_recommendations():
+    async def scenario():
+        bot = FakeBot()
+        outbox = fast_outbox()
+        futures = [
+            outbox.send_message(bot, 1, "recommendation", priority=PRIORITY_RECOMMENDATION, coalesce=False),
+            outbox.send_message(bot, 1, "answer", priority=PRIORITY_INTERACTIVE, coalesce=False),
+        ]
+        await asyncio.gather(*futures)
+        return [text for _, text in bot.sent]
+
+    assert run(scenario()) == ["answer", "recommendation"]
+
+
+def test_queued_texts_are_coalesced_into_one_message():
+    async def scenario():
+        bot = FakeBot()
+        outbox = fast_outbox()
+        futures = [outbox.send_message(bot, 1, text) for text in ("one", "two", "three")]
+        messages = await asyncio.gather(*futures)
+        return bot.sent, messages
+
+    sent, messages = run(scenario())
+    assert sent == [(1, "one\n\ntwo\n\nthree")]
+    assert all(message is messages[0] for message in messages)
+
+
+def test_coalescing_respects_the_length_limit():
+    async def scenario():
+        bot = FakeBot()
+        outbox = fast_outbox(max_length=10)
+        await asyncio.gather(*(outbox.send_message(bot, 1, text) for text in ("aaaa", "bbbb", "cccc")))
+        return [text for _, text in bot.sent]
+
+    assert run(scenario()) == ["aaaa\n\nbbbb", "cccc"]
+
+
+def test_retry_after_pauses_the_chat_and_resends():
+    async def scenario():
+        bot = FakeBot(failures=2, retry_after=0.05)
+        outbox = fast_outbox()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        message = await outbox.send_message(bot, 1, "hello")
+        return bot.sent, message, loop.time() - started
+
+    sent, message, elapsed = run(scenario())
+    assert sent == [(1, "hello")]
+    assert message.text == "hello"
+    assert elapsed >= 0.1
+
+
+def test_retry_after_gives_up_after_max_retries():
+    async def scenario():
+        bot = FakeBot(failures=10, retry_after=0.01)
+        outbox = fast_outbox(max_retries=2)
+        try:
+            await outbox.send_message(bot, 1, "hello")
+        except RetryAfter:
+            return bot.sent
+        raise AssertionError("RetryAfter was not raised")
+
+    assert run(scenario()) == []
+
+
+def test_idle_chat_buckets_are_swept(monkeypatch):
+    monkeypatch.setattr(outbox_module, "BUCKET_SWEEP_INTERVAL", 0.0)
+
+    async def scenario():
+        bot = FakeBot()
+        outbox = fast_outbox(chat_burst=1)
+        await asyncio.gather(*(outbox.send_message(bot, chat_id, "hi") for chat_id in range(1, 501)))
+        # Вёдра заполняются за 1 мс; новый чат запускает чистку
+        await asyncio.sleep(0.01)
+        await outbox.send_message(bot, 1000, "hi")
+        return len(outbox._buckets)
+
+    assert run(scenario()) <= 2
@@ -0,0 +1,16 @@
+import importlib
+
+registry_module = importlib.import_module("services.registry")
+
+
+def test_nested_service_is_not_counted_twice(monkeypatch):
+    # RSS: до внешней фабрики, до вложенной, после вложенной, после внешней
+    readings = iter([100, 100, 400, 500])
+    monkeypatch.setattr(registry_module, "process_rss_bytes", lambda pid=None: next(readings))
+    registry = registry_module.ServiceRegistry()
+    registry.register("ml_service", lambda: "model")
+    registry.register("intent_classifier", lambda: ("classifier", registry.get("ml_service"))[0])
+
+    assert registry.get("intent_classifier") == "classifier"
+    assert registry.is_loaded("ml_service")
+    assert registry.memory_report() == {"ml_service": 300, "intent_classifier": 100}
@@ -0,0 +1,124 @@
+import importlib
+import sqlite3
+import time
+
+import pytest
+
+from services.response_cache import ResponseCache
+
+response_cache_module = importlib.import_module("services.response_cache")
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache_module, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def open_cache(tmp_path):
+    caches = []
+
+    def factory(version="v1", disk=True, **kwargs):
+        # Фоновый сброс — только там, где тест задаёт flush_interval сам
+        kwargs.setdefault("flush_interval", 3600)
+        cache = ResponseCache(version, disk_path=tmp_path / "responses.sqlite3" if disk else None, **kwargs)
+        caches.append(cache)
+        return cache
+
+    yield factory
+    for cache in caches:
+        cache.close()
+
+
+def disk_rows(tmp_path) -> int:
+    with sqlite3.connect(str(tmp_path / "responses.sqlite3")) as db:
+        return db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+def test_key_ignores_case_punctuation_and_spaces(open_cache):
+    cache = open_cache(disk=False)
+    cache.put("Сколько стоит  квартира?", "дорого")
+    assert cache.get("сколько стоит квартира") == "дорого"
+    assert cache.get("сколько стоит дом") is None
+    assert cache.hits == 1 and cache.misses == 1
+
+
+def test_empty_text_is_not_cached(open_cache):
+    cache = open_cache(disk=False)
+    cache.put("?!", "ответ")
+    assert cache.get("?!") is None
+    assert cache.misses == 0
+
+
+def test_version_bump_misses_old_entries(open_cache):
+    old = open_cache("prompt-1")
+    old.put("привет", "старый ответ")
+    old.close()
+
+    assert open_cache("prompt-2").get("привет") is None
+    assert open_cache("prompt-1").get("привет") == "старый ответ"
+
+
+def test_entries_expire_after_ttl(open_cache, clock):
+    cache = open_cache(ttl=60)
+    cache.put("привет", "ответ")
+    cache.flush()
+    clock.now += 59
+    assert cache.get("привет") == "ответ"
+    clock.now += 2
+    # Устаревший ответ не отдаётся ни из памяти, ни с диска
+    assert cache.get("привет") is None
+
+
+def test_memory_tier_is_an_lru(open_cache):
+    cache = open_cache(disk=False, max_entries=2)
+    for text in ("один", "два", "три"):
+        cache.put(text, text.upper())
+    assert cache.get("один") is None
+    assert cache.get("три") == "ТРИ"
+
+
+def test_evicted_entries_come_back_from_disk(open_cache, tmp_path):
+    cache = open_cache(max_entries=1)
+    cache.put("один", "1")
+    cache.put("два", "2")
+    # Ещё не записан на диск, но уже вытеснен из памяти
+    assert cache.get("один") == "1"
+    assert cache.flush() == 2
+    cache.put("три", "3")
+    assert cache.get("два") == "2"
+    assert disk_rows(tmp_path) == 2
+
+
+def test_background_thread_flushes_to_disk(open_cache, tmp_path):
+    cache = open_cache(flush_interval=0.01)
+    cache.put("привет", "ответ")
+    deadline = time.monotonic() + 2
+    while disk_rows(tmp_path) == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert disk_rows(tmp_path) == 1
+
+
+def test_flush_trims_expired_and_oldest_rows(open_cache, clock, tmp_path):
+    cache = open_cache(ttl=100, max_disk_entries=2)
+    cache.put("старый", "0")
+    cache.flush()
+    clock.now += 150
+    for text in ("один", "два", "три"):
+        clock.now += 1
+        cache.put(text, text)
+    cache.flush()
+
+    with sqlite3.connect(str(tmp_path / "responses.sqlite3")) as db:
+        kept = sorted(row[0] for row in db.execute("SELECT response FROM responses"))
+    assert kept == ["два", "три"]
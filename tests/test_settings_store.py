@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from services.settings_store import DEFAULTS, UserSettingsStore, _to_dict, _to_record
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    stores = []
+
+    def factory(**kwargs):
+        # Фоновый сброс не должен вмешиваться в тест: пишем только явным flush/close
+        kwargs.setdefault("flush_interval", 3600)
+        store = UserSettingsStore(tmp_path / "settings.sqlite3", **kwargs)
+        stores.append(store)
+        return store
+
+    yield factory
+    for store in stores:
+        if not store._stop.is_set():
+            store.close()
+
+
+def test_flags_are_packed_into_bits():
+    record = _to_record({"ai_mode": True, "voice_mode": True, "language": "en"})
+    assert record == (3, {"language": "en"})
+    assert _to_dict(record) == {"ai_mode": True, "voice_mode": True, "language": "en"}
+    assert _to_record({"ai_mode": False, "voice_mode": True}) == (2, None)
+
+
+def test_unknown_user_gets_defaults(open_store):
+    assert open_store().get(42) == DEFAULTS
+
+
+def test_set_survives_flush_and_reopen(open_store):
+    store = open_store()
+    store.set(1, "voice_mode", True)
+    store.set(1, "language", "en")
+    assert store.flush() == 1
+    store.close()
+
+    assert open_store().get(1) == {"ai_mode": False, "voice_mode": True, "language": "en"}
+
+
+def test_close_flushes_pending_changes(open_store):
+    store = open_store()
+    store.set(7, "ai_mode", True)
+    store.close()
+
+    assert open_store().get(7)["ai_mode"] is True
+
+
+def test_evicted_dirty_records_are_not_lost(open_store):
+    store = open_store(cache_size=2)
+    for user_id in range(1, 6):
+        store.set(user_id, "ai_mode", True)
+    assert len(store._cache) == 2
+    # Вытесненная из LRU, но не записанная настройка берётся из очереди записи
+    assert store.get(1)["ai_mode"] is True
+
+    assert store.flush() == 5
+    store._cache.clear()
+    assert all(store.get(user_id)["ai_mode"] for user_id in range(1, 6))
+
+
+def test_legacy_json_migration_keeps_every_field(open_store, tmp_path):
+    legacy = {
+        "101": {"ai_mode": True, "voice_mode": False},
+        "102": {"voice_mode": True, "language": "en", "last_search": {"city": "Москва"}},
+        "-1003": {"ai_mode": True, "voice_mode": True},
+        "not-a-user": {"ai_mode": True},
+    }
+    legacy_path = tmp_path / "user_settings.json"
+    legacy_path.write_text(json.dumps(legacy, ensure_ascii=False), encoding="utf-8")
+
+    store = open_store(legacy_json=legacy_path)
+    assert store.get(101) == {"ai_mode": True, "voice_mode": False}
+    assert store.get(102) == {"ai_mode": False, "voice_mode": True, "language": "en", "last_search": {"city": "Москва"}}
+    assert store.get(-1003) == {"ai_mode": True, "voice_mode": True}
+    store.set(101, "ai_mode", False)
+    store.close()
+
+    # Миграция однократная: повторный запуск не затирает изменения старым файлом
+    reopened = open_store(legacy_json=legacy_path)
+    assert reopened.get(101)["ai_mode"] is False